@@ -15,6 +15,7 @@ for f in *.rst; do
     pywwt.rst|\
     pywwt.annotation_.rst|\
     pywwt.app.rst|\
+    pywwt.coordinates.rst|\
     pywwt.core.rst|\
     pywwt.data_server.rst|\
     pywwt.imagery.rst|\
@@ -23,9 +24,12 @@ for f in *.rst; do
     pywwt.jupyter.rst|\
     pywwt.jupyter_server.rst|\
     pywwt.layers.rst|\
+    pywwt.lod.rst|\
     pywwt.logger.rst|\
     pywwt.qt.rst|\
     pywwt.solar_system.rst|\
+    pywwt.table_encoding.rst|\
+    pywwt.table_files.rst|\
     pywwt.traits.rst|\
     pywwt.utils.rst|\
     pywwt.windows.rst|\
@@ -197,7 +197,11 @@ class WWTModel extends widgets.DOMWidgetModel {
     // instance, if the client were to issue a data-request message and we
     // routed it to multiple views, we'd get multiple responses, with no
     // sensible way to know which to prefer.
-    processIpyWidgetsMessage(msg) {
+    //
+    // Some messages, such as binary-encoded table data, come with binary
+    // buffers attached. These are relayed to the app in the message's
+    // `buffers` field.
+    processIpyWidgetsMessage(msg, buffers) {
         if (this._currentView === null) {
             // We could queue up messages here. The kernel "shouldn't" send us
             // any messages until a view is ready, but it's always possible that
@@ -206,6 +210,15 @@ class WWTModel extends widgets.DOMWidgetModel {
             return;
         }
 
+        // The kernel may bundle up several messages to save round trips; see
+        // BaseWWTWidget.batch(). These never have binary buffers attached.
+        if (msg['type'] == 'pywwt_batch') {
+            for (const submsg of msg['messages']) {
+                this.processIpyWidgetsMessage(submsg, []);
+            }
+            return;
+        }
+
         // The "official" implementation here is in
         // @wwtelescope/research-app-messages in
         // classic_pywwt.applyBaseUrlIfApplicable.
@@ -226,6 +239,12 @@ class WWTModel extends widgets.DOMWidgetModel {
             msg['threadId'] = this.model_id + "|" + msg['threadId'];
         }
 
+        if (buffers && buffers.length) {
+            msg['buffers'] = buffers.map(function (b) {
+                return b.buffer.slice(b.byteOffset, b.byteOffset + b.byteLength);
+            });
+        }
+
         this._currentView.relayIpyWidgetsMessage(msg);
     }
 
@@ -88,6 +88,17 @@ def pytest_unconfigure(config):
 
 REFERENCE_TIME = datetime(2017, 2, 1, 0, 0, 0, 0)
 
+
+@pytest.fixture(autouse=True)
+def tile_cache(tmp_path, monkeypatch):
+    # Keep the tests' images out of the user's own tile cache
+    from . import tile_cache
+
+    cache = tile_cache.TileCache(tmp_path / "tile-cache")
+    monkeypatch.setattr(tile_cache, "_tile_cache", cache)
+    return cache
+
+
 if QT_INSTALLED:
     def _check_app_available():
         import os.path
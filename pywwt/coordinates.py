@@ -0,0 +1,131 @@
+# Copyright 2021 the .NET Foundation
+# Licensed under the three-clause BSD License
+
+"""
+Vectorized preprocessing of point positions for table layers.
+
+Simulation snapshots can have tens of millions of particles, so positions are
+converted and packed with whole-array operations, writing into preallocated
+output arrays rather than creating a temporary array for every step.
+"""
+
+import numpy as np
+from astropy import units as u
+
+__all__ = ["pack_xyz", "xyz_to_spherical"]
+
+
+def _values_and_unit(values):
+    """
+    Split array-like *values* into a plain array of their data, with masked
+    values set to NaN, and their unit (or None).
+    """
+    if isinstance(values, u.Quantity):
+        return values.value, values.unit
+
+    unit = getattr(values, "unit", None)
+    mask = np.ma.getmask(values)
+    data = np.asarray(np.ma.getdata(values))
+
+    if mask is not np.ma.nomask and mask.any():
+        data = np.where(mask, np.nan, data)
+
+    return data, unit
+
+
+def pack_xyz(x, y, z, unit=None, dtype=np.float32):
+    """
+    Pack x/y/z positions into a single array of ``(x, y, z)`` triplets.
+
+    Parameters
+    ----------
+    x, y, z : array-like
+        The positions. These can be table columns or
+        :class:`~astropy.units.Quantity` arrays with units of distance, in
+        which case they are converted to *unit*. Masked values become NaN.
+    unit : :class:`~astropy.units.Unit`, optional
+        The unit of the packed positions. Positions without units are assumed
+        to be in this unit already.
+    dtype : dtype, optional
+        The type of the packed positions. Single-precision floats keep
+        positions to within a ten-millionth of the largest distance, which is
+        plenty for display.
+
+    Returns
+    -------
+    packed : :class:`~numpy.ndarray`
+        A C-contiguous array of shape ``(n, 3)``.
+
+    Raises
+    ------
+    :exc:`~astropy.units.UnitConversionError`
+        If the units of some of the positions can't be converted to *unit*.
+    """
+    packed = np.empty((len(x), 3), dtype=dtype)
+
+    for index, values in enumerate((x, y, z)):
+        data, values_unit = _values_and_unit(values)
+
+        if values_unit is not None and unit is not None:
+            factor = values_unit.to(unit)
+        else:
+            factor = 1.0
+
+        # This converts the values to the output type as it goes, without a
+        # temporary array.
+        np.multiply(data, factor, out=packed[:, index], casting="unsafe")
+
+    return packed
+
+
+def xyz_to_spherical(x, y, z):
+    """
+    Convert rectangular positions to spherical coordinates.
+
+    Parameters
+    ----------
+    x, y, z : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`
+        The positions. Quantities are converted to the unit of the first of
+        them.
+
+    Returns
+    -------
+    lon : :class:`~numpy.ndarray`
+        The longitudes, in degrees, between -180 and 180.
+    lat : :class:`~numpy.ndarray`
+        The latitudes, in degrees.
+    distance : :class:`~numpy.ndarray` or :class:`~astropy.units.Quantity`
+        The distances from the origin, in the units of the positions. This is
+        a quantity if the positions are.
+
+    Raises
+    ------
+    :exc:`~astropy.units.UnitConversionError`
+        If the units of the positions can't be converted to each other.
+    """
+    unit = None
+    arrays = []
+
+    for values in (x, y, z):
+        if isinstance(values, u.Quantity):
+            if unit is None:
+                unit = values.unit
+            values = values.to_value(unit)
+
+        arrays.append(np.asarray(values, dtype=float))
+
+    x, y, z = arrays
+
+    # Each step writes into the array that it was given, to keep the number of
+    # full-size temporary arrays down.
+    rho = np.hypot(x, y)
+    lat = np.arctan2(z, rho)
+    distance = np.hypot(rho, z, out=rho)
+    lon = np.arctan2(y, x)
+    np.degrees(lon, out=lon)
+    np.degrees(lat, out=lat)
+
+    if unit is not None:
+        distance = u.Quantity(distance, unit, copy=False)
+
+    return lon, lat, distance
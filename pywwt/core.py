@@ -10,6 +10,7 @@ different backends supported by pywwt.
 """
 
 import asyncio
+from contextlib import contextmanager
 import json
 import os
 import shutil
@@ -28,6 +29,7 @@ from .instruments import Instruments
 from .layers import LayerManager
 from .logger import logger
 from .solar_system import SolarSystem
+from .table_encoding import compression_available
 from .traits import Color, Bool, Float, Unicode, AstropyQuantity
 from .utils import ensure_utc
 
@@ -39,6 +41,23 @@ __all__ = [
 
 DEFAULT_SURVEYS_URL = "https://worldwidetelescope.github.io/pywwt/surveys.xml"
 
+# Messages that set a single value, mapped to the message fields identifying
+# that value. If several of these are sent to the same value during a batch,
+# with no other kinds of messages in between, only the last one needs to be
+# sent, in the place of the first.
+COLLAPSIBLE_EVENTS = {
+    "setting_set": ("setting",),
+    "table_layer_set": ("id", "setting"),
+    "image_layer_set": ("id", "setting"),
+    "image_layer_cmap": ("id",),
+    "image_layer_stretch": ("id",),
+    "annotation_set": ("id", "setting"),
+}
+
+# The number of pieces of a large upload (see ``BaseWWTWidget._send_upload``)
+# that can be waiting to be acknowledged by the app at any one time.
+UPLOAD_MAX_IN_FLIGHT = 4
+
 VIEW_MODES_2D = [
     "sky",
     "sun",
@@ -138,6 +157,8 @@ class BaseWWTWidget(HasTraits):
     """
 
     _startupMessageQueue = None
+    _batchMessages = None
+    _batchKeys = None
     _appAlive = False
     _readyFuture = None
     _readinessAchieved = False
@@ -151,6 +172,17 @@ class BaseWWTWidget(HasTraits):
     _systemTime = Time("2017-03-09T12:30:00", format="isot")
     _timeRate = 1.0
 
+    # Capabilities of the message transport and the app. Subclasses whose
+    # ``_actually_send_msg`` can attach binary buffers to messages should set
+    # ``_supports_binary_buffers``. The app tells us about any table encodings
+    # beyond the baseline CSV that it can decode, the compression methods that
+    # it can decompress them with, and any optional table layer protocol
+    # features that it supports, in its application state messages.
+    _supports_binary_buffers = False
+    _app_table_encodings = ()
+    _app_table_features = ()
+    _app_table_compressions = ()
+
     def __init__(self, hide_all_chrome=False, surveys_url=None):
         """
         (Note that this docstring is not exposed in the API docs. It is aimed at
@@ -185,6 +217,7 @@ class BaseWWTWidget(HasTraits):
         self._startupMessageQueue = []
         self._seqNum = 0
         self._futures = {}
+        self._last_upload = None
 
         self._available_layers = get_imagery_layers(surveys_url or DEFAULT_SURVEYS_URL)
         self._available_hips_catalog_names = []
@@ -198,6 +231,9 @@ class BaseWWTWidget(HasTraits):
         self._annotation_set = set()
         self._callbacks = {}
 
+        # Internal hooks, called with no arguments when the view changes
+        self._view_state_listeners = []
+
         if hide_all_chrome:
             self._send_msg(
                 event="modify_settings",
@@ -295,19 +331,193 @@ class BaseWWTWidget(HasTraits):
         self._seqNum += 1
         return str(self._seqNum)
 
-    def _send_msg(self, **kwargs):
+    def _send_msg(self, buffers=None, **kwargs):
+        """
+        Send a message to the app. The keyword arguments form the JSON message.
+        If *buffers* is given, it should be a list of bytes-like objects to be
+        attached to the message; this is only allowed if the transport supports
+        it, as indicated by ``_supports_binary_buffers``.
+        """
+        if buffers and not self._supports_binary_buffers:
+            raise ValueError("this WWT client cannot send binary message buffers")
+
+        if self._batchMessages is not None:
+            self._add_to_batch(kwargs, buffers)
+        elif self._startupMessageQueue is not None:
+            self._startupMessageQueue.append((kwargs, buffers))
+        elif self._appAlive:
+            self._actually_send_msg(kwargs, buffers=buffers)
+        else:
+            raise ViewerNotAvailableError()
+
+    def _add_to_batch(self, msg, buffers):
+        """
+        Add a message to the current batch. If it supersedes an earlier
+        message that was sent since the last message of another kind, it takes
+        that message's place. Other messages, such as those sending data, are
+        barriers, since later settings can depend on them (for instance, a
+        colormap column that they create).
+        """
+        event = msg.get("event")
+        fields = COLLAPSIBLE_EVENTS.get(event)
+
+        if fields is not None:
+            key = (event,) + tuple(msg.get(f) for f in fields)
+            index = self._batchKeys.get(key)
+
+            if index is not None:
+                self._batchMessages[index] = (msg, buffers)
+                return
+
+            self._batchKeys[key] = len(self._batchMessages)
+        else:
+            self._batchKeys.clear()
+
+        self._batchMessages.append((msg, buffers))
+
+    def _flush_batch(self):
+        """
+        Send the messages collected so far in the current batch, if there is
+        one. This is used when sending large amounts of data in pieces, so that
+        the pieces don't all have to be held in memory until the batch ends.
+        """
+        if self._batchMessages is None:
+            return
+
+        messages = self._batchMessages
+        self._batchMessages = []
+        self._batchKeys = {}
+        self._send_batch(messages)
+
+    def _send_batch(self, messages):
+        """
+        Send a list of ``(msg, buffers)`` tuples collected during a batch.
+        """
+        if not messages:
+            return
+
         if self._startupMessageQueue is not None:
-            self._startupMessageQueue.append(kwargs)
+            self._startupMessageQueue.extend(messages)
         elif self._appAlive:
-            self._actually_send_msg(kwargs)
+            self._actually_send_msgs(messages)
         else:
             raise ViewerNotAvailableError()
 
-    def _send_into_future(self, timeout=30, **kwargs):
+    def _supports_table_encoding(self, encoding):
+        """
+        Determine whether we can send table data to the app using the named
+        encoding. The baseline CSV encoding is always supported.
+        """
+        if encoding == "csv":
+            return True
+
+        if encoding == "binary" and not self._supports_binary_buffers:
+            return False
+
+        return encoding in self._app_table_encodings
+
+    def _supports_table_compression(self, method):
+        """
+        Determine whether we can send table data to the app compressed using
+        the named method.
+        """
+        return method in self._app_table_compressions and compression_available(
+            method
+        )
+
+    def _supports_table_feature(self, feature):
+        """
+        Determine whether the app supports an optional extension of the table
+        layer messaging protocol, such as ``"append"``.
+        """
+        return feature in self._app_table_features
+
+    def _send_upload(self, messages, progress=None):
+        """
+        Send a list of ``(msg, buffers)`` tuples holding the pieces of a large
+        upload, such as the data of a big table layer.
+
+        If there is a running event loop, the pieces are sent in the
+        background, each one asking the app to acknowledge it, with at most
+        ``UPLOAD_MAX_IN_FLIGHT`` of them waiting to be acknowledged at once.
+        This way, the message transport is never flooded, and other messages
+        can be sent and received in the meantime. Uploads are sent one after
+        another, in the order in which they were started. This returns the
+        asyncio Task sending the upload, which can be cancelled to abandon it.
+
+        Otherwise, or if the app isn't ready yet, the pieces are sent straight
+        away, and this returns None.
+
+        If *progress* is given, it is called with the number of pieces that
+        have been sent (and acknowledged, if possible) after each one.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if (
+            loop is None
+            or self._startupMessageQueue is not None
+            or self._batchMessages is not None
+        ):
+            for index, (msg, buffers) in enumerate(messages):
+                self._send_msg(buffers=buffers, **msg)
+                self._flush_batch()
+
+                if progress is not None:
+                    progress(index + 1)
+
+            return None
+
+        previous = self._last_upload
+        task = loop.create_task(self._upload(messages, progress, previous))
+        self._last_upload = task
+        return task
+
+    async def _upload(self, messages, progress, previous):
+        if previous is not None and not previous.done():
+            # Wait for the previous upload to finish, however it finishes.
+            await asyncio.wait([previous])
+
+        in_flight = set()
+        n_done = 0
+
+        try:
+            for msg, buffers in messages:
+                while len(in_flight) >= UPLOAD_MAX_IN_FLIGHT:
+                    done, in_flight = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED
+                    )
+
+                    for fut in done:
+                        fut.result()
+                        n_done += 1
+
+                        if progress is not None:
+                            progress(n_done)
+
+                in_flight.add(self._send_into_future(buffers=buffers, **msg))
+
+            for fut in in_flight:
+                await fut
+                n_done += 1
+
+                if progress is not None:
+                    progress(n_done)
+        except Exception:
+            # Nothing is waiting for this task, so report the problem here.
+            logger.exception("failed to upload data to the WWT app")
+        finally:
+            if self._last_upload is asyncio.current_task():
+                self._last_upload = None
+
+    def _send_into_future(self, timeout=30, buffers=None, **kwargs):
         """
         Send a message and return an asyncio Future that will resolve when the
         message receives a reply from the app. The value of the future will be
-        the full JSON message received.
+        the full JSON message received. If the reply carried any binary
+        message buffers, they are given as a list in its ``"buffers"`` field.
 
         This interface leverages the WWT messaging convention that messages
         which receive replies will have a field named `threadId` that will be
@@ -317,20 +527,26 @@ class BaseWWTWidget(HasTraits):
         By default, the future will timeout eventually. The timeout parameter is
         measured in seconds. If it's ``None``, no timeout will be applied.
         """
+        if self._batchMessages is not None:
+            # The message wouldn't be sent until the batch ends, so whoever
+            # is waiting for the reply inside the batch would wait forever.
+            raise RuntimeError("cannot wait for a reply from WWT inside a batch")
 
         seq = self._next_seq()
         loop = asyncio.get_running_loop()
         fut = loop.create_future()
 
         self._futures[seq] = fut
-        self._send_msg(threadId=seq, **kwargs)
+        self._send_msg(threadId=seq, buffers=buffers, **kwargs)
+
+        # If whoever is waiting for the reply gives up on it, stop tracking it.
+        fut.add_done_callback(lambda fut: self._futures.pop(seq, None))
 
         if timeout is not None:
 
             def maybe_time_it_out():
                 if not fut.done():
                     fut.set_exception(asyncio.TimeoutError())
-                    del self._futures[seq]
 
             loop.call_later(timeout, maybe_time_it_out)
 
@@ -356,16 +572,15 @@ class BaseWWTWidget(HasTraits):
             if alive and self._startupMessageQueue:
                 queue = self._startupMessageQueue
                 self._startupMessageQueue = None
+                self._actually_send_msgs(queue)
 
-                for msg in queue:
-                    self._actually_send_msg(msg)
-
-    def _on_app_message_received(self, payload):
+    def _on_app_message_received(self, payload, buffers=None):
         """
         Call this function when a message is received from the research app.
         This will generally happen in some kind of asynchronous event handler,
         so there is no guarantee that exceptions raised here will be exposed to
-        the user.
+        the user. Subclasses whose transport can carry binary message buffers
+        should pass them as *buffers*.
         """
 
         ptype = payload.get("type")
@@ -384,12 +599,35 @@ class BaseWWTWidget(HasTraits):
                 self._timeRate = float(payload["engineClockRateFactor"])
             except ValueError:
                 pass  # report a warning somehow?
+            else:
+                for listener in list(self._view_state_listeners):
+                    try:
+                        listener()
+                    except:  # noqa: E722
+                        logger.exception(
+                            "unhandled Python exception in a view state listener"
+                        )
         elif ptype == "wwt_application_state":
             hipscat = payload.get("hipsCatalogNames")
 
             if hipscat is not None:
                 self._available_hips_catalog_names = hipscat
 
+            encodings = payload.get("tableEncodings")
+
+            if encodings is not None:
+                self._app_table_encodings = tuple(encodings)
+
+            compressions = payload.get("tableCompressions")
+
+            if compressions is not None:
+                self._app_table_compressions = tuple(compressions)
+
+            features = payload.get("tableLayerFeatures")
+
+            if features is not None:
+                self._app_table_features = tuple(features)
+
         elif ptype == "wwt_selection_state":
             most_recent = payload.get("mostRecentSource")
             sources = payload.get("selectedSources")
@@ -412,7 +650,10 @@ class BaseWWTWidget(HasTraits):
             except KeyError:
                 pass
             else:
-                fut.set_result(payload)
+                if buffers:
+                    payload = dict(payload, buffers=list(buffers))
+                if not fut.done():
+                    fut.set_result(payload)
 
         # Any client-side callbacks to execute?
 
@@ -467,13 +708,24 @@ class BaseWWTWidget(HasTraits):
 
     # Support methods that can/should be overridden by subclasses:
 
-    def _actually_send_msg(self, payload):
+    def _actually_send_msg(self, payload, buffers=None):
         """
         Note that the API here is different than ``_send_msg``: we take a dict,
-        not ``**kwargs``.
+        not ``**kwargs``. The *buffers* will only be non-empty if the subclass
+        sets ``_supports_binary_buffers``.
         """
         raise NotImplementedError()
 
+    def _actually_send_msgs(self, messages):
+        """
+        Send several messages to the app at once. *messages* is a list of
+        ``(payload, buffers)`` tuples. Subclasses can override this if their
+        transport can deliver a group of messages more efficiently than one at
+        a time.
+        """
+        for payload, buffers in messages:
+            self._actually_send_msg(payload, buffers=buffers)
+
     def _serve_file(self, filename, extension=""):
         """
         Publish a single file in a web server, for use by the WWT frontend.
@@ -981,9 +1233,50 @@ class BaseWWTWidget(HasTraits):
         self.center_on_coordinates(gc, 60 * u.deg)
 
         # Reset only traits with the wwt_reset tag
-        for trait_name, trait in self.traits().items():
-            if trait.metadata.get("wwt_reset"):
-                setattr(self, trait_name, trait.default_value)
+        with self.batch():
+            for trait_name, trait in self.traits().items():
+                if trait.metadata.get("wwt_reset"):
+                    setattr(self, trait_name, trait.default_value)
+
+    @contextmanager
+    def batch(self):
+        """
+        Batch up the messages sent to WWT.
+
+        This method returns a context manager. Inside the ``with`` block,
+        messages to WWT are collected rather than being sent one by one. When
+        the block exits, the collected messages are sent together, which can
+        greatly reduce latency when WWT is running on the other side of a
+        slow network link. If a setting is changed several times within the
+        block, with nothing else sent in between, only its final value is
+        sent. Batches can be nested, in which case everything is sent when the
+        outermost block exits. Operations that wait for a reply from WWT can't
+        be used inside a batch.
+
+        Examples
+        --------
+        Change several settings in one go::
+
+            >>> with wwt.batch():
+            ...     wwt.constellation_figures = True
+            ...     wwt.constellation_boundaries = True
+            ...     layer.cmap_att = "flux"
+            ...     layer.cmap_vmin = 0
+        """
+        if self._batchMessages is not None:
+            yield
+            return
+
+        self._batchMessages = []
+        self._batchKeys = {}
+
+        try:
+            yield
+        finally:
+            messages = self._batchMessages
+            self._batchMessages = None
+            self._batchKeys = None
+            self._send_batch(messages)
 
     # Clock controls
 
@@ -1016,10 +1309,11 @@ class BaseWWTWidget(HasTraits):
 
         Parameters
         ----------
-        dt : `~datetime.datetime` or `~astropy.time.Time`
-            A time, either as a `datetime.datetime` object or an
-            astropy :class:`astropy.time.Time` object. If not specified, this
-            uses the current time.
+        dt : `~datetime.datetime`, `~astropy.time.Time` or `~numpy.datetime64`
+            A time, either as a `datetime.datetime` object, an
+            astropy :class:`astropy.time.Time` object, or a numpy
+            `~numpy.datetime64` value in UTC. If not specified, this uses the
+            current time.
 
         Notes
         -----
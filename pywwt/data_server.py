@@ -8,7 +8,6 @@ You do not need to use this module unless you are a pywwt developer.
 """
 
 import asyncio
-from hashlib import md5
 import logging
 import mimetypes
 import os.path
@@ -16,6 +15,8 @@ import socket
 from threading import Thread
 import time
 
+from .hashing import file_digest
+
 __all__ = ['get_data_server']
 
 _data_server = None
@@ -85,10 +86,7 @@ def get_data_server(verbose=True):
             self._app.run(host=host, port=port)
 
         def serve_file(self, filename, extension=''):
-            with open(filename, 'rb') as f:
-                content = f.read()
-
-            hash = md5(content).hexdigest() + extension
+            hash = file_digest(filename) + extension
             self._files[hash] = os.path.abspath(filename)
             return 'http://' + self.host + ':' + str(self.port) + '/data/' + hash
 
@@ -0,0 +1,166 @@
+# Copyright 2021 the .NET Foundation
+# Licensed under the three-clause BSD License
+
+"""
+Content hashes of files and images.
+
+Processed images are cached, and data files are served, under hashes of their
+contents, so that changing an image never shows stale tiles. Images can be
+several gigabytes in size, so they are hashed a block at a time, straight from
+memory-mapped files, and the hashes of files are remembered for as long as
+the files are unchanged.
+
+The hashes use `xxhash <https://github.com/ifduyue/python-xxhash>`_ if it is
+installed, which is several times faster than the BLAKE2 hashes that are used
+otherwise.
+"""
+
+import hashlib
+import mmap
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+__all__ = ["array_digest", "file_digest", "hdu_digest"]
+
+# Data are passed to the hash this many bytes at a time.
+HASH_BLOCK_SIZE = 16 * 2 ** 20
+
+# The number of file hashes that are remembered.
+FILE_DIGEST_CACHE_SIZE = 1024
+
+_file_digests = OrderedDict()
+_file_digests_lock = Lock()
+
+
+def _new_hash():
+    try:
+        import xxhash
+    except ImportError:
+        return hashlib.blake2b(digest_size=20)
+    return xxhash.xxh3_128()
+
+
+def _update_blocks(digest, buffer):
+    view = memoryview(buffer).cast("B")
+
+    for start in range(0, len(view), HASH_BLOCK_SIZE):
+        digest.update(view[start:start + HASH_BLOCK_SIZE])
+
+
+def file_digest(filename):
+    """
+    Hash the contents of a file.
+
+    The hash of each file is remembered along with its size and modification
+    time, and the file is only read again if they change.
+
+    Parameters
+    ----------
+    filename : str or path-like
+
+    Returns
+    -------
+    digest : str
+        The hash of the file, as a hexadecimal string.
+    """
+    filename = os.path.abspath(filename)
+
+    with open(filename, "rb") as f:
+        stat = os.fstat(f.fileno())
+        memo_key = (filename, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        with _file_digests_lock:
+            digest = _file_digests.get(memo_key)
+
+            if digest is not None:
+                _file_digests.move_to_end(memo_key)
+                return digest
+
+        content_hash = _new_hash()
+
+        # Empty files can't be memory-mapped
+        if stat.st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                _update_blocks(content_hash, data)
+
+    digest = content_hash.hexdigest()
+
+    with _file_digests_lock:
+        _file_digests[memo_key] = digest
+
+        while len(_file_digests) > FILE_DIGEST_CACHE_SIZE:
+            _file_digests.popitem(last=False)
+
+    return digest
+
+
+def array_digest(array, digest=None):
+    """
+    Hash the values of a Numpy array.
+
+    The array is hashed a block of rows at a time, so that memory-mapped
+    arrays don't have to be loaded into memory all at once.
+
+    Parameters
+    ----------
+    array : :class:`~numpy.ndarray`
+    digest : hash object, optional
+        A hash to add the array to. By default, a new one is used.
+
+    Returns
+    -------
+    digest : str
+        The hash of the values, type and shape of the array, as a
+        hexadecimal string. Arrays holding the same values in a different
+        byte order or memory layout have the same hash.
+    """
+    if digest is None:
+        digest = _new_hash()
+
+    array = np.asanyarray(array)
+
+    # Values are hashed as big-endian, the byte order of FITS files, so that
+    # arrays mapped from them are hashed without converting them.
+    dtype = array.dtype.newbyteorder(">")
+    digest.update("{0} {1}".format(dtype.str, array.shape).encode("ascii"))
+
+    if array.ndim == 0 or array.size == 0:
+        digest.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        return digest.hexdigest()
+
+    row_bytes = max(array[0].nbytes, 1)
+    rows = max(HASH_BLOCK_SIZE // row_bytes, 1)
+
+    for start in range(0, len(array), rows):
+        # Slices of C-contiguous arrays are contiguous too, so this only
+        # copies blocks that are strided, in Fortran order or little-endian.
+        block = np.ascontiguousarray(array[start:start + rows], dtype=dtype)
+        _update_blocks(digest, block.view(np.uint8).reshape(-1))
+
+    return digest.hexdigest()
+
+
+def hdu_digest(hdu):
+    """
+    Hash the header and data of a FITS HDU.
+
+    Parameters
+    ----------
+    hdu : :class:`~astropy.io.fits.ImageHDU`
+        The HDU, which can also be a :class:`~astropy.io.fits.PrimaryHDU`.
+
+    Returns
+    -------
+    digest : str
+        The hash of the HDU, as a hexadecimal string.
+    """
+    digest = _new_hash()
+    digest.update(hdu.header.tostring().encode("utf-8"))
+
+    if hdu.data is None:
+        return digest.hexdigest()
+
+    return array_digest(hdu.data, digest=digest)
@@ -105,13 +105,39 @@ class WWTJupyterWidget(widgets.DOMWidget, BaseWWTWidget):
         if content.get("type") == "wwt_jupyter_widget_status":
             self._on_app_status_change(alive=content["alive"])
 
-        self._on_app_message_received(content)
+        self._on_app_message_received(content, buffers=buffers)
 
-    def _actually_send_msg(self, payload):
+    _supports_binary_buffers = True
+
+    def _actually_send_msg(self, payload, buffers=None):
         """
         Send a message to the app. In ipywidgets this is easy.
         """
-        self.send(payload)
+        self.send(payload, buffers=buffers)
+
+    def _actually_send_msgs(self, messages):
+        """
+        Send several messages to the app. Runs of messages without binary
+        buffers are wrapped up into a single ``pywwt_batch`` message, which
+        the widget frontend unpacks before relaying the individual messages
+        to the app.
+        """
+        run = []
+
+        for payload, buffers in messages + [(None, None)]:
+            if payload is not None and not buffers:
+                run.append(payload)
+                continue
+
+            if len(run) == 1:
+                self.send(run[0])
+            elif run:
+                self.send({"type": "pywwt_batch", "messages": run})
+
+            run = []
+
+            if payload is not None:
+                self.send(payload, buffers=buffers)
 
     @default("layout")
     def _default_layout(self):
@@ -287,10 +313,12 @@ class WWTLabApplication(BaseWWTWidget):
             self._relayAvailable = payload.get("dataRelayConfirmedAvailable", False)
             return
 
-        self._on_app_message_received(payload)
+        self._on_app_message_received(payload, buffers=msg.get("buffers"))
+
+    _supports_binary_buffers = True
 
-    def _actually_send_msg(self, payload):
-        self._comm.send(payload)
+    def _actually_send_msg(self, payload, buffers=None):
+        self._comm.send(payload, buffers=buffers)
 
     def _serve_file(self, filename, extension=""):
         if not self._relayAvailable:
@@ -1,9 +1,14 @@
+import os
 import sys
 import uuid
+import hashlib
 import tempfile
 from os import path
 import shutil
+import signal
 import asyncio
+import functools
+import multiprocessing
 
 import nest_asyncio
 from pathlib import Path
@@ -26,19 +31,44 @@ from matplotlib.colors import Colormap
 from astropy import units as u
 import astropy.units.imperial  # noqa: F401
 from astropy.table import Column
-from astropy.table import Table
+from astropy.table import Table, vstack
 from astropy.time import Time
+from astropy.wcs import WCS
 from datetime import datetime
 import toasty
 from toasty import TilingMethod
 
 from traitlets import HasTraits, validate, observe
-from .traits import Color, Bool, Float, Unicode, AstropyQuantity, Any, to_hex
-from .utils import sanitize_image, validate_traits, ensure_utc
+from . import core
+from .traits import Color, Bool, Float, Int, List, Unicode, AstropyQuantity, Any
+from .lod import HealpixIndex
+from .logger import logger
+from .table_files import TableFile
+from .tile_cache import TileCache, get_tile_cache
+from .hashing import file_digest, hdu_digest
+from .table_encoding import (
+    COLUMN_ENCODING_FEATURES,
+    TABLE_COMPRESSIONS,
+    TABLE_ENCODINGS,
+    compress_payload,
+    decode_table_binary,
+    decode_table_tsv,
+    encode_column_binary,
+    encode_table_binary,
+    encode_xyz_binary,
+)
+from .utils import (
+    SANITIZE_MEMORY_LIMIT,
+    sanitize_image,
+    validate_traits,
+    ensure_utc_array,
+    wwt_compatible_file,
+)
 
 __all__ = [
     "CatalogHipsLayer",
     "ImageLayer",
+    "ImageLayerTask",
     "LayerManager",
     "TableLayer",
 ]
@@ -134,6 +164,83 @@ else:
 CMAP_COLUMN_NAME = str(uuid.uuid4())
 TIME_COLUMN_NAME = str(uuid.uuid4())
 
+# The number of colormapped columns cached per table layer
+CMAP_CACHE_SIZE = 8
+
+# How long to wait for the view to settle before refreshing the data of
+# level-of-detail table layers, in seconds
+LOD_REFRESH_DELAY = 0.3
+
+# The radius of the region around the view center for which level-of-detail
+# table layers send data, relative to the (vertical) field of view. This is
+# enough to cover the view with a widescreen aspect ratio.
+LOD_VIEW_RADIUS = 1.1
+
+# The precisions to which table layer data are sent when the layer's
+# data_precision is "auto". Positions on the sky are sent to within a
+# milliarcsecond. Other coordinates are sent to within a millionth of their
+# largest value, and sizes and colormap values to within a ten-thousandth of
+# their range.
+POSITION_PRECISION = 1 * u.mas
+COORDINATE_PRECISION = 1e-6
+NORMALIZED_PRECISION = 1e-4
+
+# The percentiles, and the number of histogram bins, computed by
+# TableLayer.column_stats.
+STATS_PERCENTILES = (0.5, 1, 5, 25, 50, 75, 95, 99, 99.5)
+STATS_HISTOGRAM_BINS = 64
+
+# The default number of rows sent to WWT at a time for table layers whose data
+# are read from files.
+FILE_CHUNK_ROWS = 100000
+
+# The default maximum size, in bytes, of the pieces in which large table data
+# are uploaded to WWT, if the app supports it. Big messages can stall the
+# widget comm channel, and are rejected by some Jupyter websocket setups.
+UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Table data smaller than this many bytes are never compressed, since the time
+# saved in sending them would be negligible.
+COMPRESSION_THRESHOLD = 64 * 1024
+
+# The filename extensions of files holding compressed table data.
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# The maximum number of HiPS catalog tiles whose rows are kept by each HiPS
+# catalog layer, if the app can send the rows tile by tile. Refreshing the
+# layer then only fetches tiles that aren't already cached.
+HIPS_TILE_CACHE_SIZE = 1024
+
+# How long to wait for the view to settle before automatically refreshing the
+# data of HiPS catalog layers, in seconds. Each refresh is a round trip to the
+# app, so this is a bit longer than LOD_REFRESH_DELAY.
+HIPS_REFRESH_DELAY = 0.5
+
+# The largest width or height of the previews shown while images are tiled in
+# the background, in pixels.
+PREVIEW_SIZE = 1024
+
+# How long to wait for a cancelled tiling process to clean up before killing
+# it, in seconds.
+TILING_STOP_TIMEOUT = 5
+
+# Marks layer managers that use the tile cache shared by the whole process.
+_DEFAULT_TILE_CACHE = object()
+
+# The traits of a table layer that name the columns WWT uses. When column
+# projection is enabled, only these columns are sent.
+COLUMN_ATTRIBUTES = (
+    "lon_att",
+    "lat_att",
+    "alt_att",
+    "x_att",
+    "y_att",
+    "z_att",
+    "size_att",
+    "cmap_att",
+    "time_att",
+)
+
 
 def guess_lon_lat_columns(colnames):
     """
@@ -229,6 +336,500 @@ def csv_table_win_newline(table):
     return re.sub(r"(?<![\r\n])(\r|\n)(?![\r\n])", "\r\n", s.read())
 
 
+def _csv_column_lines(column, precision=None):
+    """
+    Get the lines of the CSV representation of a single table column, in the
+    same format as :func:`csv_table_win_newline`, including the header line.
+    Returns None if some of the values contain line breaks, in which case the
+    lines can't be separated.
+
+    If *precision* is nonzero, floating-point values are rounded to the
+    fewest decimal places that keep them within *precision* of their true
+    values, which makes them much shorter than their full representation.
+    """
+    if precision and column.dtype.kind == "f":
+        header = _csv_column_lines(column[:0])[0]
+        decimals = int(np.ceil(-np.log10(precision) - 1e-9))
+        data = np.round(np.ma.getdata(column).astype(float), decimals)
+        values = list(map(repr, data.tolist()))
+
+        mask = getattr(column, "mask", None)
+        if mask is not None:
+            for index in np.flatnonzero(mask):
+                values[index] = ""
+
+        return [header] + values
+
+    lines = csv_table_win_newline(Table([column], copy=False)).split("\r\n")
+    del lines[-1]
+
+    if len(lines) != len(column) + 1:
+        return None
+
+    # The CSV writer quotes empty values when they're the only field on a line,
+    # which they won't be once the columns are joined together.
+    return ["" if line == '""' else line for line in lines]
+
+
+def _join_csv_columns(columns):
+    """
+    Join the outputs of :func:`_csv_column_lines` for two or more columns into
+    the text of a CSV table.
+    """
+    return "\r\n".join(map(",".join, zip(*columns))) + "\r\n"
+
+
+def _split_table_payload(fields, buffers, chunk_size):
+    """
+    Split the table data of a message, as prepared by
+    :meth:`TableLayer._send_data`, into pieces of at most *chunk_size*
+    bytes. Returns the other fields of the message, and a list of
+    ``(fields, buffers)`` tuples for the pieces.
+
+    The base64-encoded CSV text is split into ``"data"`` substrings. Binary
+    buffers are split into slices, with a ``"pieces"`` field listing the index
+    of the buffer that each slice belongs to and its offset in that buffer.
+    Empty buffers don't have any slices.
+    """
+    fields = dict(fields)
+    text = fields.pop("table", None)
+
+    if text is not None:
+        pieces = [
+            ({"data": text[start:start + chunk_size]}, None)
+            for start in range(0, len(text), chunk_size)
+        ]
+        return fields, pieces
+
+    pieces = []
+    spans = []
+    slices = []
+    size = 0
+
+    for index, buffer in enumerate(buffers):
+        view = memoryview(buffer).cast("B")
+        offset = 0
+
+        while offset < len(view):
+            n = min(chunk_size - size, len(view) - offset)
+            spans.append([index, offset])
+            slices.append(view[offset:offset + n])
+            size += n
+            offset += n
+
+            if size == chunk_size:
+                pieces.append(({"pieces": spans}, slices))
+                spans = []
+                slices = []
+                size = 0
+
+    if slices:
+        pieces.append(({"pieces": spans}, slices))
+
+    return fields, pieces
+
+
+def _column_digest(column):
+    """
+    Get a hash of the type, unit, and values of a table column.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    data = np.ma.getdata(column)
+    unit = getattr(column, "unit", None)
+    digest.update(repr((data.dtype.str, str(unit), data.shape)).encode("utf-8"))
+
+    if data.dtype.kind == "O":
+        digest.update("\0".join(map(str, data)).encode("utf-8", errors="replace"))
+    else:
+        digest.update(np.ascontiguousarray(data).view(np.uint8))
+
+    mask = getattr(column, "mask", None)
+
+    if mask is not None:
+        digest.update(np.ascontiguousarray(mask, dtype=bool).view(np.uint8))
+
+    return digest.digest()
+
+
+def _join_columns(table, derived):
+    """
+    Join *table* with the *derived* columns, given as a dict mapping their
+    names to their values, without copying any data.
+    """
+    columns = list(table.columns.values())
+    columns += [
+        Column(values, name=name, copy=False) for name, values in derived.items()
+    ]
+    return Table(columns, copy=False)
+
+
+def _same_columns(columns1, columns2):
+    """
+    Determine whether two dicts of table columns hold the same column objects
+    under the same names.
+    """
+    return len(columns1) == len(columns2) and all(
+        name1 == name2 and column1 is column2
+        for (name1, column1), (name2, column2) in zip(
+            columns1.items(), columns2.items()
+        )
+    )
+
+
+def _toasty_version():
+    try:
+        from importlib.metadata import version
+
+        return version("toasty")
+    except Exception:
+        return None
+
+
+def _tiles_name(filename, tiling_method):
+    """
+    Name the directory of the tiles of an image file in the same way as
+    toasty does, which also names the image set.
+    """
+    name = path.basename(filename).split(".gz")[0]
+    name = name[: name.rfind(".")] + "_tiled"
+
+    if tiling_method == TilingMethod.HIPS:
+        name += "_HiPS"
+    elif tiling_method == TilingMethod.TOAST:
+        name += "_TOAST"
+
+    return name
+
+
+def _read_imageset(out_dir):
+    """
+    Read the image set of a tile pyramid from its WTML file. When toasty reuses
+    existing tiles, the image set that it returns lacks the pixel cuts and
+    data range of the image, which are only kept in this file.
+    """
+    from wwt_data_formats.folder import Folder
+    from wwt_data_formats.imageset import ImageSet
+
+    folder = Folder.from_file(path.join(out_dir, "index_rel.wtml"))
+
+    for child in folder.children:
+        if isinstance(child, ImageSet):
+            return child
+
+        imgset = child.foreground_image_set or child.image_set
+
+        if imgset is not None:
+            return imgset
+
+    raise ValueError("no image set found in the tiles in {0}".format(out_dir))
+
+
+def _preview_image(filename, hdu_index=None, wcs_key=" ", size=PREVIEW_SIZE):
+    """
+    Make a low-resolution copy of the image in a FITS file, no more than *size*
+    pixels wide or high.
+
+    Every n-th pixel of the image is used, rather than the average of each
+    block of pixels, so that only a fraction of a large memory-mapped image
+    has to be read.
+    """
+    with fits.open(filename, memmap=True) as hdulist:
+        if hdu_index is None:
+            hdu_index = next(
+                index
+                for index, hdu in enumerate(hdulist)
+                if hasattr(hdu, "shape")
+                and len(hdu.shape) > 1
+                and not isinstance(hdu, fits.BinTableHDU)
+            )
+
+        hdu = hdulist[hdu_index]
+        data = hdu.data
+
+        while data.ndim > 2:
+            data = data[0]
+
+        wcs = WCS(hdu.header, key=wcs_key).celestial
+        step = max(int(np.ceil(max(data.shape) / size)), 1)
+
+        # Sliced WCSes put each pixel at the center of the block of pixels
+        # that it stands for, so use the pixels at the centers of the blocks.
+        data = np.array(data[step // 2::step, step // 2::step], dtype=float)
+        return fits.PrimaryHDU(data, wcs[::step, ::step].to_header())
+
+
+def _tile_images(
+    fits_list,
+    cache,
+    hdu_index=None,
+    wcs_key=" ",
+    cli_progress=True,
+    tiling_method=TilingMethod.AUTO_DETECT,
+    parallel=None,
+    **kwargs
+):
+    """
+    Tile images with toasty, or find their tiles in *cache*, unless that is
+    `None`. Returns the tile directory and the image set of the tiles.
+    """
+    kwargs = dict(kwargs)
+
+    def tile(out_dir=None):
+        with warnings.catch_warnings():
+            # Avoid annoying AstroPy FITS-fixed warnings
+            warnings.simplefilter("ignore")
+            return toasty.tile_fits(
+                fits_list,
+                out_dir=out_dir,
+                hdu_index=hdu_index,
+                wcs_key=wcs_key,
+                cli_progress=cli_progress,
+                parallel=parallel,
+                tiling_method=tiling_method,
+                **kwargs
+            )
+
+    if cache is None:
+        out_dir, builder = tile(kwargs.pop("out_dir", None))
+        imgset = builder.imgset
+    else:
+        # The number of processes doesn't change the tiles, so it isn't
+        # part of the key, and neither are the options that only say
+        # where and whether to tile.
+        key = TileCache.key(
+            "tiles",
+            [file_digest(filename) for filename in fits_list],
+            hdu_index,
+            wcs_key,
+            tiling_method,
+            {
+                k: v
+                for k, v in kwargs.items()
+                if k not in ("out_dir", "override", "parallel")
+            },
+            _toasty_version(),
+        )
+
+        if kwargs.get("override"):
+            cache.remove(key)
+
+        out_dir = cache.get(key, tile, name=_tiles_name(fits_list[0], tiling_method))
+        imgset = _read_imageset(out_dir)
+
+    return out_dir, imgset
+
+
+def _tile_directory(*args, **kwargs):
+    """
+    Tile images as :func:`_tile_images` does, and return the tile directory.
+    Unlike the image set, this can be sent back from a worker process.
+    """
+    return _tile_images(*args, **kwargs)[0]
+
+
+def _worker_context():
+    """
+    Get the multiprocessing context used to start tiling processes. They are
+    started from a fresh process rather than forked from this one, since
+    forking a process that runs threads, as Jupyter kernels do, can deadlock.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+def _report_progress(sender):
+    """
+    Make toasty's progress bars in this process send ``("progress",
+    fraction)`` messages through *sender*, with the fraction of each stage of
+    tiling that is done, whether or not the bars are shown.
+    """
+    from toasty import progress
+
+    class ProgressReporter(progress.tqdm):
+        def __init__(self, *args, **kwargs):
+            super(ProgressReporter, self).__init__(*args, **kwargs)
+            # Disabled bars don't count, so keep a count of our own.
+            self._done = 0
+            self._reported = None
+            self._report()
+
+        def update(self, n=1):
+            super(ProgressReporter, self).update(n)
+            self._done += n
+            self._report()
+
+        def _report(self):
+            fraction = min(self._done / self.total, 1.0) if self.total else 0.0
+
+            # Limit the number of messages for stages with many steps.
+            if (
+                self._reported is None
+                or fraction - self._reported >= 0.01
+                or fraction == 1
+            ):
+                self._reported = fraction
+                sender.send(("progress", fraction))
+
+    progress.tqdm = ProgressReporter
+
+
+def _run_in_process_group(sender, func):
+    """
+    Call *func* in a worker process and send back its result, as a
+    ``("result", ok, value)`` message after any progress messages.
+
+    The process starts a process group of its own, so that it can be stopped
+    together with any processes that it starts. Stopping it raises SystemExit,
+    so that it can clean up first, such as removing partly written tiles.
+    """
+    os.setpgid(0, 0)
+
+    def stop(signum, frame):
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, stop)
+    _report_progress(sender)
+
+    try:
+        result = ("result", True, func())
+    except Exception as e:
+        result = ("result", False, e)
+
+    try:
+        sender.send(result)
+    except Exception:
+        # The exception can't be pickled
+        sender.send(("result", False, RuntimeError(repr(result[2]))))
+
+
+def _close_receiver(receiver, receiving):
+    """
+    Close the pipe of a worker process once the thread reading from it has
+    returned.
+    """
+    if not receiving.cancelled():
+        # Nothing may be waiting for the result after a cancellation, so
+        # retrieve the exception to avoid warnings about it.
+        receiving.exception()
+
+    receiver.close()
+
+
+def _stop_process_group(process):
+    """
+    Stop a worker process started by :func:`_run_in_process_group`, and any
+    processes that it has started. Returns whether it is still running.
+    """
+    for signum in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, signum)
+        except ProcessLookupError:
+            # The process hasn't started its own group yet
+            process.terminate()
+
+        process.join(TILING_STOP_TIMEOUT)
+
+        if not process.is_alive():
+            return False
+
+    return True
+
+
+def _import_tqdm():
+    try:
+        from tqdm.auto import tqdm
+    except ImportError:
+        raise ImportError("tqdm is required to show upload progress bars")
+    return tqdm
+
+
+def _colormap_hex_values(values, cmap):
+    """
+    Map normalized values to hex color strings using a Matplotlib colormap.
+
+    This gives the same results as calling ``to_hex`` on each of the colors
+    returned by ``cmap(values)``, but is vectorized: the colormap's lookup
+    table is converted to hex strings once, and the values are then quantized
+    into indices into that table.
+
+    Parameters
+    ----------
+    values : array-like
+        The values to map, normalized so that the colormap spans 0 to 1.
+        Values outside of that range get the colormap's "under" and "over"
+        colors, and NaN or masked values get its "bad" color.
+    cmap : :class:`~matplotlib.colors.Colormap`
+        The colormap.
+
+    Returns
+    -------
+    colors : :class:`~numpy.ndarray`
+        An array of hex color strings like ``"#1f77b4"``.
+    """
+    n = cmap.N
+
+    # Integer inputs to a colormap are direct lookups into its table.
+    lut = np.concatenate(
+        [
+            cmap(np.arange(n))[:, :3],
+            [cmap.get_under()[:3], cmap.get_over()[:3], cmap.get_bad()[:3]],
+        ]
+    )
+    packed = np.round(lut * 255).astype(np.uint32) @ np.array(
+        [1 << 16, 1 << 8, 1], dtype=np.uint32
+    )
+    lut_hex = np.array(["#{0:06x}".format(p) for p in packed])
+
+    # This mirrors the quantization done in Colormap.__call__.
+    mask = np.ma.getmaskarray(values)
+    xa = np.ma.getdata(values).astype(float) * n
+    xa[xa == n] = n - 1
+
+    with np.errstate(invalid="ignore"):
+        mask_under = xa < 0
+        mask_over = xa >= n
+        mask_bad = mask | np.isnan(xa)
+        index = xa.astype(np.intp)
+
+    index[mask_under] = n
+    index[mask_over] = n + 1
+    index[mask_bad] = n + 2
+
+    return lut_hex[index]
+
+
+def _array_stats(values):
+    """
+    Compute summary statistics of an array of numbers, in the form returned by
+    :meth:`TableLayer.column_stats`. NaN and masked values are ignored, except
+    that they are counted.
+    """
+    values = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan).ravel()
+    finite = values[np.isfinite(values)]
+    stats = {"nan_count": int(np.count_nonzero(np.isnan(values)))}
+
+    if len(finite) == 0:
+        stats["min"] = stats["max"] = np.nan
+        stats["percentiles"] = {p: np.nan for p in STATS_PERCENTILES}
+        stats["histogram"] = (
+            np.zeros(STATS_HISTOGRAM_BINS, dtype=int),
+            np.full(STATS_HISTOGRAM_BINS + 1, np.nan),
+        )
+        return stats
+
+    # Percentiles of 0 and 100 are the minimum and maximum. Asking for all of
+    # them at once only needs one partial sort of the data.
+    q = np.percentile(finite, (0,) + STATS_PERCENTILES + (100,))
+    stats["min"], stats["max"] = q[0], q[-1]
+    stats["percentiles"] = dict(zip(STATS_PERCENTILES, q[1:-1]))
+    stats["histogram"] = np.histogram(
+        finite, bins=STATS_HISTOGRAM_BINS, range=(q[0], q[-1])
+    )
+    return stats
+
+
 class LayerManager(object):
     """
     A simple container for layers.
@@ -238,6 +839,54 @@ class LayerManager(object):
         self._layers = []
         self._parent = parent
         self._tmpdir = None
+        self._tile_cache = _DEFAULT_TILE_CACHE
+
+        # The table datasets that have been sent to WWT, which table layers
+        # showing the same data can share. Datasets are identified by random
+        # IDs, and mapped to and from the content keys of their data (see
+        # TableLayer._dataset_key), unless rows have been appended to them.
+        self._datasets = {}
+        self._dataset_keys = {}
+        self._dataset_users = {}
+
+        # The files of table data published by table layers (see
+        # TableLayer._serve_payload), mapped to the IDs of the layers whose
+        # current data they hold. Files are named after their contents, so
+        # several layers can use the same one.
+        self._served_files = {}
+
+    @property
+    def tile_cache(self):
+        """
+        The :class:`~pywwt.tile_cache.TileCache` that keeps processed images
+        and their tiles, so that showing them again is fast, or `None` to not
+        cache them. By default, this is the cache returned by
+        :func:`~pywwt.tile_cache.get_tile_cache`, which is shared by all pywwt
+        sessions.
+        """
+        if self._tile_cache is _DEFAULT_TILE_CACHE:
+            return get_tile_cache()
+        return self._tile_cache
+
+    @tile_cache.setter
+    def tile_cache(self, value):
+        self._tile_cache = value
+
+    def _usable_tile_cache(self):
+        """
+        Get the tile cache, or None if caching is disabled or the cache
+        directory can't be written to.
+        """
+        cache = self.tile_cache
+
+        if cache is not None and not cache.available():
+            logger.warning(
+                "cannot write to the tile cache in %s; not caching images",
+                cache.directory,
+            )
+            return None
+
+        return cache
 
     def add_image_layer(
         self,
@@ -247,6 +896,9 @@ class LayerManager(object):
         verbose=True,
         name=None,
         tiling_method=TilingMethod.AUTO_DETECT,
+        parallel=True,
+        workers=None,
+        memory_limit=SANITIZE_MEMORY_LIMIT,
         **kwargs
     ):
         """
@@ -256,6 +908,10 @@ class LayerManager(object):
         the `toasty` library for smooth & fast visualization. You can also use
         this method to combine multiple FITS files into a single image set.
 
+        The tiles, and the transformed copies of images that aren't tiled, are
+        kept in :attr:`tile_cache`, so showing the same data again with the
+        same settings reuses them rather than processing the image again.
+
         Parameters
         ----------
         image : str or list of str or :class:`~astropy.io.fits.ImageHDU` or tuple
@@ -287,18 +943,162 @@ class LayerManager(object):
             Can be used to force a specific tiling method, i.e. tiled
             tangential projection, TOAST, HiPS, or even untiled. Defaults
             to auto-detection, which choses the most appropriate method.
+        parallel : optional boolean, defaults to True
+            If true, images are tiled using several processes, which generate
+            the tiles of the pyramid and downsample them to make its lower
+            levels in parallel. The tiles are the same either way. Parallel
+            tiling needs an operating system that uses `fork`-based
+            multiprocessing, such as Linux, and is not available for HiPS
+            tiling. For tiled tangential projections, toasty always
+            downsamples using all of the available CPUs.
+        workers : optional int, defaults to None
+            The number of processes used for parallel tiling. By default, this
+            is the number of CPUs, or the number allocated to the job on a
+            Slurm cluster. Images that aren't tiled are only reprojected in
+            parallel if this is given, since that forks the current process.
+        memory_limit : optional int
+            The memory that reprojecting an image that isn't tiled may use, in
+            bytes, besides that used by the image itself. Defaults to 2 GiB.
         kwargs
             Additional keyword arguments can be used to set properties on the
             image layer or settings for the `toasty` tiling process. Common
             toasty settings include ``out_dir``, ``override``, ``blankval``,
             and ``start``.
-            See `toasty.tile_fits`.
+            See `toasty.tile_fits`. If ``out_dir`` is given, the tiles are
+            written there rather than to the tile cache, and ``override``
+            makes the image be tiled again even if it is in the cache.
 
         Returns
         -------
         layer : :class:`~pywwt.layers.ImageLayer` or a subclass thereof
         """
 
+        if workers is not None and workers < 1:
+            raise ValueError("workers should be at least 1")
+
+        image = self._image_files(image, hdu_index=hdu_index)
+
+        if self._needs_tiling(image, wcs_key, tiling_method):
+            nest_asyncio.apply()
+            loop = asyncio.get_event_loop()
+            return loop.run_until_complete(
+                self._tile_and_serve(
+                    fits_list=image,
+                    hdu_index=hdu_index,
+                    wcs_key=wcs_key,
+                    cli_progress=verbose,
+                    display_name=name,
+                    tiling_method=tiling_method,
+                    parallel=workers if parallel else 1,
+                    **kwargs
+                )
+            )
+        else:
+            return self._create_and_add_image_layer(
+                image=image[0],
+                hdu_index=hdu_index,
+                name=name,
+                parallel=(workers or 1) if parallel else 1,
+                memory_limit=memory_limit,
+                **kwargs
+            )
+
+    def add_image_layer_async(
+        self,
+        image=None,
+        hdu_index=None,
+        wcs_key=" ",
+        name=None,
+        tiling_method=TilingMethod.AUTO_DETECT,
+        parallel=True,
+        workers=None,
+        memory_limit=SANITIZE_MEMORY_LIMIT,
+        preview=True,
+        **kwargs
+    ):
+        """
+        Add an image layer to the current view, tiling the image in the
+        background.
+
+        This works in the same way as :meth:`add_image_layer`, except that it
+        returns straight away, and large images are tiled in a separate
+        process while you carry on working. In the meantime, a low-resolution
+        preview of the image is shown.
+
+        Parameters
+        ----------
+        image, hdu_index, wcs_key, name, tiling_method, parallel, workers, memory_limit
+            See :meth:`add_image_layer`.
+        preview : optional boolean, defaults to True
+            If true, and the image is in a single file, a preview of it is
+            shown until it has been tiled.
+        kwargs
+            See :meth:`add_image_layer`.
+
+        Returns
+        -------
+        task : :class:`~pywwt.layers.ImageLayerTask`
+            A handle on the tiling process. Awaiting it gives the layer.
+
+        Notes
+        -----
+        Tiling in the background needs a running asyncio event loop, as there
+        is in Jupyter. Except on Windows, the image is tiled in a separate
+        process, which reports its progress as :attr:`ImageLayerTask.progress`
+        and is stopped if the task is cancelled. The process is started afresh
+        rather than forked from this one, so the image is passed to it by
+        filename. On Windows, the image is tiled in a thread, which can't be
+        stopped, so cancelling the task only discards the tiles.
+        """
+
+        if workers is not None and workers < 1:
+            raise ValueError("workers should be at least 1")
+
+        loop = asyncio.get_running_loop()
+        image = self._image_files(image, hdu_index=hdu_index)
+        task = ImageLayerTask(self)
+
+        if not self._needs_tiling(image, wcs_key, tiling_method):
+            task._task = loop.create_future()
+            task._task.set_result(
+                self._create_and_add_image_layer(
+                    image=image[0],
+                    hdu_index=hdu_index,
+                    name=name,
+                    parallel=(workers or 1) if parallel else 1,
+                    memory_limit=memory_limit,
+                    **kwargs
+                )
+            )
+            task._status = "done"
+            return task
+
+        if preview and len(image) == 1:
+            task._show_preview(image[0], hdu_index, wcs_key, name)
+
+        # The tiling process only gets the function and its arguments, so
+        # they have to be picklable.
+        tile = functools.partial(
+            _tile_directory,
+            image,
+            None if "out_dir" in kwargs else self._usable_tile_cache(),
+            hdu_index=hdu_index,
+            wcs_key=wcs_key,
+            cli_progress=False,
+            tiling_method=tiling_method,
+            parallel=workers if parallel else 1,
+            **kwargs
+        )
+        kwargs = self._remove_toasty_keywords(**kwargs)
+        task._task = loop.create_task(task._run(tile, name, kwargs))
+        task._task.add_done_callback(task._finish)
+        return task
+
+    def _image_files(self, image, hdu_index=None):
+        """
+        Get the list of the names of the files holding the image given to
+        :meth:`add_image_layer`.
+        """
         if isinstance(image, tuple):
             image, wcs = image
             image = astropy.io.fits.PrimaryHDU(image, wcs.to_header())
@@ -321,35 +1121,27 @@ class LayerManager(object):
         if isinstance(image, str):
             image = [image]
 
-        if (
+        return image
+
+    def _needs_tiling(self, fits_list, wcs_key, tiling_method):
+        return (
             wcs_key != " "
             or tiling_method == TilingMethod.TOAST
             or tiling_method == TilingMethod.HIPS
             or tiling_method == TilingMethod.TAN
         ) or (
             tiling_method == TilingMethod.AUTO_DETECT
-            and (len(image) > 1 or Path(image[0]).stat().st_size > 20e6)
-        ):  # 20 MB
-            nest_asyncio.apply()
-            loop = asyncio.get_event_loop()
-            return loop.run_until_complete(
-                self._tile_and_serve(
-                    fits_list=image,
-                    hdu_index=hdu_index,
-                    wcs_key=wcs_key,
-                    cli_progress=verbose,
-                    display_name=name,
-                    tiling_method=tiling_method,
-                    **kwargs
-                )
-            )
-        else:
-            return self._create_and_add_image_layer(
-                image=image[0], hdu_index=hdu_index, name=name, **kwargs
-            )
+            and (len(fits_list) > 1 or Path(fits_list[0]).stat().st_size > 20e6)
+        )  # 20 MB
 
     def _write_image_for_toasty(self, image, hdu_index=None):
         filename = self._toasty_filename(image, hdu_index=hdu_index)
+        cache = self._usable_tile_cache()
+
+        if cache is not None:
+            return cache.get(
+                TileCache.key("toasty-input", filename), image.writeto, name=filename
+            )
 
         try:
             # If the magic filename already exists, assume that we've already
@@ -361,23 +1153,22 @@ class LayerManager(object):
                 image.writeto(filename)
             return filename
         except OSError:
-            if self._tmpdir is None:
-                self._tmpdir = tempfile.TemporaryDirectory()
-            filepath = path.join(self._tmpdir.name, filename)
+            filepath = path.join(self._temporary_directory(), filename)
 
             if not Path(filepath).is_file():
                 image.writeto(filepath)
             return filepath
 
     def _toasty_filename(self, image, hdu_index=None):
-        m = self._image_md5(image, hdu_index=hdu_index)
-        hex_string = m.hexdigest()
-        return "toasty_input_{}.fits".format(hex_string)
+        return "toasty_input_{}.fits".format(
+            self._image_digest(image, hdu_index=hdu_index)
+        )
 
-    def _image_md5(self, image, hdu_index=None):
-        from hashlib import md5
+    def _image_digest(self, image, hdu_index=None):
+        # The whole of each image is hashed, since cached inputs and tiles are
+        # reused whenever the filename matches.
+        digest = hashlib.blake2b(digest_size=20)
 
-        m = md5()
         if isinstance(image, astropy.io.fits.HDUList):
             if hdu_index:
                 image = image[hdu_index]  # delegate to the next stanza
@@ -398,15 +1189,13 @@ class LayerManager(object):
                     ):
                         # We could `break` here, but it seems safer not to? And
                         # the performance impact should be minimal.
-                        m.update(hdu.data[:65536])
-                        m.update(hdu.header.tostring().encode("utf-8"))
+                        digest.update(hdu_digest(hdu).encode("ascii"))
 
         if isinstance(image, astropy.io.fits.ImageHDU) or isinstance(
             image, astropy.io.fits.PrimaryHDU
         ):
-            m.update(image.data[:65536])
-            m.update(image.header.tostring().encode("utf-8"))
-        return m
+            digest.update(hdu_digest(image).encode("ascii"))
+        return digest.hexdigest()
 
     def _create_and_add_image_layer(self, image, **kwargs):
         kwargs = self._remove_toasty_keywords(**kwargs)
@@ -450,36 +1239,49 @@ class LayerManager(object):
         cli_progress=True,
         display_name=None,
         tiling_method=TilingMethod.AUTO_DETECT,
+        parallel=None,
         **kwargs
     ):
-        with warnings.catch_warnings():
-            # Avoid annoying AstroPy FITS-fixed warnings
-            warnings.simplefilter("ignore")
-            out_dir, builder = toasty.tile_fits(
-                fits_list,
-                hdu_index=hdu_index,
-                wcs_key=wcs_key,
-                cli_progress=cli_progress,
-                tiling_method=tiling_method,
-                **kwargs
-            )
-
+        out_dir, imgset = self._tile(
+            fits_list,
+            hdu_index=hdu_index,
+            wcs_key=wcs_key,
+            cli_progress=cli_progress,
+            tiling_method=tiling_method,
+            parallel=parallel,
+            **kwargs
+        )
         kwargs = self._remove_toasty_keywords(**kwargs)
+        return self._add_tiled_layer(out_dir, imgset, display_name, **kwargs)
+
+    def _tile(self, fits_list, **kwargs):
+        """
+        Tile images with toasty, or find their tiles in the tile cache. Returns
+        the tile directory and the image set of the tiles.
+        """
+        cache = None if "out_dir" in kwargs else self._usable_tile_cache()
+        return _tile_images(fits_list, cache, **kwargs)
+
+    def _add_tiled_layer(self, out_dir, imgset, display_name=None, **kwargs):
+        # Keep the tiles in the cache for as long as they're being served.
+        cache = self._usable_tile_cache()
+        hold = cache.hold(out_dir) if cache is not None else None
         url = self._parent._serve_tree(path=out_dir)
 
         self._parent.load_image_collection(url=url + "index.wtml", remote_only=True)
 
         if display_name is None:
-            display_name = builder.imgset.name
+            display_name = imgset.name
 
         image_layer = self.add_preloaded_image_layer(
-            url + builder.imgset.url, name=display_name, **kwargs
+            url + imgset.url, name=display_name, **kwargs
         )
-        if builder.imgset.pixel_cut_low > 0 or builder.imgset.pixel_cut_low < 0:
-            image_layer.vmin = builder.imgset.pixel_cut_low
-            image_layer.vmax = builder.imgset.pixel_cut_high
-            image_layer._data_min = builder.imgset.data_min
-            image_layer._data_max = builder.imgset.data_max
+        image_layer._cache_hold = hold
+        if imgset.pixel_cut_low > 0 or imgset.pixel_cut_low < 0:
+            image_layer.vmin = imgset.pixel_cut_low
+            image_layer.vmax = imgset.pixel_cut_high
+            image_layer._data_min = imgset.data_min
+            image_layer._data_max = imgset.data_max
 
         return image_layer
 
@@ -489,8 +1291,11 @@ class LayerManager(object):
 
         Parameters
         ----------
-        table : :class:`~astropy.table.Table`
-            The table containing the data to show.
+        table : :class:`~astropy.table.Table` or str
+            The table containing the data to show. This can also be the name
+            of a FITS, HDF5 or Parquet file containing the table, or a
+            :class:`~pywwt.table_files.TableFile`, in which case only the
+            columns that the layer uses are read.
         frame : str
             The reference frame to use for the data. This should be either
             ``'Sky'``, ``'Ecliptic'``, ``Galactic``, or the name of a planet
@@ -514,7 +1319,8 @@ class LayerManager(object):
         frame = frame.capitalize()
 
         if table is not None:
-            layer = TableLayer(self._parent, table=table, frame=frame, **kwargs)
+            with self._parent.batch():
+                layer = TableLayer(self._parent, table=table, frame=frame, **kwargs)
         else:
             # NOTE: in future we may allow different arguments such as e.g.
             # orbit=, hence why we haven't made this a positional argument.
@@ -613,6 +1419,92 @@ class LayerManager(object):
         if layer in self._layers:
             self._layers.remove(layer)
 
+    def _temporary_directory(self):
+        """
+        Get the path of a directory for temporary files, which is removed when
+        the layer manager is.
+        """
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.TemporaryDirectory()
+        return self._tmpdir.name
+
+    def _acquire_served_file(self, filename, layer_id):
+        """
+        Register that the layer with ID *layer_id* has published its data in
+        *filename*.
+        """
+        self._served_files.setdefault(filename, set()).add(layer_id)
+
+    def _release_served_file(self, filename, layer_id):
+        """
+        Register that the layer with ID *layer_id* no longer needs *filename*,
+        deleting the file if no other layer does.
+        """
+        users = self._served_files.get(filename)
+
+        if users is None:
+            return
+
+        users.discard(layer_id)
+
+        if users:
+            return
+
+        del self._served_files[filename]
+
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    def _acquire_dataset(self, key, layer_id):
+        """
+        Register that the layer with ID *layer_id* uses the table data with the
+        content key *key*. Returns the ID of the dataset, and whether WWT
+        already has its data.
+        """
+        dataset = self._datasets.get(key)
+
+        if dataset is not None:
+            self._dataset_users[dataset].add(layer_id)
+            return dataset, True
+
+        dataset = str(uuid.uuid4())
+        self._datasets[key] = dataset
+        self._dataset_keys[dataset] = key
+        self._dataset_users[dataset] = {layer_id}
+        return dataset, False
+
+    def _dataset_shared(self, dataset, layer_id):
+        """
+        Determine whether layers other than *layer_id* use *dataset*.
+        """
+        return bool(self._dataset_users[dataset] - {layer_id})
+
+    def _retire_dataset(self, dataset):
+        """
+        Stop new layers from sharing *dataset*, because its data have changed.
+        """
+        key = self._dataset_keys.pop(dataset, None)
+
+        if key is not None:
+            del self._datasets[key]
+
+    def _release_dataset(self, dataset, layer_id):
+        """
+        Register that the layer with ID *layer_id* no longer uses *dataset*,
+        telling WWT to free the data if no other layer uses them.
+        """
+        users = self._dataset_users[dataset]
+        users.discard(layer_id)
+
+        if users:
+            return
+
+        del self._dataset_users[dataset]
+        self._retire_dataset(dataset)
+        self._parent._send_msg(event="table_dataset_remove", dataset=dataset)
+
     def __len__(self):
         return len(self._layers)
 
@@ -775,6 +1667,88 @@ class TableLayer(HasTraits):
         True, help="Whether sources in the layer are selectable (`bool`)"
     ).tag(wwt=None)
 
+    data_encoding = Unicode(
+        "csv",
+        help="The encoding used to send the table data to WWT, either "
+        "``'csv'`` or ``'binary'``. The binary encoding is much faster for "
+        "large tables, but it is only used if the viewer supports it; "
+        "otherwise the data are sent as CSV (`str`)",
+    ).tag(wwt=None)
+
+    data_compression = Unicode(
+        "auto",
+        help="How to compress the table data sent to WWT: ``'auto'`` to use the "
+        "best method that the viewer supports, ``'gzip'`` or ``'zstd'`` to use "
+        "that method if the viewer supports it, or ``'none'``. Small tables "
+        "are never compressed (`str`)",
+    ).tag(wwt=None)
+
+    lod = Bool(
+        False,
+        help="Whether to only send WWT a density-limited sample of the rows "
+        "in the current field of view, which is updated as the view changes. "
+        "This makes it possible to display tables that are too large to send "
+        "in full. Only sky-frame layers with spherical coordinates support "
+        "this (`bool`)",
+    ).tag(wwt=None)
+    lod_max_rows = Int(
+        50000,
+        help="The maximum number of rows sent to WWT when ``lod`` is "
+        "enabled (`int`)",
+    ).tag(wwt=None)
+
+    data_precision = Unicode(
+        "full",
+        help="The precision of the numbers sent to WWT, either ``'full'`` or "
+        "``'auto'``. With ``'auto'``, the coordinates, sizes, and colormap "
+        "values of the points are only sent to the precision needed to display "
+        "them, and all numbers are sent in the most compact form available, "
+        "which can make the data sent much smaller (`str`)",
+    ).tag(wwt=None)
+
+    column_projection = Bool(
+        False,
+        help="Whether to only send WWT the columns that the layer uses, "
+        "rather than the whole table. Other columns are sent as needed when "
+        "the attributes of the layer are changed (`bool`)",
+    ).tag(wwt=None)
+    pinned_columns = List(
+        Unicode(),
+        help="Columns to send to WWT even if ``column_projection`` is "
+        "enabled and they aren't used by the layer, for instance so that "
+        "they are shown when a source is selected (`list` of `str`)",
+    ).tag(wwt=None)
+    chunk_rows = Int(
+        None,
+        help="If set, and the viewer supports it, send the table to WWT in "
+        "pieces of this many rows, so that the whole table never needs to be "
+        "encoded at once. Defaults to 100,000 for tables read from files "
+        "(`int`)",
+        allow_none=True,
+    ).tag(wwt=None)
+
+    upload_chunk_size = Int(
+        UPLOAD_CHUNK_BYTES,
+        help="If the viewer supports it, table data larger than this many bytes "
+        "are uploaded to WWT in pieces of at most this size, in the background "
+        "if possible (`int`)",
+    ).tag(wwt=None)
+
+    upload_progress = Any(
+        None,
+        help="How to report the progress of uploads of large table data: "
+        "``True`` to show a progress bar, which requires tqdm, or a function "
+        "that is called with the number of bytes uploaded so far and the total "
+        "number of bytes",
+    ).tag(wwt=None)
+
+    serve_data = Bool(
+        False,
+        help="Whether to publish the table data in a file that the viewer "
+        "downloads over HTTP, rather than sending them in messages, if the "
+        "viewer supports it (`bool`)",
+    ).tag(wwt=None)
+
     # TODO: support:
     # xAxisColumn
     # yAxisColumn
@@ -794,6 +1768,17 @@ class TableLayer(HasTraits):
     ):
         self.table = table
         self.notify_changes = True
+        self._table_file = None
+
+        if isinstance(table, (str, os.PathLike)):
+            table = TableFile(table)
+
+        if isinstance(table, TableFile):
+            # The columns that we need are read from the file below, once we
+            # know which ones they are.
+            self._table_file = table
+            self.table = Table()
+            kwargs.setdefault("chunk_rows", FILE_CHUNK_ROWS)
 
         # Validate frame
         if frame.lower() not in VALID_FRAMES:
@@ -814,6 +1799,81 @@ class TableLayer(HasTraits):
         # manager if a layer is removed.
         self._manager = None
         self._removed = False
+        self._csv_cache = None
+        self._b64_cache = None
+        self._column_cache = {}
+        self._cmap_hex_cache = OrderedDict()
+        self._column_stats_cache = {}
+        self._initialized = False
+        self._lod_index = None
+        self._lod_cells = None
+        self._lod_rows = None
+        self._lod_timer = None
+        self._uploads = []
+        self._served_files = []
+        self._dataset = None
+        self._column_digest_cache = {}
+        self._derived = OrderedDict()
+        self._joined = None
+        self._shipped_columns = {}
+        self._initial_columns = ()
+        self._initial_atts = {}
+
+        # These have to be known before the table is first sent.
+        for name in (
+            "data_encoding",
+            "data_compression",
+            "data_precision",
+            "lod",
+            "lod_max_rows",
+            "column_projection",
+            "pinned_columns",
+            "chunk_rows",
+            "upload_chunk_size",
+            "upload_progress",
+            "serve_data",
+        ):
+            if name in kwargs:
+                setattr(self, name, kwargs.pop(name))
+
+        colnames = table.colnames
+
+        if self._table_file is not None:
+            # Only the columns that the layer uses are read from the file, so
+            # only those can be sent.
+            self.column_projection = True
+
+        if not table_from_wwt_engine:
+            # The coordinate columns are only set once the layer has been
+            # created, so work out what they will be set to, so that the right
+            # columns can be sent up front rather than sending the table twice.
+            if kwargs.get("coord_type") == "rectangular":
+                atts = ("x_att", "y_att", "z_att")
+                guesses = guess_xyz_columns(colnames)
+            else:
+                atts = ("lon_att", "lat_att")
+                guesses = guess_lon_lat_columns(colnames)
+
+            self._initial_atts = {
+                att: guess or name for att, guess, name in zip(atts, guesses, colnames)
+            }
+            self._initial_atts.update(
+                (att, kwargs[att])
+                for att in COLUMN_ATTRIBUTES + ("coord_type", "lon_unit", "xyz_unit")
+                if att in kwargs
+            )
+
+            if self.column_projection:
+                self._initial_columns = {
+                    self._initial_atts.get(att) for att in COLUMN_ATTRIBUTES
+                }
+
+        if self._table_file is not None:
+            self.table = self._table_file.read(
+                name
+                for name in colnames
+                if name in self._initial_columns or name in self.pinned_columns
+            )
 
         if not table_from_wwt_engine:
             self._initialize_layer()
@@ -846,34 +1906,68 @@ class TableLayer(HasTraits):
         if not table_from_wwt_engine:
             if kwargs.get("coord_type") == "rectangular":
 
-                x_guess, y_guess, z_guess = guess_xyz_columns(self.table.colnames)
+                x_guess, y_guess, z_guess = guess_xyz_columns(colnames)
 
                 if "x_att" not in kwargs:
-                    self.x_att = x_guess or self.table.colnames[0]
+                    self.x_att = x_guess or colnames[0]
 
                 if "y_att" not in kwargs:
-                    self.y_att = y_guess or self.table.colnames[1]
+                    self.y_att = y_guess or colnames[1]
 
                 if "z_att" not in kwargs:
-                    self.z_att = z_guess or self.table.colnames[2]
+                    self.z_att = z_guess or colnames[2]
 
             else:
 
-                lon_guess, lat_guess = guess_lon_lat_columns(self.table.colnames)
+                lon_guess, lat_guess = guess_lon_lat_columns(colnames)
 
                 if "lon_att" not in kwargs:
-                    self.lon_att = lon_guess or self.table.colnames[0]
+                    self.lon_att = lon_guess or colnames[0]
 
                 if "lat_att" not in kwargs:
-                    self.lat_att = lat_guess or self.table.colnames[1]
+                    self.lat_att = lat_guess or colnames[1]
+
+            self._initialized = True
+
+            if self.lod:
+                self._enable_lod()
 
     @validate("coord_type")
     def _check_coord_type(self, proposal):
+        if proposal["value"] == "rectangular" and self.lod:
+            raise ValueError("lod is not supported with rectangular coordinates")
+
         if proposal["value"] in ("spherical", "rectangular"):
             return proposal["value"]
         else:
             raise ValueError("coord_type should be spherical or rectangular")
 
+    @validate("lod")
+    def _check_lod(self, proposal):
+        if proposal["value"] and (
+            self.frame != "Sky" or self.coord_type != "spherical"
+        ):
+            raise ValueError(
+                "lod is only supported for sky layers with spherical coordinates"
+            )
+        return proposal["value"]
+
+    @observe("lod", "lod_max_rows", "lon_att", "lat_att", "lon_unit")
+    def _on_lod_change(self, changed):
+        if changed["name"] != "lod_max_rows":
+            self._lod_index = None
+
+        if not self.notify_changes or not self._initialized:
+            return
+
+        if changed["name"] == "lod":
+            if changed["new"]:
+                self._enable_lod()
+            else:
+                self._disable_lod()
+        elif self.lod:
+            self._refresh_lod(force=True)
+
     # Attributes for spherical coordinates
 
     @validate("lon_unit")
@@ -918,8 +2012,50 @@ class TableLayer(HasTraits):
                 )
             )
 
+    @validate(
+        "lon_att",
+        "lat_att",
+        "alt_att",
+        "x_att",
+        "y_att",
+        "z_att",
+        "size_att",
+        "cmap_att",
+    )
+    def _check_column_att(self, proposal):
+        if self.notify_changes:
+            self._read_columns([proposal["value"]])
+        return proposal["value"]
+
+    @validate("pinned_columns")
+    def _check_pinned_columns(self, proposal):
+        if self.notify_changes:
+            self._read_columns(proposal["value"])
+        return proposal["value"]
+
+    @validate("upload_chunk_size")
+    def _check_upload_chunk_size(self, proposal):
+        if proposal["value"] > 0:
+            return proposal["value"]
+        else:
+            raise ValueError("upload_chunk_size should be positive")
+
+    @validate("upload_progress")
+    def _check_upload_progress(self, proposal):
+        value = proposal["value"]
+
+        if value is True:
+            _import_tqdm()
+        elif value not in (None, False) and not callable(value):
+            raise ValueError("upload_progress should be True, False, or a function")
+
+        return value
+
     @validate("time_att")
     def _check_time_att(self, proposal):
+        if self.notify_changes:
+            self._read_columns([proposal["value"]])
+
         # Parse the time_att column and make sure it's in the proper format
         # (string in isot format, astropy Time, or datetime)
         col = self._get_table()[proposal["value"]]
@@ -946,6 +2082,41 @@ class TableLayer(HasTraits):
                 "datetime.datetime, or astropy Time values"
             )
 
+    @validate("data_encoding")
+    def _check_data_encoding(self, proposal):
+        if proposal["value"] in TABLE_ENCODINGS:
+            return proposal["value"]
+        else:
+            raise ValueError(
+                "data_encoding should be one of {0}".format(
+                    "/".join(str(x) for x in TABLE_ENCODINGS)
+                )
+            )
+
+    @validate("data_compression")
+    def _check_data_compression(self, proposal):
+        options = ["auto", "none"] + TABLE_COMPRESSIONS
+
+        if proposal["value"] in options:
+            return proposal["value"]
+        else:
+            raise ValueError(
+                "data_compression should be one of {0}".format("/".join(options))
+            )
+
+    @validate("data_precision")
+    def _check_data_precision(self, proposal):
+        if proposal["value"] in ("full", "auto"):
+            return proposal["value"]
+        else:
+            raise ValueError("data_precision should be one of full/auto")
+
+    @observe("data_precision")
+    def _on_data_precision_change(self, changed):
+        if self._initialized:
+            self._csv_cache = None
+            self._send_table("table_layer_update")
+
     @validate("time_decay")
     def _check_decay(self, proposal):
         if proposal["value"].unit.physical_type == "time":
@@ -1006,7 +2177,7 @@ class TableLayer(HasTraits):
                 warnings.warn(
                     "Column {0} has units of {1} but this is not a valid "
                     "unit of distance - set the unit directly with "
-                    "xyz_unit".format(self.alt_att, unit),
+                    "xyz_unit".format(att, unit),
                     UserWarning,
                 )
 
@@ -1025,6 +2196,14 @@ class TableLayer(HasTraits):
                 )
             )
 
+    @observe("xyz_unit")
+    def _on_xyz_unit_change(self, changed):
+        # Packed positions are converted to xyz_unit, so need to be sent again.
+        if self._initialized and self._xyz_packing(
+            self._get_table(), self._sent_colnames()
+        ):
+            self._send_table("table_layer_update")
+
     # Visual attributes
 
     @validate("marker_type")
@@ -1069,13 +2248,14 @@ class TableLayer(HasTraits):
             )
             return
 
+        self._ship_new_columns()
         self.size_vmin = None
         self.size_vmax = None
 
-        column = self._get_table()[self.size_att]
+        stats = self.column_stats(self.size_att)
 
-        self.size_vmin = np.nanmin(column)
-        self.size_vmax = np.nanmax(column)
+        self.size_vmin = stats["min"]
+        self.size_vmax = stats["max"]
 
     @observe("size_vmin", "size_vmax")
     def _on_size_vmin_vmax_change(self, *value):
@@ -1143,13 +2323,14 @@ class TableLayer(HasTraits):
 
             return
 
+        self._ship_new_columns()
         self.cmap_vmin = None
         self.cmap_vmax = None
 
-        column = self._get_table()[self.cmap_att]
+        stats = self.column_stats(self.cmap_att)
 
-        self.cmap_vmin = np.nanmin(column)
-        self.cmap_vmax = np.nanmax(column)
+        self.cmap_vmin = stats["min"]
+        self.cmap_vmax = stats["max"]
 
     @observe("cmap_vmin", "cmap_vmax", "cmap")
     def _on_cmap_vmin_vmax_change(self, *value):
@@ -1177,6 +2358,10 @@ class TableLayer(HasTraits):
 
             if self.cmap.name.lower() in VALID_COLORMAPS:
 
+                # WWT computes the colors itself, so the colors from a custom
+                # colormap that was used before are no longer needed.
+                self._remove_derived(CMAP_COLUMN_NAME)
+
                 self.parent._send_msg(
                     event="table_layer_set",
                     id=self.id,
@@ -1221,19 +2406,10 @@ class TableLayer(HasTraits):
 
             else:
                 table = self._get_table()
-                column = table[self.cmap_att]
-
-                values = (column - self.cmap_vmin) / (self.cmap_vmax - self.cmap_vmin)
-
-                # PERF: vectorize the calculation of the hex strings
-                rgb = self.cmap(values)[:, :-1]
-                hex_values = [to_hex(x) for x in rgb]
-
-                table[CMAP_COLUMN_NAME] = hex_values
-
-                self.parent._send_msg(
-                    event="table_layer_update", id=self.id, table=self._table_b64
+                self._set_derived(
+                    CMAP_COLUMN_NAME, self._cmap_hex_values(table[self.cmap_att])
                 )
+                self._send_columns([CMAP_COLUMN_NAME])
 
                 self.parent._send_msg(
                     event="table_layer_set",
@@ -1260,50 +2436,971 @@ class TableLayer(HasTraits):
             self.parent._send_msg(
                 event="table_layer_set", id=self.id, setting="startDateColumn", value=-1
             )
-            return
+            return
+
+        # Update the table passed to WWT with the new, modified time column
+        table = self._get_table()
+        self._set_derived(TIME_COLUMN_NAME, self._utc_times(table[self.time_att]))
+        self._send_columns([TIME_COLUMN_NAME])
+
+        self.parent._send_msg(
+            event="table_layer_set",
+            id=self.id,
+            setting="startDateColumn",
+            value=TIME_COLUMN_NAME,
+        )
+
+    @observe("column_projection", "pinned_columns")
+    def _on_column_projection_change(self, changed):
+        if not self._initialized:
+            return
+
+        if changed["name"] == "column_projection":
+            # Send the table again so that WWT has all of the columns, or so
+            # that it can drop the ones that it doesn't need.
+            self._csv_cache = None
+            self._send_table("table_layer_update")
+        else:
+            self._ship_new_columns()
+
+    @observe("selectable")
+    def _on_selectable_change(self, changed):
+        if not self.notify_changes:
+            return
+
+        self.parent._send_msg(
+            type="modify_selectability", id=self.id, selectable=changed["new"]
+        )
+
+    def _get_table(self):
+        return self.table
+
+    def _set_derived(self, name, values):
+        """
+        Set the values of the derived column *name*, such as the colormap
+        colors, which is sent to WWT along with the layer's data.
+
+        Derived columns are held separately from the layer's table, so that
+        adding them doesn't change the table or copy its data, and changing
+        one doesn't change the encoded forms of the table's own columns.
+        """
+        self._derived[name] = Column(values, name=name, copy=False)
+        self._csv_cache = None
+
+    def _remove_derived(self, name):
+        """
+        Stop sending the derived column *name* to WWT, if it is being sent.
+        """
+        if self._derived.pop(name, None) is not None:
+            self._shipped_columns.pop(name, None)
+            self._csv_cache = None
+
+    def _derive_columns(self, table):
+        """
+        Compute the values of the layer's derived columns for the rows of
+        *table*, for any that can be computed from its columns. Returns a dict
+        mapping the names of the derived columns to their values.
+        """
+        derived = {}
+
+        if CMAP_COLUMN_NAME in self._derived:
+            if self._uniform_color():
+                derived[CMAP_COLUMN_NAME] = [self.color] * len(table)
+            elif self.cmap_att in table.colnames:
+                derived[CMAP_COLUMN_NAME] = self._cmap_hex_values(table[self.cmap_att])
+
+        if TIME_COLUMN_NAME in self._derived and self.time_att in table.colnames:
+            derived[TIME_COLUMN_NAME] = self._utc_times(table[self.time_att])
+
+        return derived
+
+    def _data_table(self):
+        """
+        Get the table whose columns are sent to WWT: the layer's table joined
+        with its derived columns. Only references to the columns are joined,
+        not their data. The joined table is kept until the columns of either
+        change.
+        """
+        table = self._get_table()
+
+        if not self._derived:
+            return table
+
+        sources = OrderedDict(table.columns)
+        sources.update(self._derived)
+
+        if self._joined is None or not _same_columns(self._joined[0], sources):
+            self._joined = (sources, _join_columns(table, self._derived))
+
+        return self._joined[1]
+
+    def _column_sources(self, table):
+        """
+        If *table* is the whole table that is sent to WWT, get a dict mapping
+        the names of its columns to the objects that they are made from: the
+        columns of the layer's table, and its derived columns. Our caches of
+        the encoded columns are keyed on these. Otherwise, return None, since
+        the encoded forms of other tables aren't cached.
+        """
+        if table is self.table:
+            return table.columns
+
+        if self._joined is not None and table is self._joined[1]:
+            return self._joined[0]
+
+        return None
+
+    def _read_columns(self, names):
+        """
+        If the layer's data are read from a file, read any of the columns in
+        *names* that haven't been read yet.
+        """
+        if self._table_file is None:
+            return
+
+        new = [name for name in names if name and name not in self.table.colnames]
+
+        if not new:
+            return
+
+        for name, column in self._table_file.read(new).columns.items():
+            self.table.add_column(column, name=name, copy=False)
+
+    def _sent_table(self):
+        """
+        Get the table data that should be sent to WWT. This is the whole table
+        unless the layer is in level-of-detail mode.
+        """
+        table = self._data_table()
+
+        if not self.lod:
+            return table
+
+        if self._lod_rows is None:
+            # The layer is still being set up; the rows will be sent once it's
+            # ready.
+            return table[:0]
+
+        return table[self._lod_rows]
+
+    def _sent_colnames(self):
+        """
+        Get the names of the columns that should be sent to WWT. These are all
+        of the columns, unless the layer is in column projection mode.
+        """
+        table = self._data_table()
+
+        if not self.column_projection:
+            return table.colnames
+
+        wanted = {getattr(self, att) for att in COLUMN_ATTRIBUTES}
+        wanted.update(self.pinned_columns)
+        wanted.update((CMAP_COLUMN_NAME, TIME_COLUMN_NAME))
+
+        if not self._initialized:
+            wanted.update(self._initial_columns)
+
+        return [name for name in table.colnames if name in wanted]
+
+    def _ship_new_columns(self):
+        """
+        Send the table again if WWT needs columns that haven't been sent yet,
+        in column projection mode, or needs columns to be more precise than
+        they were sent.
+        """
+        if not self._initialized:
+            return
+
+        shipped = self._shipped_columns
+        needed = self._column_precisions(self._sent_colnames())
+
+        if all(
+            name in shipped and (shipped[name] or 0) <= (precision or 0)
+            for name, precision in needed.items()
+        ):
+            return
+
+        self._csv_cache = None
+
+        if self.lod:
+            self._refresh_lod(force=True)
+        else:
+            self._send_table("table_layer_update")
+
+    def _enable_lod(self):
+        listeners = self.parent._view_state_listeners
+
+        if self._on_view_state_change not in listeners:
+            listeners.append(self._on_view_state_change)
+
+        self._refresh_lod(force=True)
+
+    def _disable_lod(self):
+        self._stop_lod_refreshes()
+        self._lod_cells = None
+        self._lod_rows = None
+        self._csv_cache = None
+        self._send_table("table_layer_update")
+
+    def _stop_lod_refreshes(self):
+        if self._lod_timer is not None:
+            self._lod_timer.cancel()
+            self._lod_timer = None
+
+        if self._on_view_state_change in self.parent._view_state_listeners:
+            self.parent._view_state_listeners.remove(self._on_view_state_change)
+
+    def _on_view_state_change(self):
+        # The app sends view updates continuously while the view is moving, so
+        # wait until it settles down. If there's no event loop to do that
+        # with, refresh right away: that only costs anything if a different
+        # set of rows needs to be sent.
+        if self._lod_timer is not None:
+            self._lod_timer.cancel()
+            self._lod_timer = None
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._refresh_lod()
+        else:
+            self._lod_timer = loop.call_later(LOD_REFRESH_DELAY, self._refresh_lod)
+
+    def _refresh_lod(self, force=False):
+        """
+        Send WWT the sample of the table's rows that matches the current view,
+        if it has changed.
+        """
+        self._lod_timer = None
+
+        if self._removed or not self.lod:
+            return
+
+        if self._lod_index is None:
+            table = self._get_table()
+            lon = np.ma.filled(np.ma.asarray(table[self.lon_att], dtype=float), np.nan)
+            lat = np.ma.filled(np.ma.asarray(table[self.lat_att], dtype=float), np.nan)
+
+            if self.lon_unit is not None:
+                lon = (lon * self.lon_unit).to_value(u.deg)
+
+            self._lod_index = HealpixIndex(lon, lat)
+
+        order, cells, rows = self._lod_index.query(
+            np.degrees(self.parent._raRad),
+            np.degrees(self.parent._decRad),
+            self.parent._fovDeg * LOD_VIEW_RADIUS,
+            self.lod_max_rows,
+        )
+
+        if (
+            not force
+            and self._lod_cells is not None
+            and self._lod_cells[0] == order
+            and np.array_equal(self._lod_cells[1], cells)
+        ):
+            return
+
+        self._lod_cells = (order, cells)
+        self._lod_rows = rows
+        self._csv_cache = None
+        self._send_table("table_layer_update")
+
+    def column_stats(self, name):
+        """
+        Get summary statistics of the values in a numeric column of the
+        layer's data.
+
+        The statistics are computed the first time that they are needed, and
+        are then kept until the column is changed, so that switching between
+        columns with e.g. :attr:`size_att` or :attr:`cmap_att` is cheap.
+
+        Parameters
+        ----------
+        name : str
+            The name of the column.
+
+        Returns
+        -------
+        stats : dict
+            A dictionary with keys ``"min"`` and ``"max"``, the minimum and
+            maximum values; ``"nan_count"``, the number of NaN or masked
+            values, which are otherwise ignored; ``"percentiles"``, a
+            dictionary mapping each of 0.5, 1, 5, 25, 50, 75, 95, 99, and 99.5
+            to that percentile of the values; and ``"histogram"``, a tuple of
+            the counts and bin edges of a 64-bin histogram of the values, as
+            returned by :func:`numpy.histogram`.
+        """
+        if self._table_file is not None:
+            self._read_columns([name])
+
+        column = self._get_table()[name]
+
+        if column.dtype.kind not in "biuf":
+            raise TypeError("column {0} is not numeric".format(name))
+
+        # The cache holds a reference to the column so that we can tell when
+        # it has been replaced.
+        entry = self._column_stats_cache.get(name)
+
+        if entry is not None and entry[0] is column:
+            return entry[1]
+
+        stats = _array_stats(column)
+        self._column_stats_cache[name] = (column, stats)
+        return stats
+
+    def _cmap_hex_values(self, column):
+        """
+        Compute the hex colors of the values in *column* for a colormap that
+        WWT doesn't know about.
+
+        Results for the layer's own table columns are cached, so that flipping
+        back and forth between settings is cheap.
+        """
+        key = (
+            id(column),
+            len(column),
+            id(self.cmap),
+            self.cmap.name,
+            self.cmap_vmin,
+            self.cmap_vmax,
+        )
+        cache = self._cmap_hex_cache
+
+        # The cache holds a reference to the column so that its id can't be
+        # recycled while the entry is alive.
+        if key in cache and cache[key][0] is column:
+            cache.move_to_end(key)
+            return cache[key][1]
+
+        values = (np.ma.asanyarray(column) - self.cmap_vmin) / (
+            self.cmap_vmax - self.cmap_vmin
+        )
+        hex_values = _colormap_hex_values(values, self.cmap)
+
+        if column is self.table.columns.get(self.cmap_att):
+            cache[key] = (column, hex_values)
+            while len(cache) > CMAP_CACHE_SIZE:
+                cache.popitem(last=False)
+
+        return hex_values
+
+    def _utc_times(self, column):
+        """
+        Convert the times in *column* to UTC so that WWT displays points at the
+        expected times.
+        """
+        return Column(ensure_utc_array(column))
+
+    def _setting(self, name):
+        """
+        Get the value of the trait *name*. Before the layer has been created in
+        WWT, this is the value that it is going to be set to, since the traits
+        giving the columns to use, for instance, are only set afterwards.
+        """
+        if not self._initialized and name in self._initial_atts:
+            return self._initial_atts[name]
+        return getattr(self, name)
+
+    def _column_precisions(self, names):
+        """
+        Get the precision to which each of the columns *names* needs to be
+        sent to WWT, as a dict. The precisions are None if the layer's
+        ``data_precision`` is ``"full"``, and otherwise are as described for
+        :func:`~pywwt.table_encoding.encode_column_binary`.
+        """
+        if self.data_precision == "full":
+            return dict.fromkeys(names)
+
+        table = self._get_table()
+        required = {}
+        setting = self._setting
+
+        def require(att, precision):
+            if att in names and table[att].dtype.kind in "iuf":
+                required[att] = min(precision, required.get(att, precision))
+
+        def relative(att, fraction, use_range=False):
+            stats = self.column_stats(att)
+            if use_range:
+                scale = stats["max"] - stats["min"]
+            else:
+                scale = max(abs(stats["min"]), abs(stats["max"]))
+            if not np.isfinite(scale) or scale <= 0:
+                return 0
+            # Rounding to a power of ten keeps the precision stable as rows are
+            # appended.
+            return 10.0 ** np.floor(np.log10(scale * fraction))
+
+        if setting("coord_type") == "spherical":
+            lon_unit = u.Unit(setting("lon_unit") or u.deg)
+            require(setting("lon_att"), POSITION_PRECISION.to_value(lon_unit))
+            require(setting("lat_att"), POSITION_PRECISION.to_value(u.deg))
+            coordinates = [setting("alt_att")]
+        else:
+            coordinates = [setting("x_att"), setting("y_att"), setting("z_att")]
+
+        for att in coordinates:
+            if att in names:
+                require(att, relative(att, COORDINATE_PRECISION))
+
+        for att in (setting("size_att"), setting("cmap_att")):
+            if att in names:
+                require(att, relative(att, NORMALIZED_PRECISION, use_range=True))
+
+        return {name: required.get(name, 0) for name in names}
+
+    def _dataset_key(self, table):
+        """
+        Get a key identifying the data that would be sent to WWT for *table*,
+        which is the same for any layers that would send the same data.
+        """
+        names = self._sent_colnames()
+        encoding = "binary" if self._use_binary_encoding() else "csv"
+        precisions = self._column_precisions(names)
+        settings = (
+            encoding,
+            self._column_features(),
+            sorted(precisions.items()),
+            self._xyz_packing(table, names),
+            str(self.xyz_unit),
+        )
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(settings).encode("utf-8"))
+
+        sources = self._column_sources(table)
+
+        for name in names:
+            column = table[name]
+            source = column if sources is None else sources[name]
+            entry = self._column_digest_cache.get(name)
+
+            if entry is None or entry[0] is not source:
+                entry = (source, _column_digest(column))
+
+                if sources is not None:
+                    self._column_digest_cache[name] = entry
+
+            digest.update(name.encode("utf-8"))
+            digest.update(entry[1])
+
+        return digest.hexdigest()
+
+    def _xyz_packing(self, table, names):
+        """
+        Get the names of the x/y/z columns, if they are to be sent to WWT
+        packed together as ``float32`` triplets, or an empty tuple if not.
+        """
+        atts = (self._setting("x_att"), self._setting("y_att"), self._setting("z_att"))
+
+        if (
+            self._setting("coord_type") != "rectangular"
+            or self.data_precision != "auto"
+            or not self._use_binary_encoding()
+            or not self.parent._supports_table_feature("interleaved")
+            or len(set(atts)) != 3
+        ):
+            return ()
+
+        for att in atts:
+            if att not in names or table[att].dtype.kind not in "iuf":
+                return ()
+
+        return atts
+
+    def _encoded_xyz(self, table, names):
+        """
+        Encode the x/y/z columns of *table* together, if they are to be sent
+        packed (see :meth:`_xyz_packing`). Returns a dict mapping the names of
+        the columns to their encoded forms, which is empty if they aren't
+        packed. The three columns are cached together, since they share a
+        buffer.
+        """
+        atts = self._xyz_packing(table, names)
+
+        if not atts:
+            return {}
+
+        unit = self.xyz_unit
+
+        if not self._initialized:
+            # The unit is only set afterwards, from the first of the columns
+            # that has a valid unit.
+            for att in atts:
+                column_unit = pick_unit_if_available(table[att].unit, VALID_ALT_UNITS)
+
+                if column_unit in VALID_ALT_UNITS:
+                    unit = column_unit
+                    break
+            else:
+                unit = self._setting("xyz_unit")
+
+        params = ("xyz", unit)
+        sources = self._column_sources(table)
+        cacheable = sources is not None
+
+        if not cacheable:
+            sources = table.columns
+
+        entries = [self._column_cache.get(("binary", att)) for att in atts]
+
+        if all(
+            entry is not None and entry[0] is sources[att] and entry[1] == params
+            for att, entry in zip(atts, entries)
+        ):
+            return {att: entry[2] for att, entry in zip(atts, entries)}
+
+        try:
+            values = encode_xyz_binary(*(table[att] for att in atts), unit=unit)
+        except u.UnitConversionError:
+            # The columns have units that aren't distances, which we warn
+            # about separately, so send them as they are.
+            return {}
+
+        if cacheable:
+            for att, value in zip(atts, values):
+                self._column_cache["binary", att] = (sources[att], params, value)
+
+        return dict(zip(atts, values))
+
+    def _column_features(self):
+        """
+        Get the compact column encodings that the app supports.
+        """
+        return [
+            feature
+            for feature in COLUMN_ENCODING_FEATURES
+            if self.parent._supports_table_feature(feature)
+        ]
+
+    def _encoded_columns(self, table, encoding, names=None):
+        """
+        Encode each of the columns of *table* (or just those in *names*) for
+        sending to WWT, using either the ``"csv"`` or ``"binary"`` encoding.
+
+        The encoded columns of the table that we send (see
+        :meth:`_data_table`) are cached, and are only encoded again if the
+        column is replaced, or needs to be sent to a different precision. This
+        way, when a derived column like the colormap colors changes, only that
+        column needs to be re-encoded.
+        """
+        sources = self._column_sources(table)
+        encoded = []
+
+        if names is None:
+            names = table.colnames
+
+        precisions = self._column_precisions(names)
+        features = self._column_features() if encoding == "binary" else []
+        packed = self._encoded_xyz(table, names) if encoding == "binary" else {}
+
+        for name in names:
+            if name in packed:
+                encoded.append(packed[name])
+                continue
+
+            column = table[name]
+            source = column if sources is None else sources[name]
+            params = (precisions[name], features)
+            entry = self._column_cache.get((encoding, name))
+
+            if entry is not None and entry[0] is source and entry[1] == params:
+                encoded.append(entry[2])
+                continue
+
+            if encoding == "binary":
+                value = encode_column_binary(column, *params)
+            else:
+                value = _csv_column_lines(column, precisions[name])
+
+            if sources is not None:
+                self._column_cache[encoding, name] = (source, params, value)
+
+            encoded.append(value)
+
+        if sources is not None:
+            for key in list(self._column_cache):
+                if key[1] not in table.colnames:
+                    del self._column_cache[key]
+
+        return encoded
+
+    def _csv_text(self, table, names=None):
+        columns = self._encoded_columns(table, "csv", names)
+
+        if len(columns) < 2 or any(c is None for c in columns):
+            if names is not None:
+                table = table[names]
+            return csv_table_win_newline(table)
+
+        return _join_csv_columns(columns)
+
+    @property
+    def _table_csv(self):
+        # The CSV text of the table is cached so that when rows are appended,
+        # the rows that we've already sent don't need to be formatted again.
+        # Anything that modifies the table contents must clear the cache.
+        if self._csv_cache is None:
+            names = self._sent_colnames()
+            self._csv_cache = self._csv_text(self._sent_table(), names)
+            self._shipped_columns = self._column_precisions(names)
+        return self._csv_cache
+
+    def _csv_b64(self, csv):
+        """
+        Base64-encode the CSV text *csv*. The result is cached, so that sending
+        the same table again doesn't encode it again.
+        """
+        if self._b64_cache is None or self._b64_cache[0] is not csv:
+            b64 = b64encode(csv.encode("ascii", errors="replace")).decode("ascii")
+            self._b64_cache = (csv, b64)
+
+        return self._b64_cache[1]
+
+    def _use_binary_encoding(self):
+        return self.data_encoding == "binary" and self.parent._supports_table_encoding(
+            "binary"
+        )
+
+    def _encode_table(self):
+        """
+        Encode the table for sending to WWT. Returns a dict of message fields
+        describing the data, and a list of binary message buffers (or None).
+        CSV data are given as text in a ``"csv"`` field, which
+        :meth:`_send_data` turns into the base64-encoded ``"table"`` field of
+        the message.
+        """
+        if self._use_binary_encoding():
+            names = self._sent_colnames()
+            self._shipped_columns = self._column_precisions(names)
+            return self._encode_rows(self._sent_table(), names)
+
+        # TODO: We need to make sure that the table has ra/dec columns since
+        # WWT absolutely needs that upon creation.
+
+        return {"csv": self._table_csv}, None
+
+    def _encode_rows(self, table, names):
+        """
+        Encode the columns *names* of *table*, which may be a subset of the
+        rows to send, in the same way as :meth:`_encode_table`.
+        """
+        if self._use_binary_encoding():
+            schema, buffers = encode_table_binary(
+                Table([table[name] for name in names], copy=False),
+                self._encoded_columns(table, "binary", names),
+            )
+            return {"tableEncoding": "binary", "tableSchema": schema}, buffers
+
+        return {"csv": self._csv_text(table, names)}, None
+
+    def _send_table(self, event, **kwargs):
+        table = self._sent_table()
+
+        if self.parent._supports_table_feature("datasets"):
+            # Layers showing the same data share a single copy of it in WWT,
+            # so that it's only sent once.
+            old_dataset = self._dataset
+            self._dataset, shared = self.parent.layers._acquire_dataset(
+                self._dataset_key(table), self.id
+            )
+
+            if old_dataset is not None and old_dataset != self._dataset:
+                self.parent.layers._release_dataset(old_dataset, self.id)
+
+            kwargs["tableDataset"] = self._dataset
+
+            if shared:
+                self._shipped_columns = self._column_precisions(self._sent_colnames())
+                self._cancel_uploads()
+                self.parent._send_msg(event=event, id=self.id, **kwargs)
+                return
+
+        if self.chunk_rows and len(table) > self.chunk_rows:
+            if self.parent._supports_table_feature("append"):
+                self._send_table_in_chunks(event, table, **kwargs)
+                return
+
+            warnings.warn(
+                "this viewer can't receive table data in pieces, so the whole "
+                "table is encoded at once rather than chunk_rows rows at a time"
+            )
+
+        fields, buffers = self._encode_table()
+        fields.update(kwargs)
+        self._send_data(event, fields, buffers)
+
+    def _send_columns(self, names):
+        """
+        Send WWT the columns *names*, which have been added or changed. If the
+        app supports it, only these columns are sent, as a
+        ``table_layer_columns`` message; otherwise the whole table is sent.
+        """
+        self._csv_cache = None
+
+        if not self.parent._supports_table_feature("columns"):
+            self._send_table("table_layer_update")
+            return
+
+        if self.lod and self._lod_rows is None:
+            # The layer is still being set up; the columns will be sent with
+            # the rest of the table once it's ready.
+            return
+
+        if self._dataset is not None:
+            if self.parent.layers._dataset_shared(self._dataset, self.id):
+                # Leave the data of the other layers as they are.
+                self._send_table("table_layer_update")
+                return
+
+            self.parent.layers._retire_dataset(self._dataset)
+
+        self._shipped_columns.update(self._column_precisions(names))
+        fields, buffers = self._encode_rows(self._sent_table(), names)
+        self._send_data("table_layer_columns", fields, buffers)
+
+    def _send_data(self, event, fields, buffers):
+        """
+        Send a message with table data to WWT. If the app supports it, data
+        larger than ``upload_chunk_size`` are sent separately, uploaded in
+        pieces after the message (see
+        :meth:`pywwt.core.BaseWWTWidget._send_upload`).
+        """
+        replaced = event not in ("table_layer_append", "table_layer_columns")
+
+        if replaced:
+            # Any data that are still being uploaded are being replaced.
+            self._cancel_uploads()
+
+        fields, buffers = self._compress_payload(fields, buffers)
+        old_files = self._served_files if replaced else []
+
+        if replaced:
+            self._served_files = []
+
+        if self.serve_data and self.parent._supports_table_feature("url"):
+            try:
+                served = self._serve_payload(fields, buffers)
+            except core.DataPublishingNotAvailableError:
+                warnings.warn(
+                    "table data cannot be published over HTTP here, so they are "
+                    "sent in messages instead"
+                )
+            else:
+                self._release_served_files(old_files)
+                self.parent._send_msg(event=event, id=self.id, **served)
+                return
+
+        self._release_served_files(old_files)
+        fields = dict(fields)
+        csv = fields.pop("csv", None)
+
+        if isinstance(csv, str):
+            fields["table"] = self._csv_b64(csv)
+        elif csv is not None:
+            fields["table"] = b64encode(csv).decode("ascii")
+
+        size = len(fields.get("table", "")) + sum(
+            memoryview(buffer).nbytes for buffer in buffers or ()
+        )
+
+        if size <= self.upload_chunk_size or not self.parent._supports_table_feature(
+            "chunked"
+        ):
+            self.parent._send_msg(event=event, id=self.id, buffers=buffers, **fields)
+            return
+
+        fields, pieces = _split_table_payload(fields, buffers, self.upload_chunk_size)
+        upload = str(uuid.uuid4())
+        self.parent._send_msg(
+            event=event,
+            id=self.id,
+            tableUpload=upload,
+            tableChunks=len(pieces),
+            **fields,
+        )
+
+        messages = []
+        sizes = []
+
+        for seq, (piece, piece_buffers) in enumerate(pieces):
+            piece.update(event="table_layer_chunk", id=self.id, upload=upload, seq=seq)
+            messages.append((piece, piece_buffers))
+            sizes.append(
+                len(piece.get("data", ""))
+                + sum(buffer.nbytes for buffer in piece_buffers or ())
+            )
+
+        task = self.parent._send_upload(
+            messages, progress=self._upload_progress_reporter(sizes)
+        )
+
+        if task is not None:
+            self._uploads = [t for t in self._uploads if not t.done()] + [task]
+
+    def _compression_method(self):
+        """
+        Get the method to compress table data with, or None.
+        """
+        if self.data_compression == "auto":
+            methods = TABLE_COMPRESSIONS
+        elif self.data_compression == "none":
+            methods = []
+        else:
+            methods = [self.data_compression]
+
+        for method in methods:
+            if self.parent._supports_table_compression(method):
+                return method
+
+        return None
+
+    def _compress_payload(self, fields, buffers):
+        """
+        Compress the table data of a message, as returned by
+        :meth:`_encode_table`, if they are large enough for it to be
+        worthwhile. Returns the new message fields and buffers. The
+        compression method is given in the ``"tableCompression"`` field: the
+        CSV text is replaced by the compressed bytes, which are base64-encoded
+        when the message is sent, and binary buffers are compressed one by
+        one.
+        """
+        method = self._compression_method()
+        text = fields.get("csv")
+
+        if text is not None:
+            size = len(text)
+        else:
+            size = sum(memoryview(buffer).nbytes for buffer in buffers or ())
+
+        if method is None or size < COMPRESSION_THRESHOLD:
+            return fields, buffers
+
+        fields = dict(fields, tableCompression=method)
+
+        if text is not None:
+            fields["csv"] = compress_payload(
+                text.encode("ascii", errors="replace"), method
+            )
+        else:
+            buffers = [compress_payload(buffer, method) for buffer in buffers]
 
-        wwt_times = Column(self._get_table()[self.time_att].copy()).tolist()
-        # must specify Column so we can use tolist() on astropy Time columns
+        return fields, buffers
 
-        # Convert time column to UTC so WWT displays points at expected times
-        for i, tm in enumerate(wwt_times):
-            wwt_times[i] = ensure_utc(tm, str_allowed=True)
+    def _serve_payload(self, fields, buffers):
+        """
+        Write the table data of a message to a file named after a hash of its
+        contents, and publish it. Returns the fields of the message with the
+        data replaced by the ``"tableUrl"`` at which they are published. For
+        binary data, the file holds the buffers one after another, and their
+        sizes are given in ``"tableBufferSizes"``.
+        """
+        fields = dict(fields)
+        csv = fields.pop("csv", None)
 
-        # Update the table passed to WWT with the new, modified time column
-        self._get_table()[TIME_COLUMN_NAME] = Column(wwt_times)
+        if csv is not None:
+            if isinstance(csv, str):
+                csv = csv.encode("ascii", errors="replace")
 
-        self.parent._send_msg(
-            event="table_layer_update", id=self.id, table=self._table_b64
-        )
+            chunks = [csv]
+            extension = ".csv"
+        else:
+            chunks = [memoryview(buffer).cast("B") for buffer in buffers]
+            fields["tableBufferSizes"] = [chunk.nbytes for chunk in chunks]
+            extension = ".bin"
 
-        self.parent._send_msg(
-            event="table_layer_set",
-            id=self.id,
-            setting="startDateColumn",
-            value=TIME_COLUMN_NAME,
+        extension += COMPRESSION_EXTENSIONS.get(fields.get("tableCompression"), "")
+        digest = hashlib.blake2b(digest_size=16)
+
+        for chunk in chunks:
+            digest.update(chunk)
+
+        filename = path.join(
+            self.parent.layers._temporary_directory(), digest.hexdigest() + extension
         )
 
-    @observe("selectable")
-    def _on_selectable_change(self, changed):
-        if not self.notify_changes:
-            return
+        # If the file already exists, it has the same contents, so its URL
+        # doesn't change and the viewer can use its cached copy.
+        if not path.exists(filename):
+            partial = filename + ".part"
 
-        self.parent._send_msg(
-            type="modify_selectability", id=self.id, selectable=changed["new"]
+            with open(partial, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+
+            os.replace(partial, filename)
+
+        fields["tableUrl"] = self.parent._serve_file(filename)
+        self.parent.layers._acquire_served_file(filename, self.id)
+        self._served_files.append(filename)
+        return fields
+
+    def _release_served_files(self, filenames):
+        """
+        Stop using files published by :meth:`_serve_payload`, deleting them
+        unless other layers are using them too.
+        """
+        for filename in filenames:
+            if filename not in self._served_files:
+                self.parent.layers._release_served_file(filename, self.id)
+
+    def _upload_progress_reporter(self, sizes):
+        """
+        Get a function to pass as the *progress* argument of
+        :meth:`pywwt.core.BaseWWTWidget._send_upload`, reporting the progress
+        of an upload of pieces of the given *sizes* as ``upload_progress``
+        says to.
+        """
+        if not self.upload_progress:
+            return None
+
+        cumulative = np.cumsum(sizes).tolist()
+        total = cumulative[-1]
+
+        if self.upload_progress is not True:
+            return lambda n_done: self.upload_progress(cumulative[n_done - 1], total)
+
+        bar = _import_tqdm()(
+            total=total, unit="B", unit_scale=True, desc="Uploading layer data"
         )
 
-    def _get_table(self):
-        return self.table
+        def report(n_done):
+            bar.update(cumulative[n_done - 1] - bar.n)
 
-    @property
-    def _table_b64(self):
+            if n_done == len(sizes):
+                bar.close()
 
-        # TODO: We need to make sure that the table has ra/dec columns since
-        # WWT absolutely needs that upon creation.
+        return report
+
+    def _cancel_uploads(self):
+        for task in self._uploads:
+            task.cancel()
+
+        self._uploads = []
+
+    def _send_table_in_chunks(self, event, table, **kwargs):
+        """
+        Send *table* to WWT ``chunk_rows`` rows at a time: the first rows with
+        *event*, and the rest appended to them. Only one chunk is encoded at a
+        time, and it is sent right away even if messages are being batched,
+        so the memory used doesn't depend on the size of the table.
+        """
+        names = self._sent_colnames()
+        self._shipped_columns = self._column_precisions(names)
+
+        for start in range(0, len(table), self.chunk_rows):
+            fields, buffers = self._encode_rows(
+                table[start:start + self.chunk_rows], names
+            )
 
-        csv = csv_table_win_newline(self._get_table())
+            if start == 0:
+                fields.update(kwargs)
+                self._send_data(event, fields, buffers)
+            else:
+                self._send_data("table_layer_append", fields, buffers)
 
-        return b64encode(csv.encode("ascii", errors="replace")).decode("ascii")
+            self.parent._flush_batch()
 
     def _uniform_color(self):
         return not self.cmap_att or self.cmap_vmin is None or self.cmap_vmax is None
@@ -1312,21 +3409,47 @@ class TableLayer(HasTraits):
         return not self.size_att or self.size_vmin is None or self.size_vmax is None
 
     def _initialize_layer(self):
-        self.parent._send_msg(
-            event="table_layer_create",
-            id=self.id,
-            table=self._table_b64,
-            frame=self.frame,
-        )
+        self._send_table("table_layer_create", frame=self.frame)
 
-    def update_data(self, table=None):
+    def update_data(self, table=None, mode="replace"):
         """
         Update the underlying data.
+
+        Parameters
+        ----------
+        table : :class:`~astropy.table.Table`
+            The new data.
+        mode : ``"replace"`` or ``"append"``, optional
+            If ``"replace"`` (the default), the layer's data are replaced with
+            *table*. If ``"append"``, the rows of *table* are appended to the
+            existing data, as in :meth:`append_rows`.
         """
+        if mode == "append":
+            self.append_rows(table)
+            return
+        elif mode != "replace":
+            raise ValueError('mode should be one of "replace"/"append"')
+
         self.table = table.copy(copy_data=False)
-        self.parent._send_msg(
-            event="table_layer_update", id=self.id, table=self._table_b64
-        )
+        self._table_file = None
+        self._csv_cache = None
+        self._joined = None
+        self._column_cache.clear()
+        self._cmap_hex_cache.clear()
+        self._column_stats_cache.clear()
+        self._column_digest_cache.clear()
+        self._lod_index = None
+
+        derived = self._derive_columns(self.table)
+        self._derived.clear()
+
+        for name, values in derived.items():
+            self._set_derived(name, values)
+
+        if self.lod:
+            self._refresh_lod(force=True)
+        else:
+            self._send_table("table_layer_update")
 
         if len(self.alt_att) > 0:
             if self.alt_att in self.table.colnames:
@@ -1344,13 +3467,169 @@ class TableLayer(HasTraits):
         if self.lat_att not in self.table.colnames:
             self.lat_att = lat_guess or self.table.colnames[1]
 
+    def append_rows(self, table):
+        """
+        Append rows to the underlying data.
+
+        Only the new rows are encoded. If the WWT viewer supports it, only the
+        new rows are sent to it, too; otherwise the full table is sent, reusing
+        the already-encoded data for the existing rows. If the new rows change
+        the precision to which columns are sent (see ``data_precision``), the
+        full table is encoded and sent again.
+
+        Parameters
+        ----------
+        table : :class:`~astropy.table.Table`
+            The rows to append. This table must have the same columns as the
+            layer's current data.
+        """
+        if self._table_file is not None:
+            raise ValueError(
+                "rows cannot be appended to a layer whose data are read from a file"
+            )
+
+        if table.colnames != self.table.colnames:
+            raise ValueError(
+                "appended rows must have the same columns as the layer's data "
+                "({0})".format(", ".join(self.table.colnames))
+            )
+
+        # Keep our derived columns up-to-date, computing them for the new rows
+        # only.
+        derived = self._derive_columns(table)
+        new_rows = _join_columns(table, derived)
+
+        old_csv = self._csv_cache
+        old_sources = self._column_sources(self._data_table())
+        names = self._sent_colnames()
+        old_precisions = self._column_precisions(names)
+        self.table = vstack(
+            [self.table, table], join_type="exact", metadata_conflicts="silent"
+        )
+
+        for name, values in derived.items():
+            self._set_derived(name, np.concatenate([self._derived[name], values]))
+
+        self._csv_cache = None
+        self._column_stats_cache.clear()
+        self._column_digest_cache.clear()
+
+        if self.lod:
+            # The new rows may or may not be in view, and may change which of
+            # the existing rows are sampled.
+            self._lod_index = None
+            self._refresh_lod(force=True)
+            return
+
+        if self._dataset is not None:
+            if self.parent.layers._dataset_shared(self._dataset, self.id):
+                # Leave the data of the other layers as they are.
+                self._send_table("table_layer_update")
+                return
+
+            self.parent.layers._retire_dataset(self._dataset)
+
+        precisions = self._column_precisions(names)
+
+        if precisions != old_precisions:
+            # With the new rows, some columns need to be sent to a different
+            # precision, so encode them again in full rather than mixing two
+            # precisions in one column.
+            self._send_table("table_layer_update")
+            return
+
+        # Only send the columns that WWT already has.
+        if self.column_projection:
+            new_rows = new_rows[
+                [name for name in new_rows.colnames if name in self._shipped_columns]
+            ]
+
+        if self._use_binary_encoding():
+            # Binary encoding of existing rows is just a copy, so we don't
+            # bother caching it.
+            if self.parent._supports_table_feature("append"):
+                schema, buffers = encode_table_binary(
+                    new_rows, self._encoded_columns(new_rows, "binary")
+                )
+                self._shipped_columns.update(
+                    (name, precisions[name])
+                    for name in new_rows.colnames
+                    if name in precisions
+                )
+                self._send_data(
+                    "table_layer_append",
+                    {"tableEncoding": "binary", "tableSchema": schema},
+                    buffers,
+                )
+            else:
+                self._send_table("table_layer_update")
+            return
+
+        new_columns = self._encoded_columns(new_rows, "csv")
+
+        if len(new_columns) < 2 or any(c is None for c in new_columns):
+            new_csv = csv_table_win_newline(new_rows)
+        else:
+            new_csv = _join_csv_columns(new_columns)
+
+            # Carry over the encoded columns of the existing rows, too
+            new_sources = self._column_sources(self._data_table())
+
+            for name, lines in zip(new_rows.colnames, new_columns):
+                entry = self._column_cache.get(("csv", name))
+
+                if entry is not None and entry[0] is old_sources[name]:
+                    self._column_cache["csv", name] = (
+                        new_sources[name],
+                        entry[1],
+                        entry[2] + lines[1:],
+                    )
+
+        if old_csv is not None:
+            # Reuse the cached text, dropping the header line of the new rows.
+            self._csv_cache = old_csv + new_csv[new_csv.index("\r\n") + 2:]
+
+        if self.parent._supports_table_feature("append"):
+            self._shipped_columns.update(
+                (name, precisions[name])
+                for name in new_rows.colnames
+                if name in precisions
+            )
+            self._send_data("table_layer_append", {"csv": new_csv}, None)
+        else:
+            self._send_table("table_layer_update")
+
+    def batch(self):
+        """
+        Batch up the messages sent to WWT, so that several settings can be
+        changed at once. This is a shortcut for
+        :meth:`pywwt.core.BaseWWTWidget.batch` on the parent widget::
+
+            >>> with layer.batch():
+            ...     layer.size_att = "mag"
+            ...     layer.size_vmin = 10
+            ...     layer.size_vmax = 20
+        """
+        return self.parent.batch()
+
     def remove(self):
         """
         Remove the layer.
         """
         if self._removed:
             return
+        self._stop_lod_refreshes()
+        self._cancel_uploads()
         self.parent._send_msg(event="table_layer_remove", id=self.id)
+
+        if self._dataset is not None:
+            self.parent.layers._release_dataset(self._dataset, self.id)
+            self._dataset = None
+
+        served_files = self._served_files
+        self._served_files = []
+        self._release_served_files(served_files)
+
         self._removed = True
         if self._manager is not None:
             self._manager.remove_layer(self)
@@ -1367,6 +3646,8 @@ class TableLayer(HasTraits):
         wwt_name = self.trait_metadata(changed["name"], "wwt")
         if wwt_name is not None:
             value = changed["new"]
+            if changed["name"] in COLUMN_ATTRIBUTES and value:
+                self._ship_new_columns()
             if changed["name"] == "alt_unit":
                 value = VALID_ALT_UNITS[self._check_alt_unit({"value": value})]
             elif changed["name"] == "lon_unit":
@@ -1429,7 +3710,10 @@ class TableLayer(HasTraits):
 
     def _save_data_for_serialization(self, dir):
         file_path = path.join(dir, "{0}.csv".format(self.id))
-        table_str = csv_table_win_newline(self.table)
+        if self._csv_cache is not None and not self.lod:
+            table_str = self._csv_cache
+        else:
+            table_str = self._csv_text(self._data_table(), self._sent_colnames())
         with open(
             file_path, "wb"
         ) as file:  # binary mode to preserve windows line endings
@@ -1487,6 +3771,19 @@ class CatalogHipsLayer(TableLayer):
         # skeleton table so that we can reverse-map column names:
         self.table = Table(names=app_msg["spreadsheetInfo"]["header"])
 
+        # The rows of the HiPS tiles that we've fetched, keyed by HEALPix
+        # (order, pixel), least recently visible first.
+        self._tiles = OrderedDict()
+
+        # Bumped for every request for rows, and whenever the view changes
+        # under an automatic refresh, so that stale replies can be told apart.
+        self._request_sequence = 0
+
+        self._auto_refresh_delay = None
+        self._auto_refresh_callback = None
+        self._auto_refresh_timer = None
+        self._auto_refresh_task = None
+
         settings = app_msg["spreadsheetInfo"]["settings"]
 
         def mapCol(x):
@@ -1545,24 +3842,207 @@ class CatalogHipsLayer(TableLayer):
         Returns
         -------
         table : :class:`~astropy.table.Table`
+
+        Notes
+        -----
+        If the app supports it, the rows are fetched tile by tile, and the
+        rows of up to ``HIPS_TILE_CACHE_SIZE`` tiles are kept, so that each
+        refresh only fetches the tiles that have come into view since they
+        were last seen. The rows are also sent in binary form where possible.
+
+        If another refresh is started before this one completes, the table
+        is only updated with the rows from the latest one.
         """
 
-        fut = self.parent._send_into_future(
-            timeout=timeout,
-            event="layer_hipscat_datainview",
-            tableId=self.id,
-            limit=True,
-        )
+        self._request_sequence += 1
+        sequence = self._request_sequence
+        table = await self._fetch_rows(timeout)
+
+        if sequence == self._request_sequence:
+            self.table = table
+        return table
+
+    async def _fetch_rows(self, timeout, sequence=None):
+        """
+        Fetch the rows that are currently visible in the WWT viewer, without
+        updating the Python table.
+
+        If *sequence* is given and a newer request has been made by the time
+        the reply arrives, the reply is discarded and None is returned.
+        """
+        request = {"event": "layer_hipscat_datainview", "tableId": self.id}
+        tiled = self.parent._supports_table_feature("hipsTiles")
+
+        if self.parent._supports_binary_buffers and self.parent._supports_table_feature(
+            "binaryReplies"
+        ):
+            request["encoding"] = "binary"
+
+        if tiled:
+            request["tiles"] = True
+            request["knownTiles"] = [list(key) for key in self._tiles]
+
+        fut = self.parent._send_into_future(timeout=timeout, limit=True, **request)
 
         reply = await fut
-        self.table = Table.read(reply["data"], format="ascii.tab")
-        return self.table
+
+        if sequence is not None and sequence != self._request_sequence:
+            return None
+
+        if tiled and "tiles" in reply:
+            return self._table_from_tiles(reply)
+        return self._decode_rows(reply, reply.get("buffers"))
+
+    def auto_refresh(self, enable=True, delay=HIPS_REFRESH_DELAY, callback=None):
+        """
+        Keep the Python table up to date with the data that are visible in the
+        WWT viewer as the view changes.
+
+        Parameters
+        ----------
+        enable : bool, optional
+            Whether to refresh the table automatically. Pass False to stop.
+        delay : float, optional
+            How long to wait for the view to settle before refreshing the
+            table, in seconds.
+        callback : callable, optional
+            A function to call with the new table after each refresh.
+
+        Notes
+        -----
+        The table is refreshed once the view has stopped changing for *delay*
+        seconds, so that a burst of camera moves only leads to one refresh.
+        Only one request for data is sent to the app at a time: if the view
+        settles somewhere new while a request is under way, its reply is
+        discarded without being decoded, and a new request is sent as soon as
+        it arrives.
+
+        Automatic refreshes need a running asyncio event loop, as there is in
+        Jupyter.
+        """
+        self._stop_auto_refresh()
+
+        if not enable:
+            return
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError("automatic refreshes need a running asyncio event loop")
+
+        self._auto_refresh_delay = delay
+        self._auto_refresh_callback = callback
+        self.parent._view_state_listeners.append(self._on_auto_refresh_view_change)
+        self._start_auto_refresh()
+
+    def _stop_auto_refresh(self):
+        if self._auto_refresh_timer is not None:
+            self._auto_refresh_timer.cancel()
+            self._auto_refresh_timer = None
+
+        if self._auto_refresh_task is not None:
+            self._auto_refresh_task.cancel()
+            self._auto_refresh_task = None
+
+        listeners = self.parent._view_state_listeners
+
+        if self._on_auto_refresh_view_change in listeners:
+            listeners.remove(self._on_auto_refresh_view_change)
+
+    def _on_auto_refresh_view_change(self):
+        # The same debouncing as for level-of-detail table layers.
+        if self._auto_refresh_timer is not None:
+            self._auto_refresh_timer.cancel()
+            self._auto_refresh_timer = None
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        self._auto_refresh_timer = loop.call_later(
+            self._auto_refresh_delay, self._start_auto_refresh
+        )
+
+    def _start_auto_refresh(self):
+        self._auto_refresh_timer = None
+
+        if self._auto_refresh_task is not None:
+            self._request_sequence += 1
+            return
+
+        self._auto_refresh_task = asyncio.ensure_future(self._run_auto_refresh())
+
+    async def _run_auto_refresh(self):
+        try:
+            table = None
+
+            while table is None:
+                self._request_sequence += 1
+                table = await self._fetch_rows(60, self._request_sequence)
+
+            self.table = table
+
+            if self._auto_refresh_callback is not None:
+                self._auto_refresh_callback(table)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("failed to refresh HiPS catalog layer data")
+        finally:
+            if self._auto_refresh_task is asyncio.current_task():
+                self._auto_refresh_task = None
+
+    def _decode_rows(self, fields, buffers):
+        """
+        Decode rows sent by the app, either as tab-separated text or in the
+        binary columnar format.
+        """
+        if fields.get("encoding") == "binary":
+            return decode_table_binary(fields["schema"], buffers)
+        return decode_table_tsv(fields["data"])
+
+    def _table_from_tiles(self, reply):
+        """
+        Update the tile cache from a tiled ``layer_hipscat_datainview`` reply,
+        and combine the rows of the tiles that are in view.
+
+        The reply's ``"tiles"`` lists the (order, pixel) of the tiles in view.
+        Its ``"tileData"`` holds the rows of the ones that we didn't already
+        have, with ``"order"`` and ``"pixel"`` fields identifying them.
+        """
+        buffers = reply.get("buffers")
+
+        for tile in reply.get("tileData", ()):
+            key = (tile["order"], tile["pixel"])
+            self._tiles[key] = self._decode_rows(tile, buffers)
+
+        tables = []
+
+        for order, pixel in reply["tiles"]:
+            rows = self._tiles.get((order, pixel))
+
+            if rows is not None:
+                self._tiles.move_to_end((order, pixel))
+                tables.append(rows)
+
+        while len(self._tiles) > HIPS_TILE_CACHE_SIZE:
+            self._tiles.popitem(last=False)
+
+        if not tables:
+            return Table(names=self.table.colnames)
+
+        return vstack(tables, metadata_conflicts="silent")
 
     def update_data(self, table=None):
         raise Exception(
             "HiPS catalogs data can only be updated by changing the field of view"
         )
 
+    def remove(self):
+        self._stop_auto_refresh()
+        super().remove()
+
     def __str__(self):
         return "Catalog HiPS Layer: {0}".format(self.id)
 
@@ -1589,6 +4069,7 @@ class ImageLayer(HasTraits):
         # manager if a layer is removed.
         self._manager = None
         self._removed = False
+        self._cache_hold = None
 
         self._stretch_version = 0
         self._cmap_version = 0
@@ -1605,10 +4086,39 @@ class ImageLayer(HasTraits):
 
             # "Classic" mode, processing a single FITS-like input. Transform the
             # image so that it is always acceptable to WWT (Equatorial, TAN
-            # projection, double values) and write out to a temporary file.
-            self._sanitized_image = tempfile.mktemp()
-            sanitize_image(image, self._sanitized_image, **kwargs)
+            # projection, double values) and write out to a temporary file,
+            # unless the file can be served as it is.
+            compatible = isinstance(image, str) and wwt_compatible_file(
+                image, hdu_index=kwargs.get("hdu_index")
+            )
+            cache = None
+
+            if isinstance(image, str) and not compatible:
+                cache = self.parent.layers._usable_tile_cache()
+
+            if cache is None:
+                self._sanitized_image = sanitize_image(
+                    image, tempfile.mktemp(), compatible=compatible, **kwargs
+                )
+            else:
+                key = TileCache.key(
+                    "sanitized",
+                    file_digest(image),
+                    kwargs.get("hdu_index"),
+                )
+                self._sanitized_image = cache.get(
+                    key,
+                    lambda filename: sanitize_image(
+                        image, filename, compatible=False, **kwargs
+                    ),
+                    name="sanitized.fits",
+                )
+
+                # Keep the image in the cache for as long as it's being served.
+                self._cache_hold = cache.hold(self._sanitized_image)
             kwargs.pop("hdu_index", None)
+            kwargs.pop("parallel", None)
+            kwargs.pop("memory_limit", None)
 
             # The first thing we need to do is make sure the image is being served.
             # For now we assume that image is a filename, but we could do more
@@ -1618,10 +4128,11 @@ class ImageLayer(HasTraits):
                 self._sanitized_image, extension=".fits"
             )
 
-            data = fits.getdata(self._sanitized_image)
-            self.vmin, self.vmax = np.nanpercentile(data, [0.5, 99.5])
-            self._data_min = np.nanmin(data)
-            self._data_max = np.nanmax(data)
+            self._data_stats = _array_stats(fits.getdata(self._sanitized_image))
+            self.vmin = self._data_stats["percentiles"][0.5]
+            self.vmax = self._data_stats["percentiles"][99.5]
+            self._data_min = self._data_stats["min"]
+            self._data_max = self._data_stats["max"]
 
             self.parent._send_msg(
                 event="image_layer_create",
@@ -1692,6 +4203,19 @@ class ImageLayer(HasTraits):
                 )
             return proposal["value"]
 
+    def batch(self):
+        """
+        Batch up the messages sent to WWT, so that several settings can be
+        changed at once. This is a shortcut for
+        :meth:`pywwt.core.BaseWWTWidget.batch` on the parent widget::
+
+            >>> with layer.batch():
+            ...     layer.vmin = 0
+            ...     layer.vmax = 100
+            ...     layer.stretch = "log"
+        """
+        return self.parent.batch()
+
     def remove(self):
         """
         Remove the layer.
@@ -1700,6 +4224,11 @@ class ImageLayer(HasTraits):
             return
         self.parent._send_msg(event="image_layer_remove", id=self.id)
         self._removed = True
+
+        if self._cache_hold is not None:
+            self._cache_hold.release()
+            self._cache_hold = None
+
         if self._manager is not None:
             self._manager.remove_layer(self)
 
@@ -1774,3 +4303,187 @@ class ImageLayer(HasTraits):
 
     def __repr__(self):
         return "<{0}>".format(str(self))
+
+
+class ImageLayerTask(object):
+    """
+    An image layer that is being added in the background, as returned by
+    :meth:`LayerManager.add_image_layer_async`.
+
+    Awaiting the task gives the image layer once the image has been tiled::
+
+        >>> task = wwt.layers.add_image_layer_async('big_image.fits')
+        >>> layer = await task
+    """
+
+    def __init__(self, manager):
+        self._manager = manager
+        self._task = None
+        self._process = None
+        self._preview = None
+        self._status = "tiling"
+        self._progress = None
+
+    def __repr__(self):
+        return "<ImageLayerTask ({0})>".format(self._status)
+
+    @property
+    def preview(self):
+        """
+        The :class:`ImageLayer` showing a low-resolution preview of the image
+        while it is tiled, or `None`.
+        """
+        return self._preview
+
+    @property
+    def status(self):
+        """
+        The state of the task: ``"tiling"``, ``"done"``, ``"cancelled"``, or
+        ``"failed"``.
+        """
+        return self._status
+
+    @property
+    def progress(self):
+        """
+        The fraction of the current stage of tiling that is done, from 0 to 1,
+        or `None` if this isn't known yet. toasty tiles an image in a few
+        stages, such as computing the most detailed tiles and then
+        downsampling them, and each of them goes from 0 to 1. The progress is
+        1 once the task is done, and is only reported when the image is tiled
+        in a separate process.
+        """
+        return self._progress
+
+    def __await__(self):
+        return self._task.__await__()
+
+    def done(self):
+        """
+        Determine whether the task has finished, successfully or not.
+        """
+        return self._task.done()
+
+    def result(self):
+        """
+        Get the image layer, once the task has finished.
+
+        Returns
+        -------
+        layer : :class:`ImageLayer`
+
+        Raises
+        ------
+        :exc:`asyncio.InvalidStateError`
+            If the image is still being tiled.
+        """
+        return self._task.result()
+
+    def cancel(self):
+        """
+        Stop tiling the image, and remove its preview.
+
+        Returns
+        -------
+        cancelled : bool
+            Whether the task was cancelled, rather than having finished
+            already.
+        """
+        return self._task.cancel()
+
+    def _show_preview(self, filename, hdu_index, wcs_key, name):
+        if isinstance(hdu_index, list):
+            hdu_index = hdu_index[0]
+
+        if name is None:
+            name = _tiles_name(filename, None)
+
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                image = _preview_image(filename, hdu_index=hdu_index, wcs_key=wcs_key)
+                self._preview = self._manager._create_and_add_image_layer(
+                    image=image, name=name + " (preview)"
+                )
+        except Exception:
+            # The preview is only a nicety, so carry on without it
+            logger.warning("could not make a preview of %s", filename, exc_info=True)
+
+    async def _run(self, tile, name, kwargs):
+        out_dir = await self._run_worker(tile)
+        return self._manager._add_tiled_layer(
+            out_dir, _read_imageset(out_dir), name, **kwargs
+        )
+
+    def _finish(self, task):
+        # This is called however the task ends, even if it is cancelled
+        # before it starts.
+        if task.cancelled():
+            self._status = "cancelled"
+        elif task.exception() is not None:
+            # Nothing may be waiting for this task, so report the problem here.
+            self._status = "failed"
+            logger.error("failed to tile image", exc_info=task.exception())
+        else:
+            self._status = "done"
+            self._progress = 1.0
+
+        # The preview may have been removed already.
+        preview = self._preview
+        self._preview = None
+
+        if preview is not None and preview in self._manager._layers:
+            self._manager.remove_layer(preview)
+
+    async def _run_worker(self, func):
+        """
+        Call *func* in a worker process, or in a thread where processes can't
+        be stopped together with the processes that they start, and return its
+        result.
+        """
+        loop = asyncio.get_running_loop()
+
+        if os.name == "nt":
+            return await loop.run_in_executor(None, func)
+
+        context = _worker_context()
+        receiver, sender = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_run_in_process_group, args=(sender, func)
+        )
+        self._process.start()
+        sender.close()
+
+        # Cancelling this coroutine doesn't stop the thread that is waiting for
+        # the result, so the pipe is only closed once that thread has returned,
+        # which it does when the process stops.
+        receiving = loop.run_in_executor(None, self._receive, receiver)
+        receiving.add_done_callback(functools.partial(_close_receiver, receiver))
+
+        try:
+            ok, result = await asyncio.shield(receiving)
+        except EOFError:
+            raise RuntimeError("the tiling process stopped unexpectedly")
+        except asyncio.CancelledError:
+            await loop.run_in_executor(None, _stop_process_group, self._process)
+            raise
+
+        await loop.run_in_executor(None, self._process.join)
+
+        if not ok:
+            raise result
+
+        return result
+
+    def _receive(self, receiver):
+        """
+        Receive the messages of a worker process until it sends its result,
+        keeping track of its progress.
+        """
+        while True:
+            message = receiver.recv()
+
+            if message[0] == "progress":
+                self._progress = message[1]
+            else:
+                return message[1:]
@@ -0,0 +1,171 @@
+# Copyright 2021 the .NET Foundation
+# Licensed under the three-clause BSD License
+
+"""
+Level-of-detail support for very large table layers.
+
+It isn't feasible to send tables with many millions of rows to the WWT
+frontend. Instead, table layers can be put into a level-of-detail mode in which
+pywwt builds a HEALPix-based spatial index of the table, and uses it to send
+only a density-limited subset of the rows that are in the current field of
+view. The number of rows sent is bounded regardless of the size of the table.
+
+You do not need to use this module unless you are a pywwt developer.
+"""
+
+import numpy as np
+from astropy import units as u
+from astropy_healpix import HEALPix, lonlat_to_healpix
+
+__all__ = ["HealpixIndex"]
+
+# The deepest HEALPix order used by the index. Cells at this order are about
+# 0.2 arcseconds across.
+MAX_ORDER = 20
+
+
+def _ranges_to_indices(starts, stops):
+    """
+    Concatenate ``np.arange(start, stop)`` for each pair of *starts* and
+    *stops*, without a Python loop.
+    """
+    lengths = stops - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class HealpixIndex(object):
+    """
+    A hierarchical HEALPix index of points on the sky.
+
+    Each point is assigned to a level of the HEALPix hierarchy, in the same way
+    as the rows of a HiPS catalog. For each order *k*, every HEALPix cell at
+    that order holds at most *per_cell* points of level *k*, chosen randomly
+    from the points in the cell that were not assigned to a shallower level.
+    All of the points with levels up to *k* in a region of the sky are
+    therefore a density-limited sample of the points in that region.
+
+    Parameters
+    ----------
+    lon, lat : array-like
+        The longitudes and latitudes of the points, in degrees. Points with
+        invalid coordinates are never selected.
+    per_cell : int, optional
+        The maximum number of points of each level in a cell.
+    seed : int, optional
+        The seed of the random choice of points.
+    """
+
+    def __init__(self, lon, lat, per_cell=64, seed=0):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        self.per_cell = per_cell
+
+        valid = np.isfinite(lon) & (np.abs(lat) <= 90)
+        pix = np.full(len(lon), -1, dtype=np.int64)
+        pix[valid] = lonlat_to_healpix(
+            lon[valid] * u.deg, lat[valid] * u.deg, 2 ** MAX_ORDER, order="nested"
+        )
+
+        # Invalid points get a level beyond the deepest one, so that they're
+        # never selected.
+        level = np.where(valid, MAX_ORDER, MAX_ORDER + 1).astype(np.int8)
+        remaining = np.random.default_rng(seed).permutation(np.flatnonzero(valid))
+
+        for order in range(MAX_ORDER):
+            if not len(remaining):
+                break
+
+            # Rank the remaining points within their cells at this order. Since
+            # they're in random order and the sort is stable, the first
+            # *per_cell* points of each cell are a random sample.
+            cells = pix[remaining] >> (2 * (MAX_ORDER - order))
+            by_cell = np.argsort(cells, kind="stable")
+            sorted_cells = cells[by_cell]
+            starts = np.flatnonzero(
+                np.concatenate([[True], sorted_cells[1:] != sorted_cells[:-1]])
+            )
+            counts = np.diff(np.append(starts, len(by_cell)))
+            rank = np.empty(len(by_cell), dtype=np.int64)
+            rank[by_cell] = np.arange(len(by_cell)) - np.repeat(starts, counts)
+
+            chosen = rank < per_cell
+            level[remaining[chosen]] = order
+            remaining = remaining[~chosen]
+
+        # Sort by level and then pixel, so that finding the points of a given
+        # level within a cell is a binary search.
+        self._rows = np.lexsort((pix, level))
+        self._pix = pix[self._rows]
+        self._level_starts = np.searchsorted(
+            level[self._rows], np.arange(MAX_ORDER + 2)
+        )
+        self.max_level = int(level[valid].max()) if np.any(valid) else 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def query(self, lon, lat, radius, max_rows):
+        """
+        Select a density-limited sample of the points within a circle.
+
+        The sample consists of all of the points whose levels are no deeper
+        than a certain order, in the cells at that order that overlap the
+        circle. The order is chosen to be as deep as possible while keeping
+        the number of points below *max_rows*.
+
+        Parameters
+        ----------
+        lon, lat : float
+            The center of the circle, in degrees.
+        radius : float
+            The radius of the circle, in degrees.
+        max_rows : int
+            The maximum number of points to select.
+
+        Returns
+        -------
+        order : int
+            The HEALPix order of the sample.
+        cells : :class:`~numpy.ndarray`
+            The sorted indices of the cells at that order that overlap the
+            circle. If these are unchanged, so is the sample.
+        rows : :class:`~numpy.ndarray`
+            The sorted indices of the selected points.
+        """
+        lon = lon * u.deg
+        lat = lat * u.deg
+        radius = min(radius, 180) * u.deg
+        order, cells = 0, None
+
+        for k in range(self.max_level + 1):
+            hp = HEALPix(nside=2 ** k, order="nested")
+            k_cells = hp.cone_search_lonlat(lon, lat, radius)
+
+            # Budget for about per_cell points of this level in each cell. The
+            # points from shallower levels aren't counted here, so the sample
+            # can come out larger than max_rows; it is trimmed below.
+            if cells is not None and len(k_cells) * self.per_cell > max_rows:
+                break
+
+            order, cells = k, np.sort(k_cells)
+
+        shift = 2 * (MAX_ORDER - order)
+        pix_lo = cells << shift
+        pix_hi = (cells + 1) << shift
+        pieces = []
+
+        for level in range(order + 1):
+            start, stop = self._level_starts[level:level + 2]
+            pix = self._pix[start:stop]
+            pieces.append(
+                start
+                + _ranges_to_indices(
+                    np.searchsorted(pix, pix_lo), np.searchsorted(pix, pix_hi)
+                )
+            )
+
+        # Shallow levels come first, so if we have too many points, the deepest
+        # ones are dropped.
+        selected = np.concatenate(pieces)[:max_rows]
+        return order, cells, np.sort(self._rows[selected])
@@ -312,10 +312,21 @@ class WWTQtClient(BaseWWTWidget):
             while time.time() - time1 < duration:
                 app.processEvents()
 
-    def _actually_send_msg(self, payload):
+    def _actually_send_msg(self, payload, buffers=None):
+        # We can't attach binary buffers to messages sent through the
+        # JavaScript bridge, so ``_supports_binary_buffers`` is left unset and
+        # *buffers* will always be empty.
         jmsg = json.dumps(payload)
         return self.widget.page.runJavaScript("pywwtSendMessage({0});".format(jmsg))
 
+    def _actually_send_msgs(self, messages):
+        # Deliver the whole batch with one trip through the JavaScript bridge
+        code = ''.join(
+            'pywwtSendMessage({0});'.format(json.dumps(payload))
+            for payload, _ in messages
+        )
+        return self.widget.page.runJavaScript(code)
+
     def _serve_file(self, filename, extension=''):
         return self._data_server.serve_file(filename, extension=extension)
 
@@ -0,0 +1,255 @@
+# Copyright 2021 the .NET Foundation
+# Licensed under the three-clause BSD License
+
+"""
+Table layers backed by data files.
+
+Survey catalogs can be much larger than the available memory, and usually
+have many more columns than a table layer uses. A :class:`TableFile` describes
+a table in a FITS, HDF5 or Parquet file, and can be passed to
+:meth:`pywwt.layers.LayerManager.add_table_layer` instead of an in-memory
+:class:`~astropy.table.Table`. Only the columns that the layer uses are read,
+and where the file format allows it they are memory-mapped rather than loaded.
+"""
+
+import os
+
+import numpy as np
+from astropy.io import fits
+from astropy.table import Column, Table
+from astropy.table.meta import get_header_from_yaml
+
+__all__ = ["TableFile"]
+
+# Maps lower-case filename extensions to the formats that we can read.
+TABLE_FILE_FORMATS = {
+    ".fits": "fits",
+    ".fit": "fits",
+    ".fts": "fits",
+    ".h5": "hdf5",
+    ".hdf5": "hdf5",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("h5py is required to read tables from HDF5 files")
+    return h5py
+
+
+def _import_pyarrow_parquet():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required to read tables from Parquet files")
+    return pyarrow.parquet
+
+
+class TableFile(object):
+    """
+    A table stored in a file, whose columns are read as they are needed.
+
+    Parameters
+    ----------
+    filename : str or path-like
+        The name of the file.
+    format : ``"fits"``, ``"hdf5"`` or ``"parquet"``, optional
+        The format of the file. By default, this is guessed from the filename
+        extension.
+    hdu : int or str, optional
+        For FITS files, the HDU containing the table. By default, this is the
+        first table HDU.
+    path : str, optional
+        For HDF5 files, the path of the table dataset within the file. This is
+        required if the file contains more than one dataset.
+
+    Notes
+    -----
+    Columns of FITS tables, and of HDF5 tables stored without chunking or
+    compression, are memory-mapped, so that they are paged in by the
+    operating system rather than loaded into memory. Reading HDF5 files
+    requires `h5py <https://www.h5py.org/>`_, and reading Parquet files
+    requires `pyarrow <https://arrow.apache.org/docs/python/>`_.
+    """
+
+    def __init__(self, filename, format=None, hdu=None, path=None):
+        self.filename = os.fspath(filename)
+
+        if format is None:
+            name = self.filename.lower()
+            if name.endswith(".gz"):
+                name = name[:-3]
+            format = TABLE_FILE_FORMATS.get(os.path.splitext(name)[1])
+            if format is None:
+                raise ValueError(
+                    "cannot guess the format of {0}: specify format as one of "
+                    "{1}".format(self.filename, "/".join(self._formats()))
+                )
+        elif format not in self._formats():
+            raise ValueError(
+                "format should be one of {0}".format("/".join(self._formats()))
+            )
+
+        self.format = format
+        self.hdu = hdu
+        self.path = path
+        self._fits_table = None
+        self._column_info = {}
+
+        if format == "fits":
+            self._fits_table = self._read_fits()
+            self.colnames = self._fits_table.colnames
+            self._nrows = len(self._fits_table)
+        elif format == "hdf5":
+            with _import_h5py().File(self.filename, "r") as f:
+                dataset = self._hdf5_dataset(f)
+                self.colnames = list(dataset.dtype.names)
+                self._nrows = dataset.shape[0]
+        else:
+            parquet_file = _import_pyarrow_parquet().ParquetFile(self.filename)
+            schema = parquet_file.schema_arrow
+            self.colnames = [name for name in schema.names if not name.startswith("__")]
+            self._nrows = parquet_file.metadata.num_rows
+
+            # Astropy stores the units and descriptions of the columns in the
+            # schema metadata.
+            yaml = (schema.metadata or {}).get(b"table_meta_yaml")
+
+            if yaml is not None:
+                header = get_header_from_yaml(yaml.decode("utf-8").splitlines())
+                self._column_info = {
+                    info["name"]: info for info in header.get("datatype", [])
+                }
+
+    @staticmethod
+    def _formats():
+        return sorted(set(TABLE_FILE_FORMATS.values()))
+
+    def __len__(self):
+        return self._nrows
+
+    def __repr__(self):
+        return "<TableFile {0} ({1}, {2} rows)>".format(
+            self.filename, self.format, len(self)
+        )
+
+    def _read_fits(self):
+        if self.hdu is None:
+            # Use the first table HDU, the same as Table.read does.
+            with fits.open(self.filename, memmap=True) as hdulist:
+                for index, hdu in enumerate(hdulist):
+                    if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+                        self.hdu = index
+                        break
+                else:
+                    raise ValueError("no table found in {0}".format(self.filename))
+
+        # With memmap=True, the table columns are views of the mapped file.
+        # Masking invalid values would create in-memory copies of them.
+        return Table.read(
+            self.filename, format="fits", hdu=self.hdu, memmap=True, mask_invalid=False
+        )
+
+    def _hdf5_dataset(self, f):
+        if self.path is not None:
+            return f[self.path]
+
+        h5py = _import_h5py()
+        datasets = []
+
+        def visit(name, obj):
+            if isinstance(obj, h5py.Dataset) and obj.dtype.names is not None:
+                datasets.append(name)
+
+        f.visititems(visit)
+
+        if len(datasets) != 1:
+            raise ValueError(
+                "{0} contains {1} tables: specify which one to use with "
+                "path".format(self.filename, len(datasets))
+            )
+
+        self.path = datasets[0]
+        return f[self.path]
+
+    def read(self, names):
+        """
+        Read some of the columns of the table.
+
+        Parameters
+        ----------
+        names : list of str
+            The names of the columns to read.
+
+        Returns
+        -------
+        table : :class:`~astropy.table.Table`
+            A table containing just the requested columns, in the requested
+            order. Where possible, the columns are memory-mapped.
+        """
+        names = list(names)
+        missing = [name for name in names if name not in self.colnames]
+
+        if missing:
+            raise KeyError(
+                "columns not found in {0}: {1}".format(
+                    self.filename, ", ".join(missing)
+                )
+            )
+
+        if self.format == "fits":
+            return Table([self._fits_table[name] for name in names], copy=False)
+
+        if self.format == "parquet":
+            data = _import_pyarrow_parquet().read_table(self.filename, columns=names)
+            table = Table()
+
+            for name in names:
+                values = data[name].to_numpy()
+
+                if values.dtype.kind == "O":
+                    values = values.astype(str)
+
+                info = self._column_info.get(name, {})
+                table.add_column(
+                    Column(
+                        values,
+                        name=name,
+                        unit=info.get("unit"),
+                        description=info.get("description"),
+                        copy=False,
+                    ),
+                    copy=False,
+                )
+
+            return table
+
+        h5py = _import_h5py()
+
+        with h5py.File(self.filename, "r") as f:
+            dataset = self._hdf5_dataset(f)
+            offset = dataset.id.get_offset()
+
+            if dataset.chunks is None and offset is not None:
+                data = np.memmap(
+                    self.filename,
+                    dtype=dataset.dtype,
+                    mode="r",
+                    offset=offset,
+                    shape=dataset.shape,
+                )
+                return Table([data[name] for name in names], names=names, copy=False)
+
+            if not names:
+                return Table()
+
+            data = dataset.fields(names)[()]
+
+            if len(names) == 1:
+                return Table([data], names=names, copy=False)
+
+            return Table(data, copy=False)
@@ -6,7 +6,7 @@ This package contains the pywwt tests. This particular module contains some
 infrastructure to help with the image-output tests, which can be pretty finicky.
 """
 
-__all__ = ['assert_widget_image', 'wait_for_test']
+__all__ = ['assert_widget_image', 'binary_client', 'queued', 'wait_for_test']
 
 from glob import glob
 import os.path
@@ -86,6 +86,33 @@ def assert_widget_image(tmpdir, widget, filename, fail_now=True):
     return '{}: {}'.format(filename, msg)
 
 
+def binary_client():
+    """
+    Get a widget whose app supports the binary table encoding. Its messages
+    stay in its startup queue, where :func:`queued` finds them.
+    """
+    from ..core import BaseWWTWidget
+
+    client = BaseWWTWidget()
+    client._supports_binary_buffers = True
+    client._on_app_message_received(
+        {'type': 'wwt_application_state', 'tableEncodings': ['binary']}
+    )
+    return client
+
+
+def queued(client, event):
+    """
+    Get the ``(msg, buffers)`` tuples of the queued messages of *client* that
+    are *event* messages.
+    """
+    return [
+        (msg, buffers)
+        for msg, buffers in client._startupMessageQueue
+        if msg.get('event') == event
+    ]
+
+
 def wait_for_test(wwt, timeout, for_render=False):
     """
     On macOS with software OpenGL, every so often a single call to
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.table import MaskedColumn, Table
+
+from ..coordinates import pack_xyz, xyz_to_spherical
+from ..windows.utils import convert_xyz_to_spherical
+
+
+def test_pack_xyz():
+    table = Table()
+    table["x"] = [1.0, 2.0, 3.0] * u.pc
+    table["y"] = MaskedColumn([1, 2, 3], mask=[False, True, False])
+    table["z"] = [1000, 2000, 3000] * u.au
+
+    packed = pack_xyz(table["x"], table["y"], table["z"], unit=u.au)
+    assert packed.dtype == np.float32
+    assert packed.shape == (3, 3)
+    assert packed.flags.c_contiguous
+    np.testing.assert_allclose(packed[:, 0], ([1, 2, 3] * u.pc).to_value(u.au))
+    np.testing.assert_array_equal(packed[:, 1], [1, np.nan, 3])
+    np.testing.assert_array_equal(packed[:, 2], [1000, 2000, 3000])
+
+    # Quantities work too, and units are left alone without a target unit
+    packed = pack_xyz([1, 2] * u.km, np.zeros(2), np.ones(2), dtype=np.float64)
+    np.testing.assert_array_equal(packed, [[1, 0, 1], [2, 0, 1]])
+
+    with pytest.raises(u.UnitConversionError):
+        pack_xyz(table["x"], table["y"], [1, 2, 3] * u.deg, unit=u.au)
+
+
+def test_xyz_to_spherical():
+    lon, lat, distance = xyz_to_spherical([1, 0, 0, -2], [0, 1, 0, 0], [0, 0, 3, 0])
+    np.testing.assert_allclose(lon, [0, 90, 0, 180])
+    np.testing.assert_allclose(lat, [0, 0, 90, 0])
+    np.testing.assert_allclose(distance, [1, 1, 3, 2])
+
+
+def test_convert_xyz_to_spherical():
+    rng = np.random.default_rng(42)
+    x, y, z = rng.normal(size=(3, 100))
+    coords = convert_xyz_to_spherical(x, y, z, ra_units="hours")
+    r = np.sqrt(x * x + y * y + z * z)
+    np.testing.assert_allclose(coords["ALT"], r)
+    np.testing.assert_allclose(
+        coords["RA"], (np.rad2deg(np.arctan2(y, x)) + 180) * 24 / 360
+    )
+    np.testing.assert_allclose(coords["DEC"], np.rad2deg(np.arccos(z / r)) - 90)
+
+    coords = convert_xyz_to_spherical(x, y, z, is_astro=False)
+    assert sorted(coords) == ["ALT", "LAT", "LON"]
+
+    # The altitude keeps the unit of quantities
+    coords = convert_xyz_to_spherical(x * u.kpc, y * u.kpc, (z * u.kpc).to(u.pc))
+    assert coords["ALT"].unit == u.kpc
+    np.testing.assert_allclose(coords["ALT"].value, r)
+    np.testing.assert_allclose(coords["DEC"], np.rad2deg(np.arccos(z / r)) - 90)
+
+    with pytest.raises(u.UnitConversionError):
+        convert_xyz_to_spherical(x * u.kpc, y * u.kpc, z * u.deg)
@@ -5,10 +5,17 @@
 Some basic tests.
 """
 
+import asyncio
+from datetime import datetime
+
+import numpy as np
 import pytest
+import pytz
+from astropy.time import Time
 from traitlets import TraitError
 
 from ..core import BaseWWTWidget
+from ..utils import ensure_utc_array
 
 
 def test_initial_surveys_url():
@@ -56,3 +63,164 @@ def test_color_validation():
     assert exc.value.args[0] == ('This attribute\'s color must be a string '
                                  '(a recognized matplotlib color name or hex '
                                  'code) or an RGB tuple of 3 floats')
+
+
+def test_ensure_utc_array():
+    expected = ["2020-01-01T00:00:00+00:00", "2020-01-02T12:30:00.250000+00:00"]
+    isot = ["2020-01-01T00:00:00", "2020-01-02T12:30:00.25"]
+
+    assert list(ensure_utc_array(np.array(isot))) == expected
+    assert list(ensure_utc_array(Time(isot))) == expected
+    assert list(ensure_utc_array(np.array(isot, dtype="datetime64[ms]"))) == expected
+
+    # Non-UTC time scales and time zones are converted
+    tt = Time(["2020-01-01T00:01:09.184"], scale="tt")
+    assert list(ensure_utc_array(tt)) == ["2020-01-01T00:00:00+00:00"]
+    eastern = pytz.timezone("US/Eastern").localize(datetime(2020, 1, 1))
+    times = np.array([eastern, datetime(2020, 1, 1)], dtype=object)
+    assert list(ensure_utc_array(times)) == [
+        "2020-01-01T05:00:00+00:00",
+        "2020-01-01T00:00:00+00:00",
+    ]
+
+    # Leap seconds
+    leap = Time(["2016-12-31T23:59:59.5", "2017-01-01"])
+    assert list(ensure_utc_array(leap)) == [
+        "2016-12-31T23:59:59.500000+00:00",
+        "2017-01-01T00:00:00+00:00",
+    ]
+    assert ensure_utc_array(Time("2016-12-31T23:59:59.5")) == (
+        "2016-12-31T23:59:59.500000+00:00"
+    )
+    assert ensure_utc_array(Time([["2016-12-31T12:00:00"]])).tolist() == [
+        ["2016-12-31T12:00:00+00:00"]
+    ]
+
+    with pytest.raises(ValueError):
+        ensure_utc_array(np.arange(3))
+
+
+def test_set_current_time():
+    widget = BaseWWTWidget()
+    widget.set_current_time(Time("2020-01-01T12:00:00", scale="tt"))
+    widget.set_current_time(np.datetime64("2020-01-01T12:00:00"))
+
+    isots = [
+        msg["isot"]
+        for msg, _ in widget._startupMessageQueue
+        if msg.get("event") == "set_datetime"
+    ]
+    assert isots == ["2020-01-01T11:58:50.816000+00:00", "2020-01-01T12:00:00+00:00"]
+
+
+def test_batch():
+    widget = BaseWWTWidget()
+    widget._startupMessageQueue = None
+    widget._appAlive = True
+
+    sent = []
+    widget._actually_send_msgs = sent.append
+
+    with widget.batch():
+        widget.constellation_figures = True
+        widget.constellation_boundaries = True
+        widget.constellation_figures = False
+
+        # Nested batches are sent with the outer one
+        with widget.batch():
+            widget.pause_time()
+
+        assert sent == []
+
+    # The superseded value is dropped, and the final one sent in its place
+    ((figures, _), (boundaries, _), (pause, _)) = sent[0]
+    assert figures["setting"] == "showConstellationFigures"
+    assert figures["value"] is False
+    assert boundaries["setting"] == "showConstellationBoundries"
+    assert pause["event"] == "pause_time"
+
+    # Settings aren't collapsed across other messages, which they might
+    # depend on
+    with widget.batch():
+        widget.constellation_figures = True
+        widget.pause_time()
+        widget.constellation_figures = False
+
+    assert [(msg["event"], msg.get("value")) for msg, _ in sent[1]] == [
+        ("setting_set", True),
+        ("pause_time", None),
+        ("setting_set", False),
+    ]
+    sent.clear()
+
+    # Replies can't be waited for inside a batch, since they would never come
+    async def wait_for_reply():
+        with widget.batch():
+            widget._send_into_future(event="get_view_as_tour")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(wait_for_reply())
+
+    assert sent == []
+
+    # Messages are still sent if there's an error
+    with pytest.raises(ZeroDivisionError):
+        with widget.batch():
+            widget.pause_time()
+            1 / 0
+
+    assert len(sent) == 1
+    assert widget._batchMessages is None
+
+
+def test_send_upload():
+    async def upload():
+        widget = BaseWWTWidget()
+        widget._startupMessageQueue = None
+        widget._appAlive = True
+
+        sent = []
+        widget._actually_send_msg = lambda payload, buffers=None: sent.append(payload)
+
+        def acknowledge():
+            for msg in sent:
+                if msg.get("threadId") in widget._futures:
+                    widget._on_app_message_received({"threadId": msg["threadId"]})
+
+        progress = []
+        messages = [({"event": "table_layer_chunk", "seq": i}, None) for i in range(10)]
+        first = widget._send_upload(messages, progress=progress.append)
+        second = widget._send_upload(messages[:2])
+        await asyncio.sleep(0)
+
+        # Only a few pieces are sent before the app acknowledges them, and
+        # other messages can be sent in the meantime.
+        assert [msg["seq"] for msg in sent] == [0, 1, 2, 3]
+        widget.pause_time()
+        assert sent[-1]["event"] == "pause_time"
+
+        while not second.done():
+            acknowledge()
+            await asyncio.sleep(0)
+
+        assert first.done()
+        assert progress == list(range(1, 11))
+        chunks = [msg["seq"] for msg in sent if msg["event"] == "table_layer_chunk"]
+        assert chunks == list(range(10)) + [0, 1]
+
+        # Uploads can be abandoned
+        third = widget._send_upload(messages)
+        await asyncio.sleep(0)
+        third.cancel()
+        await asyncio.sleep(0)
+        assert third.cancelled()
+        assert widget._last_upload is None
+
+    asyncio.run(upload())
+
+    # Without an event loop, the pieces are all sent right away
+    widget = BaseWWTWidget()
+    progress = []
+    assert widget._send_upload([({"event": "x"}, None)] * 3, progress.append) is None
+    assert progress == [1, 2, 3]
+    assert len(widget._startupMessageQueue) > 3
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from ..hashing import array_digest, file_digest, hdu_digest
+
+
+def test_file_digest(tmp_path):
+    filename = str(tmp_path / "data.bin")
+
+    with open(filename, "wb") as f:
+        f.write(b"abc" * 1000)
+
+    digest = file_digest(filename)
+    stat = os.stat(filename)
+
+    # Files are only hashed again if their size or modification time changes
+    with open(filename, "wb") as f:
+        f.write(b"abd" * 1000)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert file_digest(filename) == digest
+
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert file_digest(filename) != digest
+
+    empty = str(tmp_path / "empty.bin")
+    open(empty, "wb").close()
+    assert file_digest(empty) != digest
+
+
+def test_array_digest():
+    array = np.arange(200000, dtype=np.float32).reshape(100000, 2)
+
+    # Only the values matter, not how they're laid out in memory
+    assert array_digest(np.asfortranarray(array)) == array_digest(array)
+    assert array_digest(array.astype(">f4")) == array_digest(array)
+    assert array_digest(array.astype(np.float64)) != array_digest(array)
+    assert array_digest(array.reshape(2, 100000)) != array_digest(array)
+
+
+def test_hdu_digest(tmp_path):
+    data = np.zeros((70000, 2), dtype=np.float32)
+    hdu = fits.PrimaryHDU(data.copy())
+    digest = hdu_digest(hdu)
+
+    # The whole image is hashed, not just its first rows
+    data[-1, -1] = 1
+    assert hdu_digest(fits.PrimaryHDU(data)) != digest
+
+    # Memory-mapped images read from files have the same hashes
+    filename = str(tmp_path / "image.fits")
+    hdu.writeto(filename)
+    with fits.open(filename, memmap=True) as hdulist:
+        assert hdu_digest(hdulist[0]) == digest
+
+    hdu.header["OBJECT"] = "M101"
+    assert hdu_digest(hdu) != digest
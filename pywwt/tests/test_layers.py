@@ -2,21 +2,35 @@ from astropy import units as u
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
 from astropy.table import Table
-from astropy.wcs import WCS
+from astropy.wcs import WCS, Sip
+from matplotlib.pyplot import cm
+from matplotlib.colors import to_hex
 
+import asyncio
+import functools
 import numpy as np
 import os.path
+from base64 import b64decode
 import sys
 import pytest
 from stat import S_IWGRP, S_IWOTH, S_IWUSR, S_IMODE
 from tempfile import TemporaryDirectory
-from warnings import catch_warnings
+from time import perf_counter, sleep
+from unittest import mock
+from warnings import catch_warnings, simplefilter
 
-from . import assert_widget_image, wait_for_test, DATA
+from . import assert_widget_image, binary_client, queued, wait_for_test, DATA
 from ..conftest import RUNNING_ON_CI, QT_INSTALLED  # noqa
 from ..core import BaseWWTWidget
+from .. import layers, utils
+from ..table_encoding import decode_table_binary, encode_table_binary
+from ..utils import sanitize_image, wwt_compatible_file, wwt_compatible_image
 from ..layers import (
+    CMAP_COLUMN_NAME,
+    CatalogHipsLayer,
+    TIME_COLUMN_NAME,
     TableLayer,
+    _colormap_hex_values,
     guess_lon_lat_columns,
     guess_xyz_columns,
     csv_table_win_newline,
@@ -255,6 +269,399 @@ class TestLayers:
         assert layer.lat_att == "b"
         assert layer.alt_att == ""
 
+    def _sent(self, event):
+        return [
+            msg
+            for msg, buffers in self.client._startupMessageQueue
+            if msg.get("event") == event
+        ]
+
+    def test_column_cache(self, monkeypatch, tmp_path):
+        self.table["name"] = ["a b", "c,d", ""]
+        layer = self.client.layers.add_table_layer(
+            table=self.table, cmap_att="flux", cmap=cm.jet
+        )
+        msg = self._sent("table_layer_update")[-1]
+        expected = csv_table_win_newline(layer._data_table())
+        assert b64decode(msg["table"]).decode("ascii") == expected
+
+        # The derived colormap column isn't added to the layer's table
+        assert layer.table.colnames == ["flux", "dec", "ra", "name"]
+
+        encoded = []
+        csv_column_lines = layers._csv_column_lines
+
+        def tracking_csv_column_lines(column, precision=None):
+            encoded.append(column.info.name)
+            return csv_column_lines(column, precision)
+
+        monkeypatch.setattr(layers, "_csv_column_lines", tracking_csv_column_lines)
+
+        # Only the colormap column is encoded again
+        layer.cmap_vmax = 10
+        assert encoded == [CMAP_COLUMN_NAME]
+        msg = self._sent("table_layer_update")[-1]
+        assert b64decode(msg["table"]).decode("ascii") == csv_table_win_newline(
+            layer._data_table()
+        )
+
+        # Nothing needs to be encoded to save the data
+        layer._save_data_for_serialization(str(tmp_path))
+        saved = (tmp_path / "{0}.csv".format(layer.id)).read_bytes()
+        assert saved.decode("ascii") == csv_table_win_newline(layer._data_table())
+        assert encoded == [CMAP_COLUMN_NAME]
+
+        # Appending rows keeps the cache up to date
+        layer.append_rows(self.table["flux", "dec", "ra", "name"][:2])
+        del encoded[:]
+        layer.cmap_vmax = 5
+        assert encoded == [CMAP_COLUMN_NAME]
+        msg = self._sent("table_layer_update")[-1]
+        assert b64decode(msg["table"]).decode("ascii") == csv_table_win_newline(
+            layer._data_table()
+        )
+
+    def test_custom_cmap_message_order(self):
+        layer = self.client.layers.add_table_layer(
+            table=self.table, cmap_att="flux", cmap=cm.twilight
+        )
+        events = [
+            (msg["event"], msg.get("setting"), msg.get("value"))
+            for msg, _ in self.client._startupMessageQueue
+            if msg.get("id") == layer.id
+        ]
+
+        # The colormap column is only selected after the data holding it
+        update = [event for event, _, _ in events].index("table_layer_update")
+        select = events.index(("table_layer_set", "colorMapColumn", CMAP_COLUMN_NAME))
+        assert update < select
+        assert events[update + 1:select + 1] == [
+            ("table_layer_set", "dynamicColor", False),
+            ("table_layer_set", "colorMapColumn", CMAP_COLUMN_NAME),
+        ]
+
+    def test_derived_column_updates(self):
+        self.client._on_app_message_received(
+            {"type": "wwt_application_state", "tableLayerFeatures": ["columns"]}
+        )
+        layer = self.client.layers.add_table_layer(
+            table=self.table, cmap_att="flux", cmap=cm.jet
+        )
+        assert self.table.colnames == ["flux", "dec", "ra"]
+        n_updates = len(self._sent("table_layer_update"))
+
+        # Only the colormap column is sent when the colors change
+        layer.cmap_vmax = 10
+        msg = self._sent("table_layer_columns")[-1]
+        csv = b64decode(msg["table"]).decode("ascii")
+        expected = layer._data_table()[[CMAP_COLUMN_NAME]]
+        assert csv == csv_table_win_newline(expected)
+        assert len(self._sent("table_layer_update")) == n_updates
+
+        # Replacing the data recomputes the colors for the new rows
+        more = Table()
+        more["flux"] = [5, 6]
+        more["dec"] = [7, 8]
+        more["ra"] = [4, 5] * u.deg
+        layer.update_data(table=more)
+        colors = layer._data_table()[CMAP_COLUMN_NAME]
+        assert list(colors) == list(layer._cmap_hex_values(more["flux"]))
+
+    def test_custom_to_builtin_cmap(self):
+        layer = self.client.layers.add_table_layer(
+            table=self.table, cmap_att="flux", cmap=cm.jet
+        )
+        assert CMAP_COLUMN_NAME in layer._data_table().colnames
+
+        # The colors of the custom colormap are dropped, and aren't sent with
+        # later data
+        layer.cmap = cm.viridis
+        assert layer._data_table().colnames == ["flux", "dec", "ra"]
+        assert CMAP_COLUMN_NAME not in layer._shipped_columns
+
+        layer.update_data(table=self.table)
+        msg = self._sent("table_layer_update")[-1]
+        header = b64decode(msg["table"]).decode("ascii").split("\r\n")[0]
+        assert header.split(",") == ["flux", "dec", "ra"]
+
+        more = Table()
+        more["flux"] = [5]
+        more["dec"] = [7]
+        more["ra"] = [4] * u.deg
+        layer.append_rows(more)
+        assert layer._data_table().colnames == ["flux", "dec", "ra"]
+
+    def test_column_projection(self):
+        self.table["mag"] = [10, 11, 12]
+        self.table["name"] = ["a", "b", "c"]
+        layer = self.client.layers.add_table_layer(
+            table=self.table, column_projection=True
+        )
+
+        def sent_columns():
+            (msg,) = self._sent("table_layer_create")
+            updates = self._sent("table_layer_update")
+            csv = b64decode((updates or [msg])[-1]["table"]).decode("ascii")
+            return csv.split("\r\n")[0].split(",")
+
+        # Only the coordinates are sent, and only once
+        assert sent_columns() == ["dec", "ra"]
+        assert not self._sent("table_layer_update")
+
+        # Columns are sent when they're needed, or pinned
+        layer.size_att = "mag"
+        assert sent_columns() == ["dec", "ra", "mag"]
+        n_updates = len(self._sent("table_layer_update"))
+        layer.size_att = ""
+        layer.lat_att = "dec"
+        assert len(self._sent("table_layer_update")) == n_updates
+
+        layer.pinned_columns = ["name"]
+        assert sent_columns() == ["dec", "ra", "name"]
+
+        layer.cmap_att = "flux"
+        layer.cmap = cm.jet
+        assert sent_columns() == ["flux", "dec", "ra", "name", CMAP_COLUMN_NAME]
+
+        # Appended rows only have the columns that were sent
+        self.client._on_app_message_received(
+            {"type": "wwt_application_state", "tableLayerFeatures": ["append"]}
+        )
+        layer.append_rows(self.table["flux", "dec", "ra", "mag", "name"][:1])
+        (msg,) = self._sent("table_layer_append")
+        header = b64decode(msg["table"]).decode("ascii").split("\r\n")[0]
+        assert header.split(",") == sent_columns()
+        assert layer._table_csv.startswith(header + "\r\n")
+
+        layer.column_projection = False
+        assert sent_columns() == layer._data_table().colnames
+
+    def test_append_rows(self):
+        layer = self.client.layers.add_table_layer(table=self.table)
+
+        more = Table()
+        more["flux"] = [5, 6]
+        more["dec"] = [7, 8]
+        more["ra"] = [4, 5] * u.deg
+
+        # Without app support, the full table is sent
+        layer.append_rows(more)
+        assert len(layer.table) == 5
+        msg = self._sent("table_layer_update")[-1]
+        csv = b64decode(msg["table"]).decode("ascii")
+        assert csv == csv_table_win_newline(layer.table)
+        assert not self._sent("table_layer_append")
+
+        # With app support, only the new rows are sent
+        self.client._on_app_message_received(
+            {"type": "wwt_application_state", "tableLayerFeatures": ["append"]}
+        )
+        layer.update_data(table=more, mode="append")
+        assert len(layer.table) == 7
+        (msg,) = self._sent("table_layer_append")
+        csv = b64decode(msg["table"]).decode("ascii")
+        assert csv == "flux,dec,ra\r\n5,7,4.0\r\n6,8,5.0\r\n"
+        assert layer._table_csv == csv_table_win_newline(layer.table)
+
+        with pytest.raises(ValueError):
+            layer.append_rows(more["ra", "dec"])
+
+        with pytest.raises(ValueError):
+            layer.update_data(table=more, mode="prepend")
+
+    def test_append_rows_precision_change(self):
+        self.client._on_app_message_received(
+            {"type": "wwt_application_state", "tableLayerFeatures": ["append"]}
+        )
+        self.table["flux"] = [2.123456, 3.123456, 4.123456]
+        layer = self.client.layers.add_table_layer(
+            table=self.table, size_att="flux", data_precision="auto"
+        )
+        names = layer._sent_colnames()
+        assert layer._table_csv.split("\r\n")[1].split(",")[0] == "2.1235"
+
+        # Rows that don't change the precision are appended as they are
+        more = Table()
+        more["flux"] = [2.5]
+        more["dec"] = [7]
+        more["ra"] = [4] * u.deg
+        layer.append_rows(more)
+        assert len(self._sent("table_layer_append")) == 1
+        assert layer._shipped_columns == layer._column_precisions(names)
+
+        # Rows that widen the range of the sizes make them less precise, so the
+        # whole column is encoded again to the same precision
+        n_updates = len(self._sent("table_layer_update"))
+        more["flux"] = [500.0]
+        layer.append_rows(more)
+        assert len(self._sent("table_layer_append")) == 1
+        assert len(self._sent("table_layer_update")) == n_updates + 1
+        assert layer._shipped_columns == layer._column_precisions(names)
+        fluxes = [line.split(",")[0] for line in layer._table_csv.split("\r\n")[1:-1]]
+        assert fluxes == ["2.12", "3.12", "4.12", "2.5", "500.0"]
+        msg = self._sent("table_layer_update")[-1]
+        assert b64decode(msg["table"]).decode("ascii") == layer._table_csv
+
+    def test_append_rows_derived_columns(self):
+        self.table["time"] = [
+            "2020-01-01T00:00:00",
+            "2020-01-02T00:00:00",
+            "2020-01-03T00:00:00",
+        ]
+        layer = self.client.layers.add_table_layer(
+            table=self.table,
+            cmap_att="flux",
+            cmap=cm.jet,
+            time_att="time",
+            time_series=True,
+        )
+
+        more = Table()
+        more["flux"] = [2.5, 4]
+        more["dec"] = [7, 8]
+        more["ra"] = [4, 5] * u.deg
+        more["time"] = ["2020-01-04T00:00:00", "2020-01-05T12:00:00"]
+        layer.append_rows(more)
+
+        assert layer.table.colnames == ["flux", "dec", "ra", "time"]
+        full = layer._data_table()
+        assert list(full[CMAP_COLUMN_NAME]) == list(
+            layer._cmap_hex_values(full["flux"])
+        )
+        assert list(full[TIME_COLUMN_NAME][3:]) == [
+            "2020-01-04T00:00:00+00:00",
+            "2020-01-05T12:00:00+00:00",
+        ]
+
+    def test_cmap_hex_values(self):
+        values = np.array([-0.5, 0, 0.1, 0.5, 0.999, 1, 1.5, np.nan])
+        masked = np.ma.masked_array([0.2, 0.3], mask=[False, True])
+        cmap = cm.viridis.with_extremes(under="red", over="blue", bad="green")
+
+        for c in (cm.jet, cm.viridis, cmap):
+            for v in (values, masked):
+                expected = [to_hex(x) for x in c(v)[:, :-1]]
+                assert list(_colormap_hex_values(v, c)) == expected
+
+        layer = self.client.layers.add_table_layer(
+            table=self.table, cmap_att="flux", cmap=cm.jet
+        )
+        first = layer._cmap_hex_values(layer.table["flux"])
+        assert layer._cmap_hex_values(layer.table["flux"]) is first
+
+        layer.cmap_vmax = 10
+        assert layer._cmap_hex_values(layer.table["flux"]) is not first
+        layer.cmap_vmax = 4
+        assert layer._cmap_hex_values(layer.table["flux"]) is first
+
+    def test_column_stats(self, monkeypatch):
+        self.table["mag"] = np.ma.masked_array([10.0, np.nan, 30.0], [0, 0, 1])
+        layer = self.client.layers.add_table_layer(table=self.table)
+
+        stats = layer.column_stats("mag")
+        assert stats["min"] == stats["max"] == 10
+        assert stats["nan_count"] == 2
+        assert stats["percentiles"][50] == 10
+        assert stats["histogram"][0].sum() == 1
+
+        computed = []
+        array_stats = layers._array_stats
+
+        def tracking_array_stats(values):
+            computed.append(values.info.name)
+            return array_stats(values)
+
+        monkeypatch.setattr(layers, "_array_stats", tracking_array_stats)
+
+        # Switching between columns only computes the statistics once
+        for name in ("flux", "dec", "flux", "dec"):
+            layer.size_att = name
+            layer.cmap_att = name
+        assert computed == ["flux", "dec"]
+        assert layer.cmap_vmin == 4
+        assert layer.cmap_vmax == 6
+
+        # Changing the data invalidates the cache
+        more = self.table["flux", "dec", "ra", "mag"][:1]
+        layer.append_rows(more)
+        assert layer.column_stats("flux")["max"] == 4
+        layer.update_data(table=more)
+        assert layer.column_stats("flux")["max"] == 2
+        assert computed == ["flux", "dec", "flux", "flux"]
+
+        self.table["name"] = ["a", "b", "c"]
+        layer.update_data(table=self.table)
+        with pytest.raises(TypeError):
+            layer.column_stats("name")
+
+    def test_shared_datasets(self):
+        self.client._on_app_message_received(
+            {"type": "wwt_application_state", "tableLayerFeatures": ["datasets"]}
+        )
+        layer1 = self.client.layers.add_table_layer(table=self.table)
+        layer2 = self.client.layers.add_table_layer(
+            table=self.table.copy(), frame="Earth", size_scale=5
+        )
+        layer3 = self.client.layers.add_table_layer(table=self.table[:2])
+
+        # Identical data are only sent once
+        msg1, msg2, msg3 = self._sent("table_layer_create")
+        assert "table" in msg1
+        assert "table" not in msg2
+        assert msg2["tableDataset"] == msg1["tableDataset"]
+        assert "table" in msg3
+        assert msg3["tableDataset"] != msg1["tableDataset"]
+
+        # Rows appended to shared data are sent as new data
+        layer2.append_rows(self.table[:1])
+        msg = self._sent("table_layer_update")[-1]
+        assert msg["id"] == layer2.id
+        assert "table" in msg
+        assert msg["tableDataset"] != msg1["tableDataset"]
+
+        # Data are only freed when the last layer using them is removed
+        layer4 = self.client.layers.add_table_layer(table=self.table)
+        assert self._sent("table_layer_create")[-1]["tableDataset"] == (
+            msg1["tableDataset"]
+        )
+        layer1.remove()
+        assert self._sent("table_dataset_remove") == []
+        layer4.remove()
+        layer2.remove()
+        layer3.remove()
+        removed = [msg["dataset"] for msg in self._sent("table_dataset_remove")]
+        assert removed == [
+            msg1["tableDataset"],
+            msg["tableDataset"],
+            msg3["tableDataset"],
+        ]
+        assert self.client.layers._dataset_users == {}
+
+    def test_batch(self):
+        layer = self.client.layers.add_table_layer(table=self.table)
+
+        # Layer creation is batched, so each setting is only sent once
+        settings = [msg["setting"] for msg in self._sent("table_layer_set")]
+        assert len(settings) == len(set(settings))
+
+        del self.client._startupMessageQueue[:]
+
+        with layer.batch():
+            layer.cmap_att = "flux"
+            layer.cmap_vmin = 1
+            layer.cmap_vmax = 10
+
+        settings = [msg["setting"] for msg in self._sent("table_layer_set")]
+        assert len(settings) == len(set(settings))
+        assert settings.index("colorMapColumn") < settings.index("normalizeColorMapMax")
+
+        (msg,) = [
+            msg
+            for msg in self._sent("table_layer_set")
+            if msg["setting"] == "normalizeColorMapMax"
+        ]
+        assert msg["value"] == 10
+
     def test_line_endings(self):
         self.table["ra"] = [1, 2, 3]
         expected_str = "flux,dec,ra\r\n" "2,4,1\r\n" "3,5,2\r\n" "4,6,3\r\n"
@@ -344,6 +751,230 @@ def test_guess_xyz_columns(colnames, expected):
     assert guess_xyz_columns(colnames) == expected
 
 
+def test_layer_served_data():
+    client = binary_client()
+    client._on_app_message_received(
+        {"type": "wwt_application_state", "tableLayerFeatures": ["url"]}
+    )
+    table = Table()
+    table["ra"] = np.linspace(0, 360, 100) * u.deg
+    table["dec"] = np.linspace(-90, 90, 100) * u.deg
+    table["mag"] = np.arange(100.0)
+
+    # Data publishing isn't available in the base widget
+    with pytest.warns(UserWarning):
+        client.layers.add_table_layer(table=table, serve_data=True)
+    ((msg, _),) = queued(client, "table_layer_create")
+    assert "table" in msg
+
+    served = []
+
+    def serve_file(filename, extension=""):
+        served.append(filename)
+        return "http://localhost/" + os.path.basename(filename)
+
+    client._serve_file = serve_file
+    layer = client.layers.add_table_layer(table=table, serve_data=True)
+    msg, buffers = queued(client, "table_layer_create")[-1]
+    assert "table" not in msg
+    assert buffers is None
+    assert msg["tableUrl"] == "http://localhost/" + os.path.basename(served[0])
+    with open(served[0], "rb") as f:
+        assert f.read().decode("ascii") == csv_table_win_newline(table)
+
+    # The same data are published at the same URL
+    layer.update_data(table=table)
+    assert queued(client, "table_layer_update")[-1][0]["tableUrl"] == msg["tableUrl"]
+
+    layer.data_encoding = "binary"
+    layer.update_data(table=table)
+    msg, buffers = queued(client, "table_layer_update")[-1]
+    assert buffers is None
+    assert served[-1].endswith(".bin")
+    with open(served[-1], "rb") as f:
+        data = f.read()
+    offsets = np.cumsum([0] + msg["tableBufferSizes"])
+    decoded = decode_table_binary(
+        msg["tableSchema"],
+        [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])],
+    )
+    np.testing.assert_array_equal(decoded["mag"], table["mag"])
+
+    # Files that are no longer used are deleted, unless another layer uses them
+    assert not os.path.exists(served[0])
+    other = client.layers.add_table_layer(
+        table=table, serve_data=True, data_encoding="binary"
+    )
+    assert served[-1] == served[-2]
+    layer.remove()
+    assert os.path.exists(served[-1])
+    other.remove()
+    assert not os.path.exists(served[-1])
+
+
+def _hips_layer(client):
+    app_msg = {"spreadsheetInfo": {"header": ["ra", "dec"], "settings": []}}
+    return CatalogHipsLayer(client, "hips", app_msg)
+
+
+def test_hips_catalog_tile_cache():
+    client = binary_client()
+    client._on_app_message_received(
+        {
+            "type": "wwt_application_state",
+            "tableLayerFeatures": ["hipsTiles", "binaryReplies"],
+        }
+    )
+    layer = _hips_layer(client)
+
+    tiles = {}
+    for pixel in range(4):
+        table = Table()
+        table["ra"] = np.arange(3) + 10.0 * pixel
+        table["dec"] = np.zeros(3)
+        tiles[(3, pixel)] = table
+
+    async def refresh(visible):
+        sent = []
+        client._startupMessageQueue = None
+        client._appAlive = True
+        client._actually_send_msg = lambda payload, buffers=None: sent.append(
+            payload
+        )
+        task = asyncio.ensure_future(layer.refresh())
+        await asyncio.sleep(0)
+
+        (request,) = sent
+        assert request["encoding"] == "binary" and request["tiles"]
+        known = set(tuple(key) for key in request["knownTiles"])
+
+        reply = {"threadId": request["threadId"], "tiles": visible, "tileData": []}
+        buffers = []
+        for key in visible:
+            if tuple(key) not in known:
+                schema, tile_buffers = encode_table_binary(tiles[tuple(key)])
+                for column in schema["columns"]:
+                    column["buffers"] = [i + len(buffers) for i in column["buffers"]]
+                buffers += tile_buffers
+                reply["tileData"].append(
+                    {
+                        "order": 3,
+                        "pixel": key[1],
+                        "encoding": "binary",
+                        "schema": schema,
+                    }
+                )
+
+        client._on_app_message_received(reply, buffers=buffers)
+        return await task, len(reply["tileData"])
+
+    table, fetched = asyncio.run(refresh([[3, 0], [3, 1]]))
+    assert fetched == 2
+    assert table["ra"].tolist() == [0, 1, 2, 10, 11, 12]
+
+    # Only the newly visible tile is fetched.
+    table, fetched = asyncio.run(refresh([[3, 1], [3, 2]]))
+    assert fetched == 1
+    assert table["ra"].tolist() == [10, 11, 12, 20, 21, 22]
+    assert list(layer._tiles) == [(3, 0), (3, 1), (3, 2)]
+
+
+def test_hips_catalog_auto_refresh():
+    async def run():
+        client = BaseWWTWidget()
+        client._startupMessageQueue = None
+        client._appAlive = True
+        sent = []
+        client._actually_send_msg = lambda payload, buffers=None: sent.append(payload)
+        layer = _hips_layer(client)
+
+        def requests():
+            return [msg for msg in sent if msg["event"] == "layer_hipscat_datainview"]
+
+        def reply(msg, ra):
+            client._on_app_message_received(
+                {"threadId": msg["threadId"], "data": "ra\tdec\n{0}\t0\n".format(ra)}
+            )
+
+        def move(ra):
+            client._on_app_message_received(
+                {
+                    "type": "wwt_view_state",
+                    "raRad": ra,
+                    "decRad": 0,
+                    "fovDeg": 60,
+                    "rollDeg": 0,
+                    "engineClockISOT": "2017-03-09T12:30:00",
+                    "systemClockISOT": "2017-03-09T12:30:00",
+                    "engineClockRateFactor": 1,
+                }
+            )
+
+        decoded = []
+        decode_rows = layer._decode_rows
+
+        def spy(fields, buffers):
+            decoded.append(fields["data"])
+            return decode_rows(fields, buffers)
+
+        layer._decode_rows = spy
+
+        refreshed = []
+        layer.auto_refresh(delay=0.01, callback=refreshed.append)
+        await asyncio.sleep(0)
+        assert len(requests()) == 1
+
+        # A burst of moves while a request is outstanding doesn't lead to any
+        # more requests until it's answered.
+        for ra in range(5):
+            move(ra)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.05)
+        assert len(requests()) == 1
+
+        # The reply is superseded by the new view, and isn't even decoded.
+        reply(requests()[0], 1)
+        await asyncio.sleep(0)
+        assert len(requests()) == 2
+        assert refreshed == []
+        assert decoded == []
+
+        reply(requests()[1], 2)
+        await asyncio.sleep(0)
+        assert len(refreshed) == 1
+        assert layer.table is refreshed[0]
+        assert layer.table["ra"].tolist() == [2]
+        assert len(decoded) == 1
+
+        # A manual refresh that completes after a newer one doesn't replace
+        # the newer rows.
+        first = asyncio.ensure_future(layer.refresh())
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(layer.refresh())
+        await asyncio.sleep(0)
+        reply(requests()[-1], 4)
+        assert (await second)["ra"].tolist() == [4]
+        reply(requests()[-2], 3)
+        assert (await first)["ra"].tolist() == [3]
+        assert layer.table["ra"].tolist() == [4]
+
+        # Stopping abandons any outstanding request.
+        move(0)
+        await asyncio.sleep(0.05)
+        assert len(requests()) == 5
+        layer.auto_refresh(False)
+        await asyncio.sleep(0)
+        assert client._futures == {}
+        assert client._view_state_listeners == []
+        reply(requests()[4], 5)
+        assert len(refreshed) == 1
+
+    asyncio.run(run())
+
+    with pytest.raises(RuntimeError):
+        _hips_layer(BaseWWTWidget()).auto_refresh()
+
+
 @pytest.mark.skipif("not QT_INSTALLED")
 def test_table_layers_image(tmpdir, wwt_qt_client):
 
@@ -621,6 +1252,7 @@ def test_image_tmpdir_fallback(wwt_qt_client_isolated):
     infrastructure to avoid that right now."""
 
     wwt = wwt_qt_client_isolated
+    wwt.layers.tile_cache = None
     tmpdir = TemporaryDirectory()
     path = tmpdir.name
     cwd = os.getcwd()
@@ -654,3 +1286,444 @@ def test_image_tmpdir_fallback(wwt_qt_client_isolated):
     if not windows:
         os.chmod(path, current)
     os.chdir(cwd)
+
+
+def _tan_image(n):
+    rng = np.random.default_rng(42)
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = n / 2, n / 2
+    wcs.wcs.cdelt = -1e-4, 1e-4
+    wcs.wcs.crval = 10, 20
+    return fits.PrimaryHDU(rng.normal(size=(n, n)).astype(np.float32), wcs.to_header())
+
+
+def _tile_digests(out_dir):
+    # The WTML files name the image set after its directory, so leave them out
+    digests = {}
+    for root, _, filenames in os.walk(out_dir):
+        for filename in filenames:
+            if not filename.endswith(".wtml"):
+                fn = os.path.join(root, filename)
+                with open(fn, "rb") as f:
+                    digests[os.path.relpath(fn, out_dir)] = hash(f.read())
+    return digests
+
+
+def test_image_tiling_parallelism(tmp_path, monkeypatch):
+    image = str(tmp_path / "image.fits")
+    _tan_image(64).writeto(image)
+    client = BaseWWTWidget()
+    requested = []
+
+    class Tiled(Exception):
+        pass
+
+    def tile_fits(fits_list, parallel=None, **kwargs):
+        requested.append(parallel)
+        raise Tiled()
+
+    monkeypatch.setattr(layers.toasty, "tile_fits", tile_fits)
+
+    for kwargs in ({}, {"parallel": False}, {"workers": 3}):
+        with pytest.raises(Tiled):
+            client.layers.add_image_layer(
+                image, tiling_method=layers.TilingMethod.TAN, **kwargs
+            )
+
+    assert requested == [None, 1, 3]
+
+    with pytest.raises(ValueError):
+        client.layers.add_image_layer(image, workers=0)
+
+
+def test_image_reprojection_parallelism(tmp_path, monkeypatch):
+    client = BaseWWTWidget()
+    client.layers.tile_cache = None
+    monkeypatch.setattr(
+        client, "_serve_file", lambda filename, extension="": "http://localhost/data"
+    )
+    requested = []
+    sanitize = layers.sanitize_image
+
+    def sanitize_image(image, output_file, **kwargs):
+        requested.append((kwargs["parallel"], kwargs["memory_limit"]))
+        return sanitize(image, output_file, **kwargs)
+
+    monkeypatch.setattr(layers, "sanitize_image", sanitize_image)
+    image = str(tmp_path / "image.fits")
+    _tan_image(16).writeto(image)
+
+    # Images that aren't tiled are reprojected in this process unless
+    # workers are asked for
+    for kwargs in ({}, {"parallel": False, "workers": 3}, {"workers": 2}):
+        client.layers.add_image_layer(image, **kwargs)
+
+    client.layers.add_image_layer(image, memory_limit=10 ** 6)
+    assert requested == [
+        (1, layers.SANITIZE_MEMORY_LIMIT),
+        (1, layers.SANITIZE_MEMORY_LIMIT),
+        (2, layers.SANITIZE_MEMORY_LIMIT),
+        (1, 10 ** 6),
+    ]
+
+
+def _tile_image(image, out_dir, workers):
+    with catch_warnings():
+        simplefilter("ignore")
+        layers.toasty.tile_fits(
+            image,
+            out_dir=out_dir,
+            parallel=workers,
+            tiling_method=layers.TilingMethod.TAN,
+        )
+
+
+def test_parallel_tiling_determinism(tmp_path):
+    image = str(tmp_path / "image.fits")
+    _tan_image(512).writeto(image)
+
+    # Parallel tiling gives exactly the same tiles as serial tiling
+    tiles = {}
+    for n in (1, 2):
+        out_dir = str(tmp_path / "tiles{0}".format(n))
+        _tile_image(image, out_dir, n)
+        tiles[n] = _tile_digests(out_dir)
+
+    assert len(tiles[1]) > 1
+    assert tiles[2] == tiles[1]
+
+
+@pytest.mark.skipif("not os.environ.get('PYWWT_BENCHMARKS')")
+def test_parallel_tiling_benchmark(tmp_path):
+    workers = min(os.cpu_count() or 1, 8)
+
+    if workers < 4:
+        pytest.skip("tiling can't be shown to scale with fewer than 4 CPUs")
+
+    image = str(tmp_path / "image.fits")
+    _tan_image(4096).writeto(image)
+
+    times = {}
+    for n in (1, workers):
+        t0 = perf_counter()
+        _tile_image(image, str(tmp_path / "tiles{0}".format(n)), n)
+        times[n] = perf_counter() - t0
+
+    assert times[workers] < times[1]
+
+
+def test_sanitize_image_blocks(tmp_path):
+    from reproject import reproject_interp
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = "GLON-TAN", "GLAT-TAN"
+    wcs.wcs.crpix = 100, 100
+    wcs.wcs.cdelt = -1e-3, 1e-3
+    wcs.wcs.crval = 10, 20
+    data = np.random.default_rng(3).normal(size=(200, 200)).astype(np.float32)
+
+    filename = str(tmp_path / "serial.fits")
+    sanitize_image((data, wcs), filename, parallel=1)
+    with fits.open(filename) as hdulist:
+        header = hdulist[0].header
+        expected = hdulist[0].data
+        assert header["CTYPE1"] == "RA---TAN"
+        np.testing.assert_allclose(
+            expected,
+            reproject_interp((data, wcs), WCS(header), shape_out=expected.shape)[0],
+            rtol=1e-4,
+            atol=1e-4,
+        )
+
+    # Reprojecting the image a few rows at a time, in several processes,
+    # gives exactly the same result
+    for parallel in (1, 3):
+        filename = str(tmp_path / "blocks{0}.fits".format(parallel))
+        sanitize_image((data, wcs), filename, parallel=parallel, memory_limit=10 ** 6)
+        np.testing.assert_array_equal(fits.getdata(filename), expected)
+
+    with pytest.raises(OSError):
+        sanitize_image((data, wcs), filename)
+
+
+def _icrs_tan_wcs():
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = 50, 50
+    wcs.wcs.cdelt = -1e-3, 1e-3
+    wcs.wcs.crval = 10, 20
+    return wcs
+
+
+def _set_wcs(**attributes):
+    def change(data, wcs):
+        for name, value in attributes.items():
+            setattr(wcs.wcs, name, value)
+        return data, wcs
+
+    return change
+
+
+def _add_sip(data, wcs):
+    wcs.wcs.ctype = "RA---TAN-SIP", "DEC--TAN-SIP"
+    wcs.sip = Sip(np.zeros((3, 3)), np.zeros((3, 3)), None, None, wcs.wcs.crpix)
+    return data, wcs
+
+
+def _add_axis(data, wcs):
+    cube = WCS(naxis=3)
+    cube.wcs.ctype = tuple(wcs.wcs.ctype) + ("FREQ",)
+    cube.wcs.crpix = tuple(wcs.wcs.crpix) + (1,)
+    cube.wcs.cdelt = tuple(wcs.wcs.cdelt) + (1,)
+    cube.wcs.crval = tuple(wcs.wcs.crval) + (1e9,)
+    return data[np.newaxis], cube
+
+
+COMPATIBLE_IMAGES = [
+    ("float32", lambda data, wcs: (data, wcs), True),
+    ("float64", lambda data, wcs: (data.astype(np.float64), wcs), True),
+    ("big-endian", lambda data, wcs: (data.astype(">f4"), wcs), True),
+    ("explicit ICRS", _set_wcs(radesys="ICRS"), True),
+    ("float16", lambda data, wcs: (data.astype(np.float16), wcs), False),
+    ("int16", lambda data, wcs: (data.astype(np.int16), wcs), False),
+    ("galactic", _set_wcs(ctype=("GLON-TAN", "GLAT-TAN")), False),
+    ("FK5", _set_wcs(radesys="FK5", equinox=2000), False),
+    ("SIN projection", _set_wcs(ctype=("RA---SIN", "DEC--SIN")), False),
+    ("swapped axes", _set_wcs(ctype=("DEC--TAN", "RA---TAN")), False),
+    ("RA increasing to the right", _set_wcs(cdelt=(1e-3, 1e-3)), False),
+    ("south up", _set_wcs(cdelt=(-1e-3, -1e-3)), False),
+    ("rotated", _set_wcs(pc=((0.8, -0.6), (0.6, 0.8))), False),
+    ("SIP distortion", _add_sip, False),
+    ("3-d", _add_axis, False),
+]
+
+
+@pytest.mark.parametrize(
+    ("change", "compatible"),
+    [case[1:] for case in COMPATIBLE_IMAGES],
+    ids=[case[0] for case in COMPATIBLE_IMAGES],
+)
+def test_wwt_compatible_image(change, compatible):
+    data = np.zeros((100, 100), dtype=np.float32)
+    assert wwt_compatible_image(*change(data, _icrs_tan_wcs())) == compatible
+
+
+def test_sanitize_compatible_image(tmp_path):
+    data = np.random.default_rng(4).normal(size=(100, 100)).astype(np.float32)
+    header = _icrs_tan_wcs().to_header()
+    original = str(tmp_path / "original.fits")
+    fits.PrimaryHDU(data, header).writeto(original)
+
+    # Compatible files are used as they are
+    output = str(tmp_path / "output.fits")
+    assert wwt_compatible_file(original)
+    assert sanitize_image(original, output) == original
+    assert sanitize_image(original, output, hdu_index=0) == original
+    assert not os.path.exists(output)
+
+    # Other compatible images are written out without being reprojected
+    for image in ((data, WCS(header)), fits.PrimaryHDU(data, header)):
+        assert sanitize_image(image, output, overwrite=True) == output
+        np.testing.assert_array_equal(fits.getdata(output), data)
+
+    # Files that WWT can't read as they are are copied, but not reprojected
+    gzipped = str(tmp_path / "original.fits.gz")
+    fits.PrimaryHDU(data, header).writeto(gzipped)
+    extension = str(tmp_path / "extension.fits")
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data, header)]).writeto(extension)
+    scaled = str(tmp_path / "scaled.fits")
+    scaled_hdu = fits.PrimaryHDU(data, header)
+    scaled_hdu.header["BZERO"] = 0
+    scaled_hdu.writeto(scaled)
+
+    for filename in (gzipped, extension, scaled):
+        assert not wwt_compatible_file(filename)
+        assert sanitize_image(filename, output, overwrite=True) == output
+        with fits.open(output) as hdulist:
+            assert hdulist[0].header["CRPIX1"] == header["CRPIX1"]
+            np.testing.assert_array_equal(hdulist[0].data, data)
+
+    # Anything else is still reprojected
+    fits.PrimaryHDU(data.astype(np.int16), header).writeto(original, overwrite=True)
+    assert not wwt_compatible_file(original)
+    assert sanitize_image(original, output, overwrite=True) == output
+    assert fits.getheader(output)["BITPIX"] == -32
+
+
+def test_image_layer_compatible_file(tmp_path, monkeypatch, tile_cache):
+    data = np.random.default_rng(5).normal(size=(100, 100)).astype(np.float32)
+    original = str(tmp_path / "original.fits")
+    fits.PrimaryHDU(data, _icrs_tan_wcs().to_header()).writeto(original)
+
+    client = BaseWWTWidget()
+    served = []
+    monkeypatch.setattr(client, "_actually_send_msg", lambda *args, **kwargs: None)
+    monkeypatch.setattr(
+        client, "_serve_file", lambda filename, extension: served.append(filename)
+    )
+
+    checked = []
+    check = wwt_compatible_file
+
+    def wwt_compatible_file_spy(filename, hdu_index=None):
+        checked.append(filename)
+        return check(filename, hdu_index=hdu_index)
+
+    monkeypatch.setattr(layers, "wwt_compatible_file", wwt_compatible_file_spy)
+    monkeypatch.setattr(utils, "wwt_compatible_file", wwt_compatible_file_spy)
+
+    # The file is served as it is, without a copy in the cache, and it is only
+    # checked once
+    layer = client.layers.add_image_layer(original)
+    assert served == [original]
+    assert checked == [original]
+    assert layer.vmin < layer.vmax
+    assert tile_cache.size() == 0
+
+
+def _tiling_client(monkeypatch):
+    client = BaseWWTWidget()
+    monkeypatch.setattr(client, "_serve_tree", lambda path: "http://localhost/tiles/")
+    monkeypatch.setattr(
+        client, "_serve_file", lambda filename, extension="": "http://localhost/data"
+    )
+    monkeypatch.setattr(client, "load_image_collection", lambda **kwargs: None)
+    return client
+
+
+def test_image_layer_async(tmp_path, monkeypatch):
+    image = str(tmp_path / "image.fits")
+    _tan_image(1500).writeto(image)
+    client = _tiling_client(monkeypatch)
+
+    async def add():
+        task = client.layers.add_image_layer_async(
+            image, tiling_method=layers.TilingMethod.TAN
+        )
+        # A preview is shown straight away, while the image is tiled
+        assert task.status == "tiling"
+        assert not task.done()
+        assert client.layers._layers == [task.preview]
+        preview = task.preview
+        layer = await task
+        return task, preview, layer
+
+    task, preview, layer = asyncio.new_event_loop().run_until_complete(add())
+
+    assert preview.name == "image_tiled (preview)"
+    assert task.status == "done"
+    assert task.progress == 1
+    assert task.result() is layer
+    assert task.preview is None
+    assert client.layers._layers == [layer]
+    assert layer.vmin is not None
+
+    # The preview can be removed before the image has been tiled
+    async def remove_preview():
+        task = client.layers.add_image_layer_async(
+            image, tiling_method=layers.TilingMethod.TAN, name="other"
+        )
+        task.preview.remove()
+        return task, await task
+
+    task, other = asyncio.new_event_loop().run_until_complete(remove_preview())
+
+    assert task.status == "done"
+    assert task.preview is None
+    assert client.layers._layers == [layer, other]
+
+
+def _slow_tile_fits(fits_list, out_dir=None, **kwargs):
+    os.mkdir(out_dir)
+    sleep(60)
+
+
+def _failing_tile_fits(fits_list, **kwargs):
+    raise ValueError("bad image")
+
+
+def _tile_directory_using(tile_fits, *args, **kwargs):
+    # Images are tiled in a fresh process, which monkeypatching doesn't reach,
+    # so replace toasty's tiling function there.
+    with mock.patch.object(layers.toasty, "tile_fits", tile_fits):
+        return layers._tile_images(*args, **kwargs)[0]
+
+
+def test_image_layer_async_cancel(tmp_path, monkeypatch, tile_cache):
+    image = str(tmp_path / "image.fits")
+    _tan_image(64).writeto(image)
+    client = _tiling_client(monkeypatch)
+    monkeypatch.setattr(
+        layers,
+        "_tile_directory",
+        functools.partial(_tile_directory_using, _slow_tile_fits),
+    )
+
+    async def cancel():
+        task = client.layers.add_image_layer_async(
+            image, tiling_method=layers.TilingMethod.TAN
+        )
+        await asyncio.sleep(0.5)
+        t0 = perf_counter()
+        assert task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return task, perf_counter() - t0
+
+    task, elapsed = asyncio.new_event_loop().run_until_complete(cancel())
+
+    # The tiling process is stopped, and cleans up its partial tiles
+    assert task.status == "cancelled"
+    assert elapsed < layers.TILING_STOP_TIMEOUT
+    if task._process is not None:
+        # The Python process, which may be running threads, isn't forked
+        assert task._process._start_method in ("forkserver", "spawn")
+        assert not task._process.is_alive()
+    assert os.listdir(os.path.join(tile_cache.directory, "tmp")) == []
+    assert client.layers._layers == []
+
+    monkeypatch.setattr(
+        layers,
+        "_tile_directory",
+        functools.partial(_tile_directory_using, _failing_tile_fits),
+    )
+
+    async def fail():
+        task = client.layers.add_image_layer_async(
+            image, tiling_method=layers.TilingMethod.TAN, preview=False
+        )
+        with pytest.raises(ValueError, match="bad image"):
+            await task
+        return task
+
+    assert asyncio.new_event_loop().run_until_complete(fail()).status == "failed"
+
+
+def test_tiling_progress(monkeypatch):
+    from multiprocessing import Pipe
+    from toasty import progress
+
+    monkeypatch.setattr(progress, "tqdm", progress.tqdm)
+    receiver, sender = Pipe(duplex=False)
+    layers._report_progress(sender)
+
+    # Hidden bars report progress too, but not every single step of them
+    with progress.progress_bar(total=400, show=False) as bar:
+        for _ in range(400):
+            bar.update(1)
+
+    with progress.progress_bar(total=2, show=False) as bar:
+        bar.update(2)
+
+    reported = []
+    while receiver.poll():
+        reported.append(receiver.recv())
+
+    assert all(kind == "progress" for kind, _ in reported)
+    fractions = [fraction for _, fraction in reported]
+    first = fractions[: fractions.index(1) + 1]
+    assert first[0] == 0
+    assert first == sorted(first)
+    assert 50 < len(first) <= 101
+    assert fractions[len(first):] == [0, 1]
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.table import Table
+
+from ..core import BaseWWTWidget
+from ..lod import HealpixIndex
+
+
+def _random_sky(n, seed=42):
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(0, 360, n)
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    return lon, lat
+
+
+def _separation(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    cos_sep = np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(
+        lon1 - lon2
+    )
+    return np.degrees(np.arccos(np.clip(cos_sep, -1, 1)))
+
+
+def _updates(client):
+    return [
+        msg
+        for msg, buffers in client._startupMessageQueue
+        if msg.get("event") == "table_layer_update"
+    ]
+
+
+def _move(client, ra, dec, fov):
+    client._on_app_message_received(
+        {
+            "type": "wwt_view_state",
+            "raRad": np.radians(ra),
+            "decRad": np.radians(dec),
+            "fovDeg": fov,
+            "rollDeg": 0,
+            "engineClockISOT": "2017-03-09T12:30:00",
+            "systemClockISOT": "2017-03-09T12:30:00",
+            "engineClockRateFactor": 1,
+        }
+    )
+
+
+def test_index_query():
+    lon, lat = _random_sky(200_000)
+    lon[:5] = np.nan
+    index = HealpixIndex(lon, lat, per_cell=16)
+
+    # The number of rows is bounded, however large the region
+    for radius in (180, 30, 3):
+        order, cells, rows = index.query(120, -30, radius, 5000)
+        assert 0 < len(rows) <= 5000
+        assert np.all(np.diff(rows) > 0)
+        assert not np.any(rows < 5)
+
+    # Zoomed in far enough, every point in the region is selected
+    order, cells, rows = index.query(120, -30, 0.5, 5000)
+    inside = np.flatnonzero(_separation(120, -30, lon, lat) < 0.5)
+    assert np.all(np.isin(inside, rows))
+
+    # Selected points are close to the region
+    assert _separation(120, -30, lon[rows], lat[rows]).max() < 5
+
+
+def test_empty_index():
+    index = HealpixIndex([], [])
+    order, cells, rows = index.query(0, 0, 10, 100)
+    assert len(rows) == 0
+
+
+class TestLODLayer:
+    def setup_method(self, method):
+        self.client = BaseWWTWidget()
+        lon, lat = _random_sky(100_000)
+        self.table = Table()
+        self.table["ra"] = lon * u.deg
+        self.table["dec"] = lat * u.deg
+        self.table["flux"] = np.arange(len(lon))
+
+    def test_bounded(self):
+        layer = self.client.layers.add_table_layer(
+            table=self.table, lod=True, lod_max_rows=2000
+        )
+        assert len(layer._lod_rows) <= 2000
+
+        # Moving the view a little doesn't change the rows, but moving it a
+        # lot does. (The client has no event loop, so refreshes happen
+        # immediately.)
+        n_updates = len(_updates(self.client))
+        _move(self.client, 0.01, 0, 60)
+        assert len(_updates(self.client)) == n_updates
+
+        _move(self.client, 180, 45, 1)
+        assert len(_updates(self.client)) == n_updates + 1
+        rows = layer._lod_rows
+        assert 0 < len(rows) <= 2000
+        ra, dec = self.table["ra"][rows], self.table["dec"][rows]
+        assert _separation(180, 45, ra, dec).max() < 10
+
+        # Turning LOD off sends everything
+        layer.lod = False
+        assert self.client._view_state_listeners == []
+        sent = layer._sent_table()
+        assert len(sent) == len(self.table)
+
+        layer.lod = True
+        assert len(self.client._view_state_listeners) == 1
+        layer.remove()
+        assert self.client._view_state_listeners == []
+
+    def test_update_and_append(self):
+        layer = self.client.layers.add_table_layer(
+            table=self.table, lod=True, lod_max_rows=1000
+        )
+
+        layer.update_data(table=self.table[:500])
+        assert len(layer._lod_rows) <= 500
+
+        layer.append_rows(self.table[500:1000])
+        assert layer._lod_index is not None
+        assert len(layer._lod_index) == 1000
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            self.client.layers.add_table_layer(
+                table=self.table, frame="earth", lod=True
+            )
+
+        layer = self.client.layers.add_table_layer(table=self.table, lod=True)
+        with pytest.raises(ValueError):
+            layer.coord_type = "rectangular"
@@ -0,0 +1,437 @@
+from base64 import b64decode, b64encode
+from timeit import repeat
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.table import MaskedColumn, Table
+
+from . import binary_client, queued
+from ..core import BaseWWTWidget
+from ..layers import csv_table_win_newline
+from ..table_encoding import (
+    compress_payload,
+    decode_table_binary,
+    decode_table_tsv,
+    decompress_payload,
+    encode_column_binary,
+    encode_table_binary,
+    encode_xyz_binary,
+)
+
+
+def _large_table(n):
+    rng = np.random.default_rng(1234)
+    table = Table()
+    table["id"] = np.arange(n, dtype=np.int64)
+    table["ra"] = rng.uniform(0, 360, n) * u.deg
+    table["dec"] = rng.uniform(-90, 90, n) * u.deg
+    table["mag"] = rng.normal(18, 2, n)
+    return table
+
+
+def test_roundtrip():
+    table = Table()
+    table["f8"] = [1.5, 2.25, np.nan]
+    table["f4"] = np.array([1, 2, 3], dtype=np.float32)
+    table["i8"] = np.array([1, -2, 3], dtype=np.int64)
+    table["big"] = np.array([1, 2, 2**40], dtype=np.int64)
+    table["u1"] = np.array([1, 2, 255], dtype=np.uint8)
+    table["b"] = [True, False, True]
+    table["s"] = ["x y", "a,b", "été"]
+    table["m"] = MaskedColumn([1, 2, 3], mask=[False, True, False])
+
+    schema, buffers = encode_table_binary(table)
+    assert schema["nrows"] == 3
+    types = dict((c["name"], c["type"]) for c in schema["columns"])
+    assert types == {
+        "f8": "float64",
+        "f4": "float32",
+        "i8": "int32",
+        "big": "float64",
+        "u1": "uint8",
+        "b": "bool",
+        "s": "string",
+        "m": "float64",
+    }
+
+    decoded = decode_table_binary(schema, [bytes(b) for b in buffers])
+    assert decoded.colnames == table.colnames
+    np.testing.assert_array_equal(decoded["f8"], table["f8"])
+    np.testing.assert_array_equal(decoded["i8"], [1, -2, 3])
+    np.testing.assert_array_equal(decoded["big"], [1.0, 2.0, 2.0**40])
+    np.testing.assert_array_equal(decoded["b"], table["b"])
+    assert list(decoded["s"]) == list(table["s"])
+    np.testing.assert_array_equal(decoded["m"], [1.0, np.nan, 3.0])
+
+
+def test_roundtrip_precision():
+    table = Table()
+    table["id"] = np.arange(1000, 2000, dtype=np.int64)
+    table["ra"] = np.linspace(0, 360, 1000)
+    table["ra"][5] = np.nan
+    table["mag"] = np.linspace(10, 20, 1000)
+    table["half"] = np.arange(1000) / 2
+
+    features = ["scaled", "delta"]
+    encoded = [
+        encode_column_binary(table["id"], 0, features),
+        encode_column_binary(table["ra"], 1e-6, features),
+        encode_column_binary(table["mag"], 1e-2, features),
+        encode_column_binary(table["half"], 0, features),
+    ]
+    schema, buffers = encode_table_binary(table, encoded)
+    columns = dict((c["name"], c) for c in schema["columns"])
+    assert columns["id"]["type"] == "uint8"
+    assert columns["id"]["delta"]
+    assert columns["ra"]["type"] == "uint32"
+    assert columns["ra"]["scale"] == 1e-6
+    assert columns["mag"]["type"] == "float32"
+    assert columns["half"]["type"] == "float32"
+
+    decoded = decode_table_binary(schema, [bytes(b) for b in buffers])
+    np.testing.assert_array_equal(decoded["id"], table["id"])
+    np.testing.assert_allclose(decoded["ra"], table["ra"], rtol=0, atol=1e-6)
+    assert np.isnan(decoded["ra"][5])
+    np.testing.assert_allclose(decoded["mag"], table["mag"], rtol=0, atol=1e-2)
+    np.testing.assert_array_equal(decoded["half"], table["half"])
+
+    # Without the compact forms, columns are only narrowed to float32
+    schema, buffers = encode_table_binary(
+        table, [encode_column_binary(table[name], 1e-4) for name in table.colnames]
+    )
+    types = dict((c["name"], c["type"]) for c in schema["columns"])
+    assert types == {
+        "id": "uint16",
+        "ra": "float32",
+        "mag": "float32",
+        "half": "float32",
+    }
+
+
+def test_roundtrip_xyz():
+    table = Table()
+    table["x"] = np.linspace(-1, 1, 10) * u.kpc
+    table["y"] = np.linspace(0, 1, 10) * u.pc
+    table["z"] = np.zeros(10)
+    table["mass"] = np.arange(10.0)
+
+    encoded = encode_xyz_binary(table["x"], table["y"], table["z"], unit=u.pc)
+    encoded.append(encode_column_binary(table["mass"]))
+    schema, buffers = encode_table_binary(table, encoded)
+    assert len(buffers) == 2
+    assert [c["buffers"] for c in schema["columns"]] == [[0], [0], [0], [1]]
+
+    decoded = decode_table_binary(schema, [bytes(b) for b in buffers])
+    np.testing.assert_allclose(decoded["x"], np.linspace(-1000, 1000, 10))
+    np.testing.assert_allclose(decoded["y"], table["y"])
+    np.testing.assert_array_equal(decoded["mass"], table["mass"])
+
+
+def test_empty_table():
+    table = Table()
+    table["ra"] = np.zeros(0)
+    table["name"] = np.array([], dtype=str)
+    schema, buffers = encode_table_binary(table)
+    decoded = decode_table_binary(schema, buffers)
+    assert len(decoded) == 0
+    assert decoded.colnames == ["ra", "name"]
+
+
+def test_bad_version():
+    with pytest.raises(ValueError):
+        decode_table_binary({"version": 999, "columns": []}, [])
+
+
+def test_layer_falls_back_to_csv():
+    # Neither the transport nor the app support binary data here
+    client = BaseWWTWidget()
+    table = _large_table(10)
+    layer = client.layers.add_table_layer(table=table, data_encoding="binary")
+    assert layer.data_encoding == "binary"
+
+    ((msg, buffers),) = queued(client, "table_layer_create")
+    assert "table" in msg
+    assert "tableSchema" not in msg
+    assert buffers is None
+
+    # The transport can carry buffers but the app hasn't said that it can
+    # decode them
+    client = BaseWWTWidget()
+    client._supports_binary_buffers = True
+    client.layers.add_table_layer(table=table, data_encoding="binary")
+    ((msg, buffers),) = queued(client, "table_layer_create")
+    assert "table" in msg
+
+
+def test_layer_binary():
+    client = binary_client()
+    table = _large_table(10)
+
+    # CSV remains the default
+    client.layers.add_table_layer(table=table)
+    ((msg, buffers),) = queued(client, "table_layer_create")
+    assert "table" in msg
+
+    layer = client.layers.add_table_layer(table=table, data_encoding="binary")
+    msg, buffers = queued(client, "table_layer_create")[-1]
+    assert msg["id"] == layer.id
+    assert msg["tableEncoding"] == "binary"
+    assert "table" not in msg
+
+    decoded = decode_table_binary(msg["tableSchema"], buffers)
+    np.testing.assert_array_equal(decoded["ra"], table["ra"])
+    np.testing.assert_array_equal(decoded["id"], table["id"])
+
+    layer.update_data(table=table[:5])
+    msg, buffers = queued(client, "table_layer_update")[-1]
+    assert msg["tableSchema"]["nrows"] == 5
+
+    with pytest.raises(ValueError):
+        layer.data_encoding = "xml"
+
+
+def test_layer_data_precision():
+    client = binary_client()
+    client._on_app_message_received(
+        {"type": "wwt_application_state", "tableLayerFeatures": ["scaled", "delta"]}
+    )
+    table = _large_table(1000)
+    table["id"] += 10**6
+    client.layers.add_table_layer(table=table)
+    client.layers.add_table_layer(table=table, data_precision="auto")
+
+    (full_msg, _), (msg, _) = queued(client, "table_layer_create")
+    assert len(msg["table"]) < 0.8 * len(full_msg["table"])
+    decoded = Table.read(b64decode(msg["table"]).decode("ascii"), format="ascii.csv")
+    np.testing.assert_array_equal(decoded["id"], table["id"])
+    np.testing.assert_allclose(decoded["dec"], table["dec"], rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(decoded["mag"], table["mag"])
+
+    layer = client.layers.add_table_layer(
+        table=table, data_encoding="binary", data_precision="auto"
+    )
+    msg, buffers = queued(client, "table_layer_create")[-1]
+    types = dict((c["name"], c["type"]) for c in msg["tableSchema"]["columns"])
+    assert types == {"id": "uint8", "ra": "uint32", "dec": "uint32", "mag": "float64"}
+    decoded = decode_table_binary(msg["tableSchema"], buffers)
+    np.testing.assert_array_equal(decoded["id"], table["id"])
+
+    # Colormapped columns only need to be as precise as the colors
+    layer.cmap_att = "mag"
+    layer.update_data(table=table)
+    msg, buffers = queued(client, "table_layer_update")[-1]
+    types = dict((c["name"], c["type"]) for c in msg["tableSchema"]["columns"])
+    assert types["mag"] == "float32"
+
+    with pytest.raises(ValueError):
+        layer.data_precision = "low"
+
+
+def test_layer_chunked_upload():
+    client = binary_client()
+    client._on_app_message_received(
+        {"type": "wwt_application_state", "tableLayerFeatures": ["chunked"]}
+    )
+    table = _large_table(1000)
+    progress = []
+    layer = client.layers.add_table_layer(
+        table=table,
+        upload_chunk_size=5000,
+        upload_progress=lambda done, total: progress.append((done, total)),
+    )
+
+    ((msg, _),) = queued(client, "table_layer_create")
+    assert "table" not in msg
+    chunks = [chunk for chunk, _ in queued(client, "table_layer_chunk")]
+    assert len(chunks) == msg["tableChunks"] > 1
+    assert [chunk["seq"] for chunk in chunks] == list(range(len(chunks)))
+    assert all(chunk["upload"] == msg["tableUpload"] for chunk in chunks)
+    assert all(len(chunk["data"]) <= 5000 for chunk in chunks)
+    csv = b64decode("".join(chunk["data"] for chunk in chunks)).decode("ascii")
+    assert csv == csv_table_win_newline(table)
+    total = progress[-1][1]
+    assert progress[-1] == (total, total)
+    assert len(progress) == len(chunks)
+
+    # Binary buffers are split into slices
+    layer.data_encoding = "binary"
+    layer.update_data(table=table)
+    ((msg, buffers),) = queued(client, "table_layer_update")
+    assert buffers is None
+    assembled = [bytearray() for _ in msg["tableSchema"]["columns"]]
+
+    for chunk, slices in queued(client, "table_layer_chunk")[len(chunks):]:
+        assert sum(len(s) for s in slices) <= 5000
+        for (index, offset), data in zip(chunk["pieces"], slices):
+            assert len(assembled[index]) == offset
+            assembled[index] += data
+
+    decoded = decode_table_binary(msg["tableSchema"], assembled)
+    np.testing.assert_array_equal(decoded["ra"], table["ra"])
+
+    # Small data are sent as usual
+    layer.update_data(table=table[:10])
+    msg, buffers = queued(client, "table_layer_update")[-1]
+    assert "tableChunks" not in msg
+    assert len(buffers) == 4
+
+    with pytest.raises(ValueError):
+        layer.upload_chunk_size = 0
+
+    with pytest.raises(ValueError):
+        layer.upload_progress = "yes"
+
+
+@pytest.mark.parametrize("method", ["gzip", "zstd"])
+def test_compression_roundtrip(method):
+    if method == "zstd":
+        pytest.importorskip("zstandard")
+
+    data = b"ra,dec\r\n" + b"1.5,2.5\r\n" * 1000
+    compressed = compress_payload(data, method)
+    assert len(compressed) < len(data) / 10
+    assert decompress_payload(compressed, method) == data
+
+    # Typed buffers can be compressed directly
+    buffer = memoryview(np.arange(1000.0))
+    assert decompress_payload(compress_payload(buffer, method), method) == bytes(
+        buffer
+    )
+
+    with pytest.raises(ValueError):
+        compress_payload(data, "lzma")
+
+
+def test_layer_interleaved_xyz():
+    client = binary_client()
+    client._on_app_message_received(
+        {"type": "wwt_application_state", "tableLayerFeatures": ["interleaved"]}
+    )
+    table = Table()
+    table["x"] = np.linspace(-1, 1, 100) * u.kpc
+    table["y"] = np.linspace(0, 10, 100) * u.pc
+    table["z"] = np.arange(100.0) * u.pc
+    # kpc isn't one of the units that WWT knows, so the positions are sent in
+    # pc, converting them as they are packed.
+    with pytest.warns(UserWarning, match="kpc"):
+        layer = client.layers.add_table_layer(
+            table=table,
+            coord_type="rectangular",
+            data_encoding="binary",
+            data_precision="auto",
+        )
+    assert layer.xyz_unit == u.pc
+
+    msg, buffers = queued(client, "table_layer_create")[-1]
+    assert len(buffers) == 1
+    assert buffers[0].nbytes == 100 * 3 * 4
+    decoded = decode_table_binary(msg["tableSchema"], buffers)
+    np.testing.assert_allclose(
+        decoded["x"], table["x"].quantity.to_value(u.pc), rtol=1e-6
+    )
+    np.testing.assert_allclose(decoded["z"], table["z"], rtol=1e-6)
+
+    # Appended rows are packed too
+    layer.update_data(table=table, mode="append")
+    assert len(layer.table) == 200
+
+    # Full precision positions are sent as they are
+    layer.data_precision = "full"
+    msg, buffers = queued(client, "table_layer_update")[-1]
+    assert len(buffers) == 3
+
+
+def test_layer_compression():
+    client = binary_client()
+    client._on_app_message_received(
+        {"type": "wwt_application_state", "tableCompressions": ["gzip", "brotli"]}
+    )
+    table = _large_table(5000)
+    layer = client.layers.add_table_layer(table=table)
+
+    ((msg, _),) = queued(client, "table_layer_create")
+    assert msg["tableCompression"] == "gzip"
+    csv = decompress_payload(b64decode(msg["table"]), "gzip").decode("ascii")
+    assert csv == csv_table_win_newline(table)
+
+    layer.data_encoding = "binary"
+    layer.update_data(table=table)
+    msg, buffers = queued(client, "table_layer_update")[-1]
+    assert msg["tableCompression"] == "gzip"
+    decoded = decode_table_binary(
+        msg["tableSchema"], [decompress_payload(b, "gzip") for b in buffers]
+    )
+    np.testing.assert_array_equal(decoded["dec"], table["dec"])
+
+    # Small tables aren't compressed, and neither are tables sent with methods
+    # that the app doesn't support.
+    layer.update_data(table=table[:10])
+    assert "tableCompression" not in queued(client, "table_layer_update")[-1][0]
+    layer.data_compression = "zstd"
+    layer.update_data(table=table)
+    assert "tableCompression" not in queued(client, "table_layer_update")[-1][0]
+
+    with pytest.raises(ValueError):
+        layer.data_compression = "brotli"
+
+
+def test_compressed_payload_size_and_time():
+    # Compare the time taken to compress a large CSV payload and send it over
+    # a modest 100 Mbit/s connection with the time to send it as it is.
+    table = _large_table(100_000)
+    csv = csv_table_win_newline(table).encode("ascii")
+    bandwidth = 100e6 / 8
+
+    raw_size = len(b64encode(csv))
+    raw_time = raw_size / bandwidth
+
+    compressed_size = len(b64encode(compress_payload(csv, "gzip")))
+    compress_time = min(
+        repeat(
+            lambda: b64encode(compress_payload(csv, "gzip")), number=1, repeat=3
+        )
+    )
+    compressed_time = compress_time + compressed_size / bandwidth
+
+    assert compressed_size < 0.6 * raw_size
+    assert compressed_time < raw_time
+
+
+def test_payload_size_and_encode_time():
+    table = _large_table(100_000)
+
+    csv_payload = b64encode(csv_table_win_newline(table).encode("ascii"))
+    schema, buffers = encode_table_binary(table)
+    binary_size = sum(b.nbytes for b in buffers)
+
+    assert binary_size < 0.5 * len(csv_payload)
+
+    # Take the best of a few runs, and leave a wide margin, so that a busy
+    # machine doesn't make this fail.
+    csv_time = min(
+        repeat(
+            lambda: b64encode(csv_table_win_newline(table).encode("ascii")),
+            number=1,
+            repeat=3,
+        )
+    )
+    binary_time = min(
+        repeat(lambda: encode_table_binary(table), number=1, repeat=3)
+    )
+
+    assert binary_time < 0.1 * csv_time
+
+
+def test_decode_table_tsv():
+    text = "ra\tdec\tname\tmag\r\n1.5\t-2\tx\t\r\n3\t4\ty\t12.5\r\n"
+    table = decode_table_tsv(text)
+    expected = Table.read(text, format="ascii.tab")
+
+    assert table.colnames == ["ra", "dec", "name", "mag"]
+    for name in table.colnames:
+        assert table[name].dtype == expected[name].dtype
+        assert np.all(table[name] == expected[name])
+    assert table["mag"].mask.tolist() == [True, False]
+
+    assert len(decode_table_tsv("")) == 0
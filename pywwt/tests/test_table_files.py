@@ -0,0 +1,140 @@
+from base64 import b64decode
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.table import Table
+
+from ..core import BaseWWTWidget
+from ..layers import csv_table_win_newline
+from ..table_files import TableFile
+
+
+def _table(n=100):
+    table = Table()
+    table["flux"] = np.arange(n, dtype=float)
+    table["ra"] = np.linspace(0, 360, n, endpoint=False) * u.deg
+    table["dec"] = np.linspace(-80, 80, n)
+    table["mag"] = np.arange(n) % 7
+    table["name"] = ["star{0}".format(i) for i in range(n)]
+    return table
+
+
+def _client():
+    client = BaseWWTWidget()
+    client._on_app_message_received(
+        {"type": "wwt_application_state", "tableLayerFeatures": ["append"]}
+    )
+    return client
+
+
+def _sent_csv(client):
+    messages = [
+        msg
+        for msg, buffers in client._startupMessageQueue
+        if msg.get("event") in ("table_layer_create", "table_layer_append")
+    ]
+    texts = [b64decode(msg["table"]).decode("ascii") for msg in messages]
+    header = texts[0][: texts[0].index("\r\n") + 2]
+    return len(messages), header + "".join(text[len(header):] for text in texts)
+
+
+def test_fits_table_layer(tmp_path):
+    filename = tmp_path / "catalog.fits"
+    table = _table()
+    table.write(filename)
+
+    client = _client()
+    layer = client.layers.add_table_layer(table=str(filename), chunk_rows=30)
+
+    # Only the coordinates are read, and they're sent in chunks
+    assert layer.table.colnames == ["ra", "dec"]
+    assert layer.lon_att == "ra"
+    n_messages, csv = _sent_csv(client)
+    assert n_messages == 4
+    assert csv == csv_table_win_newline(table["ra", "dec"])
+
+    # Other columns are read when needed
+    layer.size_att = "mag"
+    assert layer.table.colnames == ["ra", "dec", "mag"]
+    assert layer.size_vmax == 6
+
+    with pytest.raises(ValueError):
+        layer.append_rows(table[:1])
+
+    # Replacing the data with an in-memory table works as usual
+    layer.update_data(table=table)
+    assert layer.table.colnames == table.colnames
+    layer.append_rows(table[:1])
+    assert len(layer.table) == 101
+
+    # Viewers that can't append rows get the whole table at once
+    client = BaseWWTWidget()
+
+    with pytest.warns(UserWarning, match="chunk_rows"):
+        client.layers.add_table_layer(table=str(filename), chunk_rows=30)
+
+    assert _sent_csv(client) == (1, csv_table_win_newline(table["ra", "dec"]))
+
+
+def test_fits_table_file(tmp_path):
+    filename = tmp_path / "catalog.fit"
+    _table().write(filename)
+
+    table_file = TableFile(filename)
+    assert table_file.format == "fits"
+    assert table_file.colnames == ["flux", "ra", "dec", "mag", "name"]
+    assert len(table_file) == 100
+
+    table = table_file.read(["dec", "flux"])
+    assert table.colnames == ["dec", "flux"]
+    assert np.all(table["flux"] == np.arange(100))
+
+    with pytest.raises(KeyError):
+        table_file.read(["nope"])
+
+    with pytest.raises(ValueError):
+        TableFile(tmp_path / "catalog.txt")
+
+    with pytest.raises(ValueError):
+        TableFile(filename, format="votable")
+
+
+def test_hdf5_table_file(tmp_path):
+    h5py = pytest.importorskip("h5py")
+    filename = tmp_path / "catalog.h5"
+    table = _table()
+    table["name"] = table["name"].astype("S")
+
+    with h5py.File(filename, "w") as f:
+        f.create_dataset("data/catalog", data=table.as_array())
+        f.create_dataset(
+            "data/chunked", data=table.as_array(), chunks=True, compression="gzip"
+        )
+
+    with pytest.raises(ValueError):
+        TableFile(filename)
+
+    for path in ("data/catalog", "data/chunked"):
+        table_file = TableFile(filename, path=path)
+        assert table_file.colnames == table.colnames
+        assert len(table_file) == 100
+        read = table_file.read(["mag", "ra"])
+        assert read.colnames == ["mag", "ra"]
+        assert np.all(read["mag"] == table["mag"])
+
+
+def test_parquet_table_file(tmp_path):
+    pytest.importorskip("pyarrow")
+    filename = tmp_path / "catalog.parquet"
+    _table().write(filename)
+
+    table_file = TableFile(filename)
+    assert table_file.colnames == ["flux", "ra", "dec", "mag", "name"]
+    assert len(table_file) == 100
+
+    client = _client()
+    layer = client.layers.add_table_layer(table=table_file, chunk_rows=60)
+    assert layer.table.colnames == ["ra", "dec"]
+    assert layer.table["ra"].unit == u.deg
+    assert _sent_csv(client)[0] == 2
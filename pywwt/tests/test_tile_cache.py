@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from .. import layers
+from ..core import BaseWWTWidget
+from ..tile_cache import TileCache, _FileLock
+
+
+def _writer(data):
+    def create(path):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    return create
+
+
+def _create_slowly(cache_dir, log):
+    def create(path):
+        with open(log, "a") as f:
+            f.write("created\n")
+        time.sleep(0.2)
+        with open(path, "w") as f:
+            f.write("data")
+
+    TileCache(cache_dir).get("shared", create)
+
+
+def test_entries_created_once(tmp_path):
+    cache = TileCache(tmp_path)
+    calls = []
+
+    def create(path):
+        calls.append(path)
+        os.mkdir(path)
+        with open(os.path.join(path, "tile.png"), "wb") as f:
+            f.write(b"x" * 100)
+
+    path1 = cache.get("a", create, name="tiles")
+    path2 = cache.get("a", create, name="tiles")
+    assert path1 == path2
+    assert os.path.basename(path1) == "tiles"
+    assert len(calls) == 1
+    assert os.path.isfile(os.path.join(path1, "tile.png"))
+    assert cache.size() == 100
+
+    # A cache in the same directory, as in another process, sees the entry
+    assert TileCache(tmp_path).get("a", create, name="tiles") == path1
+    assert len(calls) == 1
+
+    cache.remove("a")
+    assert cache.size() == 0
+    cache.get("a", create, name="tiles")
+    assert len(calls) == 2
+
+
+def test_failed_creation(tmp_path):
+    cache = TileCache(tmp_path)
+
+    class Failed(Exception):
+        pass
+
+    def create(path):
+        with open(path, "w") as f:
+            f.write("half-written")
+        raise Failed()
+
+    with pytest.raises(Failed):
+        cache.get("a", create)
+
+    # Nothing is left behind, and the next attempt creates the entry again
+    assert os.listdir(os.path.join(tmp_path, "entries")) == []
+    assert os.listdir(os.path.join(tmp_path, "tmp")) == []
+    path = cache.get("a", _writer(b"data"))
+    with open(path, "rb") as f:
+        assert f.read() == b"data"
+
+
+def test_lru_eviction(tmp_path):
+    cache = TileCache(tmp_path, max_size=250)
+    entries_dir = os.path.join(tmp_path, "entries")
+    path_a = cache.get("a", _writer(b"a" * 100))
+    os.utime(os.path.join(entries_dir, "a"), (1, 1))
+    cache.get("b", _writer(b"b" * 100))
+    os.utime(os.path.join(entries_dir, "b"), (2, 2))
+
+    # Using an entry makes it the most recently used one, so adding a third
+    # entry evicts the second.
+    assert cache.get("a", _writer(b"")) == path_a
+    cache.get("c", _writer(b"c" * 100))
+    assert sorted(os.listdir(entries_dir)) == ["a", "c"]
+    assert cache.size() == 200
+
+    # The newest entry is kept even if it's bigger than the limit
+    cache.get("d", _writer(b"d" * 300))
+    assert os.listdir(entries_dir) == ["d"]
+
+    cache.clear()
+    assert cache.size() == 0
+
+
+def test_held_entries(tmp_path):
+    cache = TileCache(tmp_path)
+    entries_dir = os.path.join(tmp_path, "entries")
+    path = cache.get("a", _writer(b"a" * 100))
+    hold = cache.hold(path)
+    assert cache.hold(str(tmp_path / "elsewhere")) is None
+
+    # Held entries aren't evicted, even by another session
+    TileCache(tmp_path).clear()
+    assert os.listdir(entries_dir) == ["a"]
+
+    hold.release()
+    cache.clear()
+    assert os.listdir(entries_dir) == []
+    assert cache.hold(path) is None
+
+    # The holds of processes that have died are ignored
+    path = cache.get("b", _writer(b"b" * 100))
+    stale = cache.hold(path)
+    _FileLock.release(stale)  # Unlocks the file without deleting it
+    cache.clear()
+    assert os.listdir(entries_dir) == []
+    assert os.listdir(os.path.join(tmp_path, "holds")) == []
+
+
+def test_concurrent_creation(tmp_path):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs fork-based multiprocessing")
+
+    context = multiprocessing.get_context("fork")
+    log = str(tmp_path / "log")
+    processes = [
+        context.Process(target=_create_slowly, args=(str(tmp_path / "cache"), log))
+        for _ in range(4)
+    ]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+
+    with open(log) as f:
+        assert f.read() == "created\n"
+
+
+def test_tiled_image_cache(tmp_path, monkeypatch, tile_cache):
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = "RA---TAN", "DEC--TAN"
+    wcs.wcs.crpix = 32, 32
+    wcs.wcs.cdelt = -1e-4, 1e-4
+    wcs.wcs.crval = 10, 20
+    data = np.random.default_rng(1).normal(size=(64, 64)).astype(np.float32)
+    image = str(tmp_path / "image.fits")
+    fits.PrimaryHDU(data, wcs.to_header()).writeto(image)
+
+    client = BaseWWTWidget()
+    monkeypatch.setattr(client, "_serve_tree", lambda path: "http://localhost/tiles/")
+    monkeypatch.setattr(client, "load_image_collection", lambda **kwargs: None)
+    tile_fits = layers.toasty.tile_fits
+    tiled = []
+
+    def counting_tile_fits(*args, **kwargs):
+        tiled.append(kwargs["out_dir"])
+        return tile_fits(*args, **kwargs)
+
+    monkeypatch.setattr(layers.toasty, "tile_fits", counting_tile_fits)
+
+    def add_layer(**kwargs):
+        return client.layers.add_image_layer(
+            image, tiling_method=layers.TilingMethod.TAN, verbose=False, **kwargs
+        )
+
+    layer1 = add_layer()
+    assert len(tiled) == 1
+    assert tiled[0].startswith(tile_cache.directory)
+    assert layer1.name == "image_tiled"
+
+    # The tiles are reused, along with the image's pixel cuts, even if they
+    # were made by another session or with a different number of processes
+    client.layers.tile_cache = TileCache(tile_cache.directory)
+    layer2 = add_layer(parallel=False)
+    assert len(tiled) == 1
+    assert layer2.name == layer1.name
+    assert layer2.vmin == layer1.vmin
+    assert layer2.vmax == layer1.vmax
+
+    # Different settings make different tiles
+    add_layer(blankval=0)
+    assert len(tiled) == 2
+
+    add_layer(override=True)
+    assert len(tiled) == 3
+
+    # The tiles that layers are showing are kept until the layers are removed
+    client.layers.tile_cache = tile_cache
+    tile_cache.clear()
+    assert tile_cache.size() > 0
+    for layer in list(client.layers):
+        layer.remove()
+    tile_cache.clear()
+    assert tile_cache.size() == 0
+
+    # The cache can be turned off
+    client.layers.tile_cache = None
+    add_layer(out_dir=str(tmp_path / "tiles"))
+    assert tiled[3] == str(tmp_path / "tiles")
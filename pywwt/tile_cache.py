@@ -0,0 +1,484 @@
+# Copyright 2021 the .NET Foundation
+# Licensed under the three-clause BSD License
+
+"""
+A persistent on-disk cache for processed images.
+
+Tiling a large image or mosaic with `toasty` and reprojecting images for WWT
+can take minutes, so the results are kept in a cache that is shared by all
+pywwt sessions of the same user, by default in ``~/.cache/pywwt``. Entries are
+identified by hashes of the complete contents of their inputs and of the
+settings used to process them, so showing the same data again reuses them
+however it was loaded.
+
+Entries are created in a scratch directory and renamed into place, so other
+processes never see them half-written, and a lock file for each entry stops
+several processes from creating the same entry at once. When the cache grows
+past its size limit, the least recently used entries are removed, except for
+those that are held because they are in use, for instance by a layer whose
+tiles are being served to WWT.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from .logger import logger
+
+__all__ = ["TileCache", "get_tile_cache"]
+
+# The default limit on the size of the cache, in bytes.
+DEFAULT_CACHE_SIZE = 10 * 2 ** 30
+
+# The name of the file holding the details of each entry.
+ENTRY_INFO = ".entry.json"
+
+_tile_cache = None
+
+
+def get_tile_cache():
+    """
+    Get the cache shared by all of the layer managers in this process.
+
+    The cache is in the ``pywwt`` subdirectory of ``$XDG_CACHE_HOME``, or of
+    ``~/.cache`` if that is not set. The directory and size limit can be set
+    with the ``PYWWT_CACHE_DIR`` and ``PYWWT_CACHE_SIZE`` environment
+    variables, or by changing the returned object.
+
+    Returns
+    -------
+    cache : :class:`TileCache`
+    """
+    global _tile_cache
+
+    if _tile_cache is None:
+        size = os.environ.get("PYWWT_CACHE_SIZE")
+        _tile_cache = TileCache(
+            directory=os.environ.get("PYWWT_CACHE_DIR"),
+            max_size=int(size) if size else DEFAULT_CACHE_SIZE,
+        )
+
+    return _tile_cache
+
+
+def _default_directory():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "pywwt")
+
+
+def _path_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    size = 0
+
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(root, filename))
+
+    return size
+
+
+class _FileLock(object):
+    """
+    An exclusive lock on a file, which is held by at most one process (or open
+    lock object) at a time.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """
+        Acquire the lock, waiting for it if *blocking* is true. Returns whether
+        the lock was acquired.
+        """
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o666)
+
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.1)
+            else:
+                import fcntl
+
+                flags = fcntl.LOCK_EX
+
+                if not blocking:
+                    flags |= fcntl.LOCK_NB
+
+                fcntl.flock(fd, flags)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+
+        if os.name == "nt":
+            import msvcrt
+
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class _EntryHold(_FileLock):
+    """
+    A lock on a file of its own that marks an entry of the cache as being in
+    use by the holder. The file is deleted when the hold is released. If the
+    holder dies without releasing it, the lock is freed, and the file is
+    recognized as stale.
+    """
+
+    def release(self):
+        super(_EntryHold, self).release()
+
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+class TileCache(object):
+    """
+    A size-limited on-disk cache of processed images.
+
+    Parameters
+    ----------
+    directory : str or path-like, optional
+        The directory holding the cache, which is created if needed. By
+        default, this is ``~/.cache/pywwt``.
+    max_size : int, optional
+        The limit on the total size of the cache, in bytes. The least recently
+        used entries are removed when the cache grows past this.
+
+    Notes
+    -----
+    Each entry is a file or a directory, created by a function that is only
+    called if the entry isn't already in the cache. Entries should be treated
+    as read-only. Entries that are in use should be held with :meth:`hold`, so
+    that they aren't evicted.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        if directory is None:
+            directory = _default_directory()
+
+        self.directory = os.fspath(directory)
+        self.max_size = max_size
+
+    def __repr__(self):
+        return "<TileCache {0} ({1} bytes)>".format(self.directory, self.size())
+
+    def _subdirectory(self, name):
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _lock(self, key):
+        return _FileLock(os.path.join(self._subdirectory("locks"), key))
+
+    def available(self):
+        """
+        Check whether the cache can be used, creating its directory if needed.
+
+        Returns
+        -------
+        available : bool
+            Whether the cache directory exists and can be written to.
+        """
+        try:
+            for name in ("entries", "holds", "locks", "tmp"):
+                self._subdirectory(name)
+        except OSError:
+            return False
+
+        return os.access(self.directory, os.W_OK)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Make the key of an entry from the settings and content hashes that
+        identify it.
+
+        Parameters
+        ----------
+        parts
+            Values that can be converted to JSON, such as strings, numbers and
+            lists of them.
+
+        Returns
+        -------
+        key : str
+        """
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=20).hexdigest()
+
+    def get(self, key, create, name="data"):
+        """
+        Get the path of an entry of the cache, creating the entry if needed.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry, from :meth:`key`.
+        create : callable
+            A function that is called with a path if the entry has to be
+            created. It should write a file or directory at that path.
+        name : str, optional
+            The name of the entry's file or directory. Some tools use this,
+            for instance to name tile pyramids.
+
+        Returns
+        -------
+        path : str
+            The path of the file or directory.
+        """
+        entry_dir = os.path.join(self._subdirectory("entries"), key)
+
+        with self._lock(key):
+            path = self._lookup(entry_dir)
+
+            if path is not None:
+                # Bump the entry's modification time to keep track of the
+                # order in which entries were used.
+                os.utime(entry_dir)
+                return path
+
+            scratch = tempfile.mkdtemp(dir=self._subdirectory("tmp"))
+
+            try:
+                create(os.path.join(scratch, name))
+                size = _path_size(os.path.join(scratch, name))
+
+                with open(os.path.join(scratch, ENTRY_INFO), "w") as f:
+                    json.dump({"name": name, "size": size}, f)
+
+                # A whole directory can be renamed atomically, so the entry
+                # either appears complete or not at all.
+                os.rename(scratch, entry_dir)
+            except BaseException:
+                shutil.rmtree(scratch, ignore_errors=True)
+                raise
+
+        self.evict(keep=key)
+        return os.path.join(entry_dir, name)
+
+    def hold(self, path):
+        """
+        Stop an entry from being evicted while it is in use, by this or any
+        other process.
+
+        Parameters
+        ----------
+        path : str
+            The path of the entry's file or directory, as returned by
+            :meth:`get`.
+
+        Returns
+        -------
+        hold : object or None
+            An object whose ``release()`` method ends the hold, or `None` if
+            *path* isn't an entry of the cache.
+        """
+        entry_dir = os.path.dirname(os.path.abspath(path))
+        entries_dir = os.path.abspath(self._subdirectory("entries"))
+
+        if os.path.dirname(entry_dir) != entries_dir:
+            return None
+
+        key = os.path.basename(entry_dir)
+
+        with self._lock(key):
+            if self._lookup(entry_dir) is None:
+                return None
+
+            hold = _EntryHold(
+                os.path.join(
+                    self._subdirectory("holds"), key + "." + uuid.uuid4().hex
+                )
+            )
+            hold.acquire()
+
+        return hold
+
+    def _held(self, key):
+        """
+        Determine whether an entry is held, deleting stale holds of processes
+        that have died.
+        """
+        holds_dir = self._subdirectory("holds")
+        held = False
+
+        for filename in os.listdir(holds_dir):
+            if filename.rsplit(".", 1)[0] != key:
+                continue
+
+            hold = _FileLock(os.path.join(holds_dir, filename))
+
+            if not hold.acquire(blocking=False):
+                held = True
+                continue
+
+            hold.release()
+
+            try:
+                os.remove(hold.filename)
+            except OSError:
+                pass
+
+        return held
+
+    def _lookup(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, ENTRY_INFO)) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            if os.path.isdir(entry_dir):
+                # A leftover from an interrupted removal
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        path = os.path.join(entry_dir, info["name"])
+        return path if os.path.exists(path) else None
+
+    def _entries(self):
+        """
+        Get the key, size and time of last use of each entry, from the least
+        to the most recently used.
+        """
+        entries_dir = self._subdirectory("entries")
+        entries = []
+
+        for key in os.listdir(entries_dir):
+            entry_dir = os.path.join(entries_dir, key)
+
+            try:
+                with open(os.path.join(entry_dir, ENTRY_INFO)) as f:
+                    size = json.load(f)["size"]
+                used = os.stat(entry_dir).st_mtime
+            except (OSError, ValueError, KeyError):
+                continue
+
+            entries.append((used, key, size))
+
+        entries.sort()
+        return [(key, size, used) for used, key, size in entries]
+
+    def size(self):
+        """
+        Get the total size of the entries in the cache.
+
+        Returns
+        -------
+        size : int
+            The size, in bytes.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def remove(self, key):
+        """
+        Remove an entry from the cache, if it is present.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+        """
+        with self._lock(key):
+            self._remove(key)
+
+    def _remove(self, key):
+        entry_dir = os.path.join(self._subdirectory("entries"), key)
+
+        if not os.path.isdir(entry_dir):
+            return
+
+        # Move the entry out of the way first, so that it disappears at once
+        # even though deleting a large tile pyramid takes a while.
+        trash = os.path.join(self._subdirectory("tmp"), uuid.uuid4().hex)
+        os.rename(entry_dir, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self, max_size=None, keep=None):
+        """
+        Remove the least recently used entries until the cache is under its
+        size limit.
+
+        Entries that are held (see :meth:`hold`), or that another process is
+        creating or removing, are skipped.
+
+        Parameters
+        ----------
+        max_size : int, optional
+            The size limit, in bytes. By default, this is :attr:`max_size`.
+        keep : str, optional
+            The key of an entry that should not be removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+
+        for key, size, _ in entries:
+            if total <= max_size:
+                break
+
+            if key == keep:
+                continue
+
+            lock = self._lock(key)
+
+            if not lock.acquire(blocking=False):
+                continue
+
+            try:
+                if self._held(key):
+                    continue
+
+                self._remove(key)
+            finally:
+                lock.release()
+
+            logger.debug("evicted %s (%d bytes) from the tile cache", key, size)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all of the entries from the cache, apart from those that are
+        held.
+        """
+        self.evict(max_size=0)
@@ -3,6 +3,7 @@ from traitlets import (TraitType, TraitError,
                        Bool as OriginalBool,
                        CFloat as OriginalFloat,
                        Int as OriginalInt,
+                       List as OriginalList,
                        Unicode as OriginalUnicode)
 from astropy import units as u
 
@@ -13,7 +14,7 @@ except ImportError:
     def to_hex(input):  # noqa
         return rgb2hex(colorConverter.to_rgb(input))
 
-__all__ = ['Any', 'Bool', 'Float', 'Int', 'Unicode', 'AstropyQuantity',
+__all__ = ['Any', 'Bool', 'Float', 'Int', 'List', 'Unicode', 'AstropyQuantity',
            'Color', 'ColorWithOpacity', 'to_hex']
 
 # We inherit the original trait classes to make sure that the docstrings are set
@@ -51,6 +52,14 @@ class Int(OriginalInt):
             self.__doc__ = self.help
 
 
+class List(OriginalList):
+
+    def __init__(self, *args, **kwargs):
+        super(List, self).__init__(*args, **kwargs)
+        if self.help:
+            self.__doc__ = self.help
+
+
 class Unicode(OriginalUnicode):
 
     def __init__(self, *args, **kwargs):
@@ -1,24 +1,80 @@
+import multiprocessing
+import os
+import warnings
+
+import erfa
 import numpy as np
 import pytz
 from astropy.io import fits
 from astropy.io.fits import CompImageHDU, ImageHDU, PrimaryHDU
 from astropy.coordinates import ICRS
 from astropy.time import Time
+from astropy.wcs import WCS
+from astropy.wcs.utils import wcs_to_celestial_frame
 from datetime import datetime
 from reproject import reproject_interp
 from reproject.mosaicking import find_optimal_celestial_wcs
 
-__all__ = ["sanitize_image"]
+__all__ = ["sanitize_image", "wwt_compatible_file", "wwt_compatible_image"]
+
+# Julian date of midnight on 1970 January 1
+_UNIX_EPOCH_JD = 2440588
+
+# The memory that reprojecting an image for WWT may use, in bytes, besides
+# that used by the input image. The image is reprojected in blocks of rows
+# that fit in this, however large it is.
+SANITIZE_MEMORY_LIMIT = 2 * 2 ** 30
+
+# Roughly the most memory that reproject_interp uses for each output pixel, in
+# bytes, mostly for arrays of coordinates.
+REPROJECT_BYTES_PER_PIXEL = 160
+
+# In the worker processes of a parallel reprojection, the image that they are
+# reprojecting into a memory-mapped output. This is only set in the workers,
+# by their pool's initializer.
+_worker_reprojection = None
 
 
-def sanitize_image(image, output_file, overwrite=False, hdu_index=None, **kwargs):
+def sanitize_image(
+    image,
+    output_file,
+    overwrite=False,
+    hdu_index=None,
+    parallel=1,
+    memory_limit=SANITIZE_MEMORY_LIMIT,
+    compatible=None,
+    **kwargs
+):
     """
     Transform a FITS image so that it is in equatorial coordinates with a TAN
     projection and floating-point values, all of which are required to work
     correctly in WWT at the moment.
 
     Image can be a filename, an HDU, or a tuple of (array, WCS).
+
+    Images that WWT can show as they are (see :func:`wwt_compatible_image`)
+    aren't reprojected. If *image* is such a file, and the image is in its
+    primary HDU, nothing is written and *image* itself is returned. Other
+    compatible images are written to *output_file* unchanged. If the caller
+    has already checked the file with :func:`wwt_compatible_file`, it can pass
+    the result as *compatible* so that the file isn't read again.
+
+    Otherwise, the image is reprojected straight into a memory-mapped output file, in
+    blocks of rows that fit in *memory_limit* bytes. By default, this is done
+    in this process. If *parallel* is more than one, that many forked
+    processes reproject blocks at once, and ``parallel=None`` starts one for
+    each CPU. Forking a process that runs other threads, as Jupyter kernels
+    do, can deadlock, so only do this where that isn't a concern.
+
+    Returns the name of the file holding the transformed image.
     """
+    if compatible is None:
+        compatible = isinstance(image, str) and wwt_compatible_file(
+            image, hdu_index=hdu_index
+        )
+
+    if compatible:
+        return image
 
     # In case of a FITS file with more than one HDU, we need to choose one
     if isinstance(image, str):
@@ -34,17 +90,88 @@ def sanitize_image(image, output_file, overwrite=False, hdu_index=None, **kwargs
                     ):
                         break
                 image = hdu
-            transform_to_wwt_supported_fits(image, output_file, overwrite)
+            return transform_to_wwt_supported_fits(
+                image, output_file, overwrite, parallel, memory_limit
+            )
     else:
-        transform_to_wwt_supported_fits(image, output_file, overwrite)
+        return transform_to_wwt_supported_fits(
+            image, output_file, overwrite, parallel, memory_limit
+        )
+
+
+def wwt_compatible_image(data, wcs):
+    """
+    Check whether WWT can show an image as it is, without reprojecting it.
+
+    That is the case for 2-d single- or double-precision images in ICRS
+    coordinates, with a TAN projection and no distortions, that have north up
+    and east to the left, like the images that :func:`sanitize_image` makes.
+    """
+    if data.ndim != 2 or data.dtype.kind != "f" or data.dtype.itemsize not in (4, 8):
+        return False
+
+    if wcs.naxis != 2 or tuple(wcs.wcs.ctype) != ("RA---TAN", "DEC--TAN"):
+        return False
+
+    if wcs.has_distortion:
+        return False
 
+    try:
+        frame = wcs_to_celestial_frame(wcs)
+    except ValueError:
+        return False
 
-def transform_to_wwt_supported_fits(image, output_file, overwrite):
+    if not isinstance(frame, ICRS):
+        return False
+
+    # Right ascension must increase to the left and declination upwards,
+    # with no rotation.
+    matrix = wcs.pixel_scale_matrix
+    return (
+        matrix[0, 1] == 0 and matrix[1, 0] == 0 and matrix[0, 0] < 0 < matrix[1, 1]
+    )
+
+
+def wwt_compatible_file(filename, hdu_index=None):
+    """
+    Check whether WWT can show the image in a FITS file straight from the
+    file.
+
+    The image has to be compatible (see :func:`wwt_compatible_image`), and in
+    the primary HDU of an uncompressed file, without any scaling of its
+    values.
+    """
+    if hdu_index not in (None, 0):
+        return False
+
+    with fits.open(filename) as hdul:
+        if hdul.fileinfo(0)["file"].compression is not None:
+            return False
+
+        hdu = hdul[0]
+        header = hdu.header
+
+        if header.get("NAXIS") != 2 or header.get("BITPIX") not in (-32, -64):
+            return False
+
+        if "BSCALE" in header or "BZERO" in header:
+            return False
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            wcs = WCS(header)
+
+        # The data are memory-mapped, so this doesn't read them.
+        return wwt_compatible_image(hdu.data, wcs)
+
+
+def transform_to_wwt_supported_fits(
+    image, output_file, overwrite, parallel=1, memory_limit=SANITIZE_MEMORY_LIMIT
+):
     # Workaround because `reproject` currently only accepts 2D inputs. This is a
     # hack and it would be better to update reproject to do this processing.
     # Also, this logic is copy/pasting `toasty.collection.SimpleFitsCollection`.
 
-    import warnings
     from reproject.utils import parse_input_data
 
     with warnings.catch_warnings():
@@ -103,10 +230,96 @@ def transform_to_wwt_supported_fits(image, output_file, overwrite):
 
     # End workaround.
 
+    if wwt_compatible_image(data, wcs):
+        # Nothing to reproject. Arrays are written without converting them, so
+        # they aren't copied either.
+        fits.PrimaryHDU(data, header=wcs.to_header()).writeto(
+            output_file, overwrite=overwrite
+        )
+        return output_file
+
     wcs, shape_out = find_optimal_celestial_wcs([image], frame=ICRS(), projection="TAN")
-    array = reproject_interp(image, wcs, shape_out=shape_out, return_footprint=False)
-    fits.writeto(
-        output_file, array.astype(np.float32), wcs.to_header(), overwrite=overwrite
+    output = _create_fits_image(output_file, wcs.to_header(), shape_out, overwrite)
+
+    if parallel is None:
+        parallel = os.cpu_count() or 1
+    if "fork" not in multiprocessing.get_all_start_methods():
+        parallel = 1
+
+    # Each process holds the coordinates of a block of pixels at a time, so
+    # the blocks get smaller the more processes there are.
+    rows = memory_limit // (parallel * shape_out[1] * REPROJECT_BYTES_PER_PIXEL)
+    rows = max(int(rows), 1)
+    blocks = [
+        (start, min(start + rows, shape_out[0]))
+        for start in range(0, shape_out[0], rows)
+    ]
+
+    try:
+        if parallel == 1 or len(blocks) == 1:
+            for block in blocks:
+                _reproject_block(image, wcs, output, block)
+        else:
+            # The workers are forked, so they get the image and the memory map
+            # of the output without copying them.
+            context = multiprocessing.get_context("fork")
+
+            with context.Pool(
+                min(parallel, len(blocks)),
+                initializer=_start_reprojection_worker,
+                initargs=(image, wcs, output),
+            ) as pool:
+                for _ in pool.imap_unordered(_reproject_worker_block, blocks):
+                    pass
+
+        output.flush()
+    finally:
+        del output
+
+    return output_file
+
+
+def _create_fits_image(output_file, header, shape, overwrite):
+    """
+    Create a FITS file with a single-precision image of the given shape, whose
+    data are left as zeros, and return a memory-mapped array of them.
+    """
+    if not overwrite and os.path.exists(output_file):
+        raise OSError("File {!r} already exists.".format(output_file))
+
+    header = PrimaryHDU(np.zeros((1, 1), dtype=np.float32), header=header).header
+    header["NAXIS1"] = shape[1]
+    header["NAXIS2"] = shape[0]
+    header_bytes = header.tostring().encode("ascii")
+    data_size = shape[0] * shape[1] * 4
+
+    with open(output_file, "wb") as f:
+        f.write(header_bytes)
+        # Extending the file fills it with zeros, which most file systems
+        # store sparsely until the pixels are written.
+        f.truncate(len(header_bytes) + -(-data_size // 2880) * 2880)
+
+    return np.memmap(
+        output_file, dtype=">f4", mode="r+", offset=len(header_bytes), shape=shape
+    )
+
+
+def _start_reprojection_worker(image, wcs, output):
+    global _worker_reprojection
+    _worker_reprojection = image, wcs, output
+
+
+def _reproject_worker_block(block):
+    _reproject_block(*_worker_reprojection, block)
+
+
+def _reproject_block(image, wcs, output, block):
+    start, stop = block
+    output[start:stop] = reproject_interp(
+        image,
+        wcs[start:stop, :],
+        shape_out=(stop - start, output.shape[1]),
+        return_footprint=False,
     )
 
 
@@ -144,8 +357,8 @@ def ensure_utc(tm, str_allowed):
         else:  # has a non-UTC time zone
             utc_tm = tm.astimezone(pytz.UTC).isoformat()
 
-    elif isinstance(tm, Time):
-        utc_tm = tm.to_datetime(pytz.UTC).isoformat()
+    elif isinstance(tm, (Time, np.datetime64)):
+        utc_tm = str(ensure_utc_array(tm))
 
     else:
         if str_allowed:  # is an ISOT string
@@ -155,3 +368,73 @@ def ensure_utc(tm, str_allowed):
             raise ValueError("Time must be a datetime or astropy.Time object")
 
     return utc_tm
+
+
+def _leap_second_days():
+    """
+    Get the days, counted from the Unix epoch, that end with a leap second.
+    """
+    # Leap seconds are inserted just before the months listed in the table
+    table = erfa.leap_seconds.get()
+    months = np.array(
+        ["{0:04d}-{1:02d}".format(y, m) for y, m in zip(table["year"], table["month"])],
+        dtype="datetime64[M]",
+    )
+    return months.astype("datetime64[D]").astype(np.int64)[1:] - 1
+
+
+def ensure_utc_array(times):
+    """
+    Vectorized version of :func:`ensure_utc` for whole columns of times.
+
+    *times* may be an astropy Time array, a numpy ``datetime64`` array, an
+    array of ISOT strings, or an object array of anything accepted by
+    :func:`ensure_utc`. Naive times are assumed to be in UTC. The result is an
+    array of ISO 8601 strings in the same format that :func:`ensure_utc`
+    produces, e.g. ``"2020-01-01T00:00:00+00:00"``.
+    """
+    if isinstance(times, Time):
+        # Time.datetime64 goes through string formatting internally, so work
+        # from the two-part Julian dates instead. For UTC, jd1 is integral and
+        # jd2 is within half a day of it.
+        # Work on a flat copy, so that scalar times can be indexed too.
+        utc = times.utc.ravel()
+        days = (np.asarray(utc.jd1) - _UNIX_EPOCH_JD).astype(np.int64)
+        usecs = np.round((np.asarray(utc.jd2) + 0.5) * 86_400_000_000)
+        dt64 = (days * 86_400_000_000 + usecs.astype(np.int64)).astype(
+            "datetime64[us]"
+        )
+
+        # Days ending in a leap second are 86401 seconds long, so the simple
+        # calculation doesn't apply. These are rare enough to do slowly.
+        leap = np.isin(days, _leap_second_days())
+        if np.any(leap):
+            dt64[leap] = np.asarray(utc[leap].datetime64).astype("datetime64[us]")
+
+        dt64 = dt64.reshape(times.shape)
+    else:
+        times = np.asarray(times)
+        kind = times.dtype.kind
+
+        if kind == "M":
+            dt64 = times
+        elif kind in "US":
+            dt64 = Time(times, format="isot").utc.datetime64
+        elif kind == "O":
+            # Python datetimes may carry arbitrary time zones, so there is no
+            # fast path for them.
+            return np.array(
+                [ensure_utc(tm, str_allowed=True) for tm in times.flat]
+            ).reshape(times.shape)
+        else:
+            raise ValueError("Time must be a datetime or astropy.Time object")
+
+    # Like datetime.isoformat(), only include microseconds if they're nonzero
+    dt64 = np.asarray(dt64).astype("datetime64[us]")
+    whole = dt64.astype("datetime64[s]")
+    isot = np.where(
+        dt64 == whole,
+        np.datetime_as_string(whole, unit="s"),
+        np.datetime_as_string(dt64, unit="us"),
+    )
+    return np.char.add(isot, "+00:00")
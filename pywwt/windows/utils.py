@@ -4,12 +4,13 @@ import codecs
 import struct
 from datetime import datetime, timedelta
 
-import numpy as np
 import matplotlib.cm as mcm
 from matplotlib.colors import LogNorm, Normalize
 from astropy.utils.console import ProgressBar
 from dateutil import tz, parser
 
+from ..coordinates import xyz_to_spherical
+
 __all__ = ['map_array_to_colors', 'generate_utc_times',
            'convert_xyz_to_spherical', 'write_data_to_csv']
 
@@ -117,11 +118,11 @@ def convert_xyz_to_spherical(x, y, z, is_astro=True, ra_units="degrees"):
 
     Parameters
     ----------
-    x : `numpy.ndarray`
+    x : `numpy.ndarray` or `astropy.units.Quantity`
         The x-coordinates of the data.
-    y : `numpy.ndarray`
+    y : `numpy.ndarray` or `astropy.units.Quantity`
         The y-coordinates of the data.
-    z : `numpy.ndarray`
+    z : `numpy.ndarray` or `astropy.units.Quantity`
         The z-coordinates of the data.
     is_astro : `bool`, optional
         Whether the coordinate system is astronomical (RA, Dec) or geographical
@@ -133,7 +134,8 @@ def convert_xyz_to_spherical(x, y, z, is_astro=True, ra_units="degrees"):
     -------
     spherical : `dict`
         A dict of NumPy arrays corresponding to the positions in spherical
-        coordinates.
+        coordinates. If the positions are quantities, so is the altitude,
+        in the unit of ``x``.
     """
     if ra_units == "degrees" or not is_astro:
         ra_scale = 1.
@@ -145,10 +147,11 @@ def convert_xyz_to_spherical(x, y, z, is_astro=True, ra_units="degrees"):
     else:
         ra_name = "LON"
         dec_name = "LAT"
+    lon, lat, distance = xyz_to_spherical(x, y, z)
     coords = {}
-    coords["ALT"] = np.sqrt(x * x + y * y + z * z)
-    coords[ra_name] = (np.rad2deg(np.arctan2(y, x)) + 180.) * ra_scale
-    coords[dec_name] = np.rad2deg(np.arccos(z / coords["ALT"])) - 90.
+    coords["ALT"] = distance
+    coords[ra_name] = (lon + 180.) * ra_scale
+    coords[dec_name] = -lat
     return coords
 
 
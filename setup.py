@@ -107,6 +107,7 @@ setup_args = dict(
     install_requires=[
         # Keep alphabetized:
         "astropy>=1.0,!=4.0.1",
+        "astropy-healpix",
         "beautifulsoup4",
         "ipyevents",
         "ipywidgets>=7.0.0",
@@ -114,6 +115,7 @@ setup_args = dict(
         "matplotlib>1.5",
         "nest_asyncio",
         "numpy>=1.9",
+        "pyerfa",
         "python-dateutil",
         "pytz",
         "reproject>=0.8",